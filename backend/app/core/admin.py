@@ -0,0 +1,16 @@
+from typing import Optional
+import secrets
+
+from fastapi import Header, HTTPException
+
+from app.core.config import settings
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    # operator endpoints (profiler, per-room listings) need `Authorization: Bearer
+    # <ADMIN_TOKEN>`; with no ADMIN_TOKEN configured they don't exist at all
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(404, "Not found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(401, "Admin token required", headers={"WWW-Authenticate": "Bearer"})
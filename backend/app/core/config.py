@@ -2,7 +2,104 @@
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
-    DATABASE_URL: str
+    # read when the first session is opened, not on import
+    DATABASE_URL: str = ""
+
+    # async engine pool (ignored for SQLite)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    # connections opened in the background on startup, so the first requests don't connect
+    DB_POOL_WARM: int = 2
+    # create missing tables and run data migrations on startup; otherwise run
+    # `python -m app.core.migrations` once per deploy
+    DB_CREATE_SCHEMA: bool = False
+
+    # per-connection outbound queue: frames buffered before a slow client is resynced/dropped
+    WS_OUTBOX_SIZE: int = 256
+    WS_SEND_TIMEOUT: float = 5.0
+
+    # inbound limits per connection and per room: larger messages and clients
+    # that overrun WS_INBOX_SIZE queued messages are disconnected, and handling
+    # is slowed to WS_RATE (WS_ROOM_RATE) messages per second with bursts of
+    # WS_BURST (WS_ROOM_BURST); a rate <= 0 turns that limit off
+    WS_MAX_MESSAGE_BYTES: int = 1024 * 1024
+    WS_INBOX_SIZE: int = 64
+    WS_RATE: float = 50.0
+    WS_BURST: int = 100
+    WS_ROOM_RATE: float = 500.0
+    WS_ROOM_BURST: int = 1000
+
+    # clients connecting with ?features=binary get binary frames: MessagePack ("auto",
+    # when installed) or JSON ("json"), deflated once they reach WS_COMPRESS_MIN_BYTES
+    WS_BINARY_ENCODING: str = "auto"
+    WS_COMPRESS_MIN_BYTES: int = 1024
+    WS_COMPRESS_LEVEL: int = 1
+
+    # clients connecting with ?features=chunked receive documents longer than
+    # SYNC_CHUNK_SIZE characters as SYNC_CHUNK frames of that size; 0 never chunks
+    SYNC_CHUNK_SIZE: int = 64 * 1024
+
+    # write-behind checkpoints of room code: a dirty room is flushed after
+    # CHECKPOINT_INTERVAL seconds or CHECKPOINT_BYTES changed characters
+    CHECKPOINT_INTERVAL: float = 5.0
+    CHECKPOINT_BYTES: int = 64 * 1024
+    CHECKPOINT_BATCH_SIZE: int = 50
+
+    # read-through cache of room metadata (limit, members, last saved hash);
+    # other workers' writes are visible after at most ROOM_CACHE_TTL seconds
+    ROOM_CACHE_SIZE: int = 1024
+    ROOM_CACHE_TTL: float = 30.0
+
+    # saved revisions: a full snapshot at least every REVISION_SNAPSHOT_INTERVAL
+    # revisions, so fetching any revision applies fewer deltas than that
+    REVISION_SNAPSHOT_INTERVAL: int = 20
+
+    # soft target for room state kept in this process, checked every
+    # ROOM_MEMORY_CHECK_INTERVAL seconds: closed rooms stay as cold copies until it
+    # is reached, then live rooms idle for ROOM_IDLE_SECONDS are trimmed to their
+    # document. Documents of rooms with sockets are never evicted, so live rooms
+    # can exceed it; 0 keeps no cold copies and never trims
+    ROOM_MEMORY_BUDGET: int = 256 * 1024 * 1024
+    ROOM_IDLE_SECONDS: float = 60.0
+    ROOM_MEMORY_CHECK_INTERVAL: float = 5.0
+
+    # upper bound on USER_UPDATE broadcasts per second per room
+    PRESENCE_MAX_RATE: float = 4.0
+
+    # room fan-out between processes: "memory" for a single worker, "unix" relays
+    # every room event through a hub on BACKPLANE_SOCKET (uvicorn --workers N)
+    BACKPLANE: str = "memory"
+    BACKPLANE_SOCKET: str = "/tmp/pair-programmer.sock"
+
+    # CPU-bound work on a document of at least CPU_OFFLOAD_BYTES (diffing, hashing,
+    # encoding, parsing, symbol indexing) runs on a pool of CPU_WORKERS: "thread",
+    # "process" or "inline" to keep everything on the event loop
+    CPU_EXECUTOR: str = "thread"
+    CPU_WORKERS: int = 2
+    CPU_OFFLOAD_BYTES: int = 256 * 1024
+
+    # event-loop lag sampled every LOOP_LAG_INTERVAL seconds; stalls of
+    # LOOP_LAG_WARN_SECONDS or more are logged, 0 never warns
+    LOOP_LAG_INTERVAL: float = 0.1
+    LOOP_LAG_WARN_SECONDS: float = 0.25
+
+    # distinct identifiers tracked per room for autocomplete
+    ROOM_SYMBOLS_MAX: int = 5000
+    # distinct accepted completions remembered per room, ranked ahead of the rest of the vocabulary
+    ROOM_ACCEPTED_MAX: int = 500
+
+    # GET /metrics in the Prometheus text format; when off, instrumented paths skip their timers
+    METRICS_ENABLED: bool = True
+    # default seconds between stack samples of POST /metrics/profiler
+    PROFILER_INTERVAL: float = 0.005
+    # bearer token for operator endpoints (the profiler, per-room listings in
+    # /stats); empty leaves them switched off
+    ADMIN_TOKEN: str = ""
+
+    # "auto" uses orjson when it is installed, "json" forces the stdlib
+    JSON_BACKEND: str = "auto"
 
     class Config:
         env_file = ".env"
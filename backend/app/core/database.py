@@ -1,16 +1,89 @@
 # app/core/database.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from typing import Optional
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def async_database_url(url: str) -> str:
+    # DATABASE_URL keeps its usual sync form, the engine needs the async driver
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            # asyncpg spells libpq's sslmode as ssl
+            return url.replace("sslmode=", "ssl=")
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": True}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    return options
+
+
+def upsert_insert(dialect_name: str):
+    # insert() with on_conflict_do_nothing/do_update, for the two backends we run on
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+# built on first use, so importing the app needs no DATABASE_URL and loads no driver
+_engine: Optional[AsyncEngine] = None
+_sessions: Optional[async_sessionmaker] = None
+
+
+def get_engine() -> AsyncEngine:
+    global _engine, _sessions
+    if _engine is None:
+        if not settings.DATABASE_URL:
+            raise RuntimeError("DATABASE_URL is not set")
+        url = async_database_url(settings.DATABASE_URL)
+        _engine = create_async_engine(url, **engine_options(url))
+        _sessions = async_sessionmaker(_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _engine
+
+
+def SessionLocal() -> AsyncSession:
+    get_engine()
+    return _sessions()
+
+
+async def warm_pool(connections: int):
+    # opens pool connections ahead of the first requests; they go back to the pool idle
+    engine = get_engine()
+    if engine.dialect.name == "sqlite":
+        connections = min(connections, 1)
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+
+async def dispose_engine():
+    global _engine, _sessions
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _sessions = None
+
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,146 @@
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CpuExecutor:
+    # CPU-bound room work (diffing, hashing, encoding and parsing big documents,
+    # symbol indexing) at least `offload_bytes` large runs on a pool so the loop
+    # keeps serving other rooms; anything smaller runs inline, where the hop to a
+    # pool would cost more than the job. A thread pool still holds the GIL for pure
+    # Python, but hands the loop a turn every switch interval; hashlib and zlib
+    # release it. A process pool runs in parallel at the price of pickling the
+    # arguments, so jobs are plain module-level functions
+    def __init__(self):
+        self.kind = "inline"
+        self.workers = 2
+        self.offload_bytes = 256 * 1024
+        self._pool: Optional[Executor] = None
+        # (job, "inline" | "offloaded") -> count, and job -> seconds offloaded, queueing included
+        self.jobs: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self.running = 0
+
+    def configure(self, kind: str, workers: int, offload_bytes: int):
+        if kind not in ("inline", "thread", "process"):
+            logger.warning(f"CPU executor {kind!r} is not known, running inline")
+            kind = "inline"
+        self.shutdown()
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.offload_bytes = offload_bytes
+
+    def _executor(self) -> Executor:
+        # started on first use, so a process that never sees a big document has no pool
+        if self._pool is None:
+            if self.kind == "process":
+                # spawned, not forked: the workers inherit no loop, sockets or threads
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu")
+        return self._pool
+
+    def offloads(self, size: int) -> bool:
+        return self.kind != "inline" and size >= self.offload_bytes
+
+    async def run(self, fn: Callable, *args, size: int) -> Any:
+        job = fn.__name__
+        if not self.offloads(size):
+            self.jobs[(job, "inline")] += 1
+            return fn(*args)
+
+        self.jobs[(job, "offloaded")] += 1
+        self.running += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        finally:
+            self.running -= 1
+            self.seconds[job] += time.perf_counter() - start
+
+    def shutdown(self, wait: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "offload_bytes": self.offload_bytes,
+            "running": self.running,
+            "jobs": {f"{job}:{where}": count for (job, where), count in sorted(self.jobs.items())},
+            "offloaded_seconds": {job: round(seconds, 3) for job, seconds in sorted(self.seconds.items())},
+        }
+
+
+class LoopMonitor:
+    # wakes up every `interval` seconds and records how late it did: time the loop
+    # spent on something else without yielding. Stalls past `warn_seconds` are logged
+    def __init__(self):
+        self.interval = 0.1
+        self.warn_seconds = 0.25
+        self.samples: Deque[float] = deque(maxlen=600)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float, warn_seconds: float):
+        self.interval = max(0.001, interval)
+        self.warn_seconds = warn_seconds
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - start - self.interval))
+
+    def record(self, lag: float):
+        self.samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if self.warn_seconds > 0 and lag >= self.warn_seconds:
+            self.stalls += 1
+            logger.warning(f"Event loop stalled for {lag * 1000:.0f} ms")
+
+    def quantiles(self) -> Dict[str, float]:
+        # seconds over the last `samples.maxlen` samples
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "p50": ordered[int(0.5 * len(ordered))],
+            "p99": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))],
+            "max": ordered[-1],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "samples": len(self.samples),
+            "last_ms": round(self.samples[-1] * 1000, 3) if self.samples else 0.0,
+            **{f"{name}_ms": round(value * 1000, 3) for name, value in self.quantiles().items()},
+            "max_since_start_ms": round(self.max_lag * 1000, 3),
+            "stalls": self.stalls,
+        }
+
+
+cpu = CpuExecutor()
+loop_monitor = LoopMonitor()
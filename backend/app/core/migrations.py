@@ -0,0 +1,64 @@
+# app/core/migrations.py
+import asyncio
+import json
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.database import Base, dispose_engine, get_engine, upsert_insert
+from app.models.room import RoomMember
+
+logger = logging.getLogger(__name__)
+
+
+def _legacy_users_column(sync_conn) -> bool:
+    return any(c["name"] == "users" for c in inspect(sync_conn).get_columns("rooms"))
+
+
+async def migrate_room_members(conn: AsyncConnection):
+    # rooms created before room_members kept their members in a JSON `users`
+    # column; copy them over once and clear the column so this runs only once
+    if not await conn.run_sync(_legacy_users_column):
+        return
+
+    rows = (await conn.execute(text("SELECT id, users FROM rooms WHERE users IS NOT NULL"))).all()
+    migrated = 0
+    for room_id, users in rows:
+        if isinstance(users, str):
+            users = json.loads(users)
+        members = []
+        seen = set()
+        for user in users or []:
+            username = user.get("username") if isinstance(user, dict) else None
+            if username and username not in seen:
+                seen.add(username)
+                members.append({"room_id": room_id, "username": username, "online": bool(user.get("online"))})
+        if members:
+            insert = upsert_insert(conn.dialect.name)
+            await conn.execute(insert(RoomMember).values(members).on_conflict_do_nothing())
+            migrated += len(members)
+        await conn.execute(text("UPDATE rooms SET users = NULL WHERE id = :id"), {"id": room_id})
+
+    if rows:
+        logger.info(f"Moved {migrated} members of {len(rows)} rooms into {RoomMember.__tablename__}.")
+
+
+async def create_schema():
+    # missing tables are created, existing ones are left as they are
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await migrate_room_members(conn)
+
+
+async def _migrate():
+    try:
+        await create_schema()
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    # python -m app.core.migrations, once per deploy instead of DB_CREATE_SCHEMA on every start
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_migrate())
+    logger.info("Schema is up to date.")
@@ -0,0 +1,77 @@
+from collections import Counter
+from typing import Any, Dict, Optional
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    # samples the stack of one thread (the event loop's) from a background thread
+    # every `interval` seconds. Nothing runs in the sampled thread, so the cost is
+    # one stack walk per sample and none at all while stopped
+    def __init__(self):
+        self.interval = 0.005
+        self.samples: Counter = Counter()
+        self.total = 0
+        self.started: Optional[float] = None
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float, thread_id: Optional[int] = None):
+        if self.running:
+            self.stop()
+        self.interval = max(0.001, interval)
+        self._target = thread_id if thread_id is not None else threading.get_ident()
+        self.samples.clear()
+        self.total = 0
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started, every {self.interval * 1000:.1f} ms")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Sampling profiler stopped after {self.total} samples")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+            self.total += 1
+
+    def collapsed(self, limit: Optional[int] = None) -> str:
+        # one "frame;frame;frame count" line per stack, the input of flamegraph.pl and speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common(limit))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.total,
+            "stacks": len(self.samples),
+            "seconds": round(time.monotonic() - self.started, 3) if self.started is not None else 0.0,
+        }
+
+
+profiler = SamplingProfiler()
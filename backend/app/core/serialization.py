@@ -0,0 +1,207 @@
+# app/core/serialization.py
+import asyncio
+import json
+import logging
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+Dumps = Callable[[Any], bytes]
+Loads = Callable[[Union[str, bytes]], Any]
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+_backends: Dict[str, Tuple[Dumps, Loads]] = {"json": (_json_dumps, json.loads)}
+if orjson is not None:
+    _backends["orjson"] = (orjson.dumps, orjson.loads)
+
+_dumps: Dumps = _json_dumps
+_loads: Loads = json.loads
+backend_name = "json"
+
+
+def register_backend(name: str, dumps: Dumps, loads: Loads):
+    _backends[name] = (dumps, loads)
+
+
+def use_backend(name: str):
+    # "auto" picks orjson when it is installed and falls back to the stdlib
+    global _dumps, _loads, backend_name
+    if name == "auto":
+        name = "orjson" if "orjson" in _backends else "json"
+    if name not in _backends:
+        logger.warning(f"JSON backend {name!r} is not available, using json")
+        name = "json"
+    _dumps, _loads = _backends[name]
+    backend_name = name
+
+
+def dumps(obj: Any) -> bytes:
+    return _dumps(obj)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    return _loads(data)
+
+
+# binary frames (?features=binary) start with one flags byte, then the payload:
+# MessagePack when FLAG_MSGPACK is set, else UTF-8 JSON, deflated when FLAG_DEFLATE is set
+FLAG_MSGPACK = 0x01
+FLAG_DEFLATE = 0x02
+
+_binary_msgpack = False
+binary_name = "json"
+compress_min_bytes = 1024
+compress_level = 1
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+def use_binary(name: str, min_bytes: int, level: int):
+    # "auto" picks MessagePack when it is installed; payloads of at least
+    # `min_bytes` are deflated, min_bytes <= 0 never compresses
+    global _binary_msgpack, binary_name, compress_min_bytes, compress_level
+    if name == "auto":
+        name = "msgpack" if msgpack is not None else "json"
+    if name == "msgpack" and msgpack is None:
+        logger.warning("Binary encoding 'msgpack' is not available, using json")
+        name = "json"
+    _binary_msgpack = name == "msgpack"
+    binary_name = name
+    compress_min_bytes = min_bytes
+    compress_level = level
+
+
+def _pack(obj: Any, dumps: Dumps, use_msgpack: bool, min_bytes: int, level: int) -> bytes:
+    if use_msgpack:
+        flags, payload = FLAG_MSGPACK, msgpack.packb(obj, use_bin_type=True)
+    else:
+        flags, payload = 0, dumps(obj)
+    if 0 < min_bytes <= len(payload):
+        compressed = zlib.compress(payload, level)
+        if len(compressed) < len(payload):
+            flags, payload = flags | FLAG_DEFLATE, compressed
+    return bytes((flags,)) + payload
+
+
+def pack(obj: Any) -> bytes:
+    return _pack(obj, _dumps, _binary_msgpack, compress_min_bytes, compress_level)
+
+
+def _encode_form(obj: Any, backend: str, binary: Optional[Tuple[bool, int, int]]) -> bytes:
+    # one wire form of a frame from explicit settings, so a pool process builds
+    # the same bytes this one would
+    dumps = _backends.get(backend, _backends["json"])[0]
+    return dumps(obj) if binary is None else _pack(obj, dumps, *binary)
+
+
+def unpack(data: bytes, max_size: int) -> Any:
+    # any client may send binary frames; a deflated payload is never inflated past max_size
+    if not data:
+        raise ValueError("empty binary frame")
+    flags, payload = data[0], data[1:]
+    if flags & FLAG_DEFLATE:
+        inflater = zlib.decompressobj()
+        try:
+            payload = inflater.decompress(payload, max_size)
+        except zlib.error as exc:
+            raise ValueError(f"bad deflate payload: {exc}")
+        if inflater.unconsumed_tail:
+            raise FrameTooLarge(f"inflates past {max_size} bytes")
+    if flags & FLAG_MSGPACK:
+        if msgpack is None:
+            raise ValueError("MessagePack is not available")
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as exc:
+            raise ValueError(f"bad MessagePack payload: {exc}")
+    return _loads(payload)
+
+
+class Frame:
+    # a message encoded at most once per wire format; every recipient is handed the
+    # same buffers, and a format nobody in the room uses is never built
+    __slots__ = ("obj", "size", "_data", "_text", "_binary", "_pending")
+
+    def __init__(self, obj: Any, size: int = 0):
+        self.obj = obj
+        # rough payload size in characters, from the caller, for deciding where to encode it
+        self.size = size
+        self._data: Optional[bytes] = None
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+        self._pending: Optional[Dict[bool, "asyncio.Future[bytes]"]] = None
+
+    async def prepare(self, binary: bool, run: Callable[..., Awaitable[bytes]]):
+        # builds the form a writer needs through `run` (the CPU executor), once
+        # for all the writers waiting on it
+        if (self._binary if binary else self._data) is not None:
+            return
+        if self._pending is None:
+            self._pending = {}
+        pending = self._pending.get(binary)
+        if pending is None:
+            config = (_binary_msgpack, compress_min_bytes, compress_level) if binary else None
+            pending = self._pending[binary] = asyncio.ensure_future(
+                run(_encode_form, self.obj, backend_name, config, size=self.size)
+            )
+        try:
+            # one writer giving up must not cancel the job for the others
+            data = await asyncio.shield(pending)
+        finally:
+            if pending.done() and self._pending.get(binary) is pending:
+                del self._pending[binary]
+        if binary:
+            self._binary = data
+        else:
+            self._data = data
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = _dumps(self.obj)
+        return self._data
+
+    @property
+    def text(self) -> str:
+        # ASGI text frames must be str, decode once and share it
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = pack(self.obj)
+        return self._binary
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def footprint(self) -> int:
+        # bytes held by the forms built so far
+        return sum(len(part) for part in (self._data, self._text, self._binary) if part is not None)
+
+
+def encode(obj: Any, size: int = 0) -> Frame:
+    return Frame(obj, size)
+
+
+use_backend("auto")
+use_binary("auto", compress_min_bytes, compress_level)
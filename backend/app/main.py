@@ -1,13 +1,77 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.core.database import engine, Base
-from app.routers import rooms, autocomplete, websockets
+from app.core.config import settings
+from app.core.database import dispose_engine, warm_pool
+from app.core.executor import cpu, loop_monitor
+from app.core.migrations import create_schema
+from app.core.profiler import profiler
+from app.core.serialization import use_backend, use_binary
+from app.routers import rooms, autocomplete, websockets, stats, metrics
+from app.services.autocomplete_index import get_index
+from app.services.websocket_manager import get_manager
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="Pair Programming App")
+use_backend(settings.JSON_BACKEND)
+use_binary(settings.WS_BINARY_ENCODING, settings.WS_COMPRESS_MIN_BYTES, settings.WS_COMPRESS_LEVEL)
+cpu.configure(settings.CPU_EXECUTOR, settings.CPU_WORKERS, settings.CPU_OFFLOAD_BYTES)
+
+
+async def _timed(name: str, job):
+    # a warm-up step run after startup; requests are served meanwhile and build
+    # whatever they need themselves
+    start = time.perf_counter()
+    try:
+        await job
+        app.state.startup[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    except Exception:
+        logger.exception(f"Startup {name} failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    app.state.startup = {}
+    if settings.DB_CREATE_SCHEMA:
+        try:
+            await create_schema()
+            logger.info("Tables created successfully.")
+        except Exception:
+            logger.exception("Error creating tables")
+
+    loop_monitor.start(settings.LOOP_LAG_INTERVAL, settings.LOOP_LAG_WARN_SECONDS)
+    await get_manager().backplane.start()
+    get_manager().flusher.start()
+    get_manager().store.start()
+    warmups = [
+        asyncio.create_task(_timed("pool_warmed", warm_pool(settings.DB_POOL_WARM))),
+        asyncio.create_task(_timed("index_built", asyncio.to_thread(get_index))),
+    ]
+    app.state.startup["startup_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    yield
+
+    for task in warmups:
+        task.cancel()
+    await get_manager().store.stop()
+    try:
+        await get_manager().flusher.stop()
+        logger.info("Flushed room code on shutdown.")
+    except Exception:
+        logger.exception("Error flushing room code on shutdown")
+    await get_manager().backplane.stop()
+    await loop_monitor.stop()
+    cpu.shutdown(wait=True)
+    profiler.stop()
+    await dispose_engine()
+
+
+app = FastAPI(title="Pair Programming App", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,11 +84,5 @@ app.add_middleware(
 app.include_router(rooms.router)
 app.include_router(autocomplete.router)
 app.include_router(websockets.router)
-
-@app.on_event("startup")
-async def startup_event():
-    try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Tables created successfully.")
-    except Exception:
-        logger.exception("Error creating tables")
\ No newline at end of file
+app.include_router(stats.router)
+app.include_router(metrics.router)
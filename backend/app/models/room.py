@@ -1,5 +1,4 @@
-from sqlalchemy.ext.mutable import MutableList
-from sqlalchemy import Column, String, Text, Integer, JSON, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Index, LargeBinary, String, Text, Integer, DateTime, UniqueConstraint
 from sqlalchemy.sql import func
 from ..core.database import Base
 
@@ -8,8 +7,41 @@ class Room(Base):
 
     id = Column(String, primary_key=True, index=True)
     code = Column(Text, default="")
-    users = Column(MutableList.as_mutable(JSON), default=list)
     name = Column(String, nullable=True)
     limit = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class RoomMember(Base):
+    # one row per user who ever joined a room; ids keep the join order
+    __tablename__ = "room_members"
+    __table_args__ = (
+        UniqueConstraint("room_id", "username", name="uq_room_members_room_user"),
+        Index("ix_room_members_room_online", "room_id", "online"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    room_id = Column(String, ForeignKey("rooms.id", ondelete="CASCADE"), nullable=False)
+    username = Column(String, nullable=False)
+    online = Column(Boolean, nullable=False, default=False)
+    last_seen = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class RoomRevision(Base):
+    # append-only history of saved code: a full snapshot every so often and
+    # compressed deltas against the previous revision in between
+    __tablename__ = "room_revisions"
+    __table_args__ = (
+        UniqueConstraint("room_id", "revision", name="uq_room_revisions_room_revision"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    room_id = Column(String, ForeignKey("rooms.id", ondelete="CASCADE"), nullable=False)
+    revision = Column(Integer, nullable=False)
+    snapshot = Column(Boolean, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    author = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,42 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from app.core import metrics
+from app.core.admin import require_admin
+from app.core.config import settings
+from app.core.profiler import profiler
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+PROMETHEUS_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# async handlers run on the event loop's thread: the collectors read rooms and
+# counters the loop mutates, and the profiler samples that same thread
+
+@router.get("", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    if not metrics.enabled:
+        raise HTTPException(404, "Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_TEXT)
+
+
+@router.post("/profiler", dependencies=[Depends(require_admin)])
+async def toggle_profiler(enabled: bool = Query(...), interval: Optional[float] = Query(None, gt=0, le=1)):
+    if enabled:
+        profiler.start(interval or settings.PROFILER_INTERVAL)
+    else:
+        profiler.stop()
+    return profiler.stats()
+
+
+@router.get("/profiler", dependencies=[Depends(require_admin)])
+async def profiler_stats():
+    return profiler.stats()
+
+
+@router.get("/profiler/stacks", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profiler_stacks(limit: Optional[int] = Query(None, ge=1)):
+    # collapsed stacks of the last or current run, for flamegraph.pl or speedscope
+    return PlainTextResponse(profiler.collapsed(limit))
@@ -1,47 +1,35 @@
 import logging
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.core.database import get_db
-from app.models.room import Room
-from app.schemas.schemas import RoomResponse, SaveRequest
+from app.schemas.schemas import RevisionContent, RevisionSummary, RoomResponse, SaveRequest
+from app.services.revision_service import RevisionService
 from app.services.room_service import RoomService
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.post("/rooms", response_model=RoomResponse)
-def create_room(
+async def create_room(
     username: str = Query(...),
     roomId: str = Query(...),
     limit: int = Query(..., ge=1, le=10),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        existing = db.query(Room).filter(Room.id == roomId).first()
-        if existing:
-            return RoomResponse(
-                roomId=existing.id,
-                users=existing.users or [],
-                limit=existing.limit
-            )
-
-        room = Room(
-            id=roomId,
-            users=[{"username": username, "online": True}],
-            limit=limit
-        )
+        room = await RoomService.get_info(db, roomId)
+        if room is None:
+            room = await RoomService.create_room(db, roomId, username, limit)
 
-        db.add(room)
-        db.commit()
-        db.refresh(room)
         return RoomResponse(
-            roomId=room.id,
-            users=room.users or [],
+            roomId=room.room_id,
+            users=room.users,
             limit=room.limit
         )
     except SQLAlchemyError:
-        db.rollback()
+        await db.rollback()
         logger.exception("SQLAlchemy error while creating room")
         raise HTTPException(500, "Database error")
     except Exception:
@@ -50,17 +38,18 @@ def create_room(
 
 
 @router.get("/rooms/{room_id}", response_model=RoomResponse)
-def get_room(
+async def get_room(
     room_id: str,
     username: str = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        room = RoomService.join_room(db, room_id, username)
+        await RoomService.join_room(db, room_id, username)
+        room = await RoomService.get_info(db, room_id)
 
         return RoomResponse(
-            roomId=room.id,
-            users=room.users or [],
+            roomId=room.room_id,
+            users=room.users,
             limit=room.limit
         )
     except HTTPException:
@@ -71,22 +60,13 @@ def get_room(
 
 
 @router.post("/rooms/save")
-def save_code(payload: SaveRequest, db: Session = Depends(get_db)):
+async def save_code(payload: SaveRequest, db: AsyncSession = Depends(get_db)):
     try:
-        room = db.query(Room).filter(Room.id == payload.roomId).first()
-        if not room:
-            raise HTTPException(404, "Room not found")
-        
-        if (room.code or "").strip() == payload.code.strip():
-            raise HTTPException(304, "No changes")
-
-        room.code = payload.code
-        room.name = payload.username
-        db.commit()
-        return {"message": "Code saved successfully"}
+        revision = await RoomService.save_code(db, payload.roomId, payload.code, payload.username)
+        return {"message": "Code saved successfully", "revision": revision}
 
     except SQLAlchemyError:
-        db.rollback()
+        await db.rollback()
         logger.exception("SQLAlchemy error in save code")
         raise HTTPException(500, "Failed to save code")
     except HTTPException:
@@ -95,22 +75,54 @@ def save_code(payload: SaveRequest, db: Session = Depends(get_db)):
         logger.exception("Unexpected error while saving code")
         raise HTTPException(500, "Unexpected server error")
 
+@router.get("/rooms/{room_id}/revisions", response_model=List[RevisionSummary])
+async def list_revisions(
+    room_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        rows = await RevisionService.history(db, room_id, limit, before)
+        return [
+            RevisionSummary(
+                revision=row.revision,
+                hash=row.content_hash,
+                size=row.size,
+                author=row.author,
+                snapshot=row.snapshot,
+                createdAt=row.created_at
+            )
+            for row in rows
+        ]
+    except Exception:
+        logger.exception("Error listing revisions")
+        raise HTTPException(500, "Failed to list revisions")
+
+
+@router.get("/rooms/{room_id}/revisions/{revision}", response_model=RevisionContent)
+async def get_revision(room_id: str, revision: int, db: AsyncSession = Depends(get_db)):
+    try:
+        found = await RevisionService.fetch(db, room_id, revision)
+        if found is None:
+            raise HTTPException(404, "Revision not found")
+        row, code = found
+        return RevisionContent(roomId=room_id, revision=row.revision, hash=row.content_hash, code=code)
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error fetching revision")
+        raise HTTPException(500, "Failed to fetch revision")
+
+
 @router.patch("/rooms/{room_id}/limit")
-def update_room_limit(
+async def update_room_limit(
     room_id: str,
     new_limit: int = Query(..., ge=1, le=10),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        room = db.query(Room).filter(Room.id == room_id).first()
-        if not room:
-            raise HTTPException(404, "Room not found")
-
-        if new_limit <= room.limit:
-            raise HTTPException(400, "New limit cannot be lower than current limit")
-        room.limit = new_limit
-        db.commit()
-        db.refresh(room)
+        await RoomService.update_limit(db, room_id, new_limit)
         return {"message": "Room limit updated", "limit": new_limit}
     except HTTPException:
         raise
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, Query, Request
+
+from app.core.admin import require_admin
+from app.core.executor import cpu, loop_monitor
+from app.services import inbound
+from app.services.room_cache import get_room_cache
+from app.services.websocket_manager import ConnectionManager, get_manager
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+# async handlers, so they read the rooms and counters on the event loop that
+# changes them instead of from the threadpool
+
+
+@router.get("/connections")
+async def connection_stats(manager: ConnectionManager = Depends(get_manager)):
+    # totals only; anyone who knows a room ID can join it
+    return manager.connection_stats()
+
+
+@router.get("/connections/rooms", dependencies=[Depends(require_admin)])
+async def connection_detail(manager: ConnectionManager = Depends(get_manager)):
+    # per room and connection, for operators
+    return manager.connection_detail()
+
+
+@router.get("/persistence")
+async def persistence_stats(manager: ConnectionManager = Depends(get_manager)):
+    return manager.flusher.stats()
+
+
+@router.get("/memory")
+async def memory_stats(manager: ConnectionManager = Depends(get_manager)):
+    # approximate room state of the process, live and cold
+    return manager.store.stats()
+
+
+@router.get("/memory/rooms", dependencies=[Depends(require_admin)])
+async def memory_rooms(top: int = Query(20, ge=0), manager: ConnectionManager = Depends(get_manager)):
+    # the `top` largest live rooms, for operators
+    return manager.store.largest_rooms(top)
+
+
+@router.get("/inbound")
+async def inbound_stats():
+    # totals over every connection since startup, closed ones included
+    return dict(inbound.totals)
+
+
+@router.get("/loop")
+async def loop_stats():
+    # event-loop lag over the monitor's recent samples, and the CPU jobs kept off the loop
+    return {"loop": loop_monitor.stats(), "cpu": cpu.stats()}
+
+
+@router.get("/startup")
+async def startup_stats(request: Request):
+    # milliseconds spent in startup, and in each background warm-up once it is done
+    return request.app.state.startup
+
+
+@router.get("/room-cache")
+async def room_cache_stats():
+    return get_room_cache().stats()
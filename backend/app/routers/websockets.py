@@ -1,13 +1,14 @@
-import json
 import logging
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy.ext.mutable import MutableDict
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+from pydantic import ValidationError
 
-from app.core.database import get_db
+from app.core import serialization
+from app.core.database import SessionLocal
+from app.schemas.schemas import AutocompleteAccept, AutocompleteRequest
+from app.services.autocomplete_service import AutocompleteService
 from app.services.websocket_manager import ConnectionManager, get_manager
 from app.services.room_service import RoomService
-from app.models.room import Room
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -17,66 +18,82 @@ async def websocket_endpoint(
     websocket: WebSocket, 
     room_id: str, 
     username: str, 
-    db: Session = Depends(get_db),
+    features: str = Query(""),
+    version: Optional[int] = Query(None),
+    epoch: Optional[str] = Query(None),
+    offset: int = Query(0),
     manager: ConnectionManager = Depends(get_manager) 
 ):
+    # clients opt into incremental edits with ?features=delta, into binary
+    # (MessagePack, compressed) frames with ?features=binary and into chunked
+    # snapshots with ?features=chunked. A reconnecting delta client passes the
+    # version and epoch it has (and the offset reached in an unfinished stream)
+    requested = features.split(",")
+    delta = "delta" in requested
+
     try:
-        await manager.connect(room_id, websocket, username)
+        inbox = await manager.connect(
+            room_id, websocket, username, delta=delta, binary="binary" in requested, chunked="chunked" in requested
+        )
     except Exception:
         logger.exception(f"Failed to connect websocket for {username}")
         await websocket.close()
         return
+    if inbox is None:
+        return
 
     try:
+        # a session of its own for the join only; the socket may stay open for
+        # hours and must not hold a pooled connection meanwhile
+        async with SessionLocal() as db:
+            room, members = await RoomService.connect_user(db, room_id, username)
 
-        room = db.query(Room).filter(Room.id == room_id).first()
-        if not room:
-            room = Room(id=room_id, users=[MutableDict({"username": username, "online": True})], limit=5)
-            db.add(room)
-            db.commit()
-        else:
-            users = room.users or []
-            existing = next((u for u in users if u.get("username") == username), None)
-            if existing:
-                existing["online"] = True
-            else:
-                users.append(MutableDict({"username": username, "online": True}))
-                room.users = users
-            db.commit()
-
-        latest_code = manager.get_code(room_id)
-        if latest_code:
-            await websocket.send_json({
-                "type": "CODE_UPDATE", 
-                "code": latest_code, 
-                "sender": "System"
-            })
-        elif room.code:
-            await websocket.send_json({
-                "type": "CODE_UPDATE", 
-                "code": room.code, 
-                "sender": "System"
-            })
-
-        await RoomService.send_user_list(room_id, db, manager)
+        await manager.open_room(room_id, websocket, room.code, members)
+        if delta or manager.get_code(room_id):
+            await manager.send_snapshot(room_id, websocket, version, epoch, offset)
 
-        # 4. Message Loop
+        # 4. Message Loop: frames are read, size-checked and coalesced by the
+        # inbox, and come out here no faster than the rate limits allow
         while True:
             try:
-                raw = await websocket.receive_text()
-                data = json.loads(raw)
+                data = await inbox.get()
+                if data is None:
+                    break
                 msg_type = data.get("type")
 
                 if msg_type == "CODE_UPDATE":
                     code = data.get("code", "")
                     await manager.broadcast_code(room_id, code, websocket)
 
+                elif msg_type == "CODE_DELTA":
+                    await manager.apply_delta(room_id, data.get("version"), data.get("ops"), websocket)
+
+                elif msg_type == "SYNC_REQUEST":
+                    await manager.send_snapshot(room_id, websocket, data.get("version"), data.get("epoch"), data.get("offset", 0))
+
                 elif msg_type == "TYPING_UPDATE":
                     await manager.broadcast_typing(room_id, websocket, data.get("typing", False))
-                    await RoomService.send_user_list(room_id, db, manager)
                 
                 elif msg_type == "USER_UPDATE":
-                     await RoomService.send_user_list(room_id, db, manager)
+                     await manager.send_presence(room_id, websocket)
+
+                elif msg_type == "AUTOCOMPLETE":
+                    # same request as POST /autocomplete, always scoped to this room
+                    try:
+                        request = AutocompleteRequest.model_validate({**data, "roomId": room_id})
+                        result = AutocompleteService.complete(request, manager)
+                    except ValidationError:
+                        result = {"suggestion": "", "suggestions": []}
+                    manager.send_to(room_id, websocket, serialization.encode(
+                        {"type": "AUTOCOMPLETE_RESULT", "requestId": data.get("requestId"), **result}
+                    ))
+
+                elif msg_type == "AUTOCOMPLETE_ACCEPT":
+                    # the suggestion the user picked; ranks it higher in this room, no reply
+                    try:
+                        AutocompleteService.accept(AutocompleteAccept.model_validate({**data, "roomId": room_id}), manager)
+                    except ValidationError:
+                        pass
 
             except WebSocketDisconnect:
                 break
@@ -85,7 +102,5 @@ async def websocket_endpoint(
                 break
 
     finally:
-        await manager.disconnect(room_id, websocket)
-        RoomService.mark_user_offline(db, room_id, username)
-        await RoomService.send_user_list(room_id, db, manager)
-        db.close()
\ No newline at end of file
+        # the room marks the user offline in the DB once its leave has been applied
+        await manager.disconnect(room_id, websocket)
\ No newline at end of file
@@ -1,6 +1,7 @@
 # app/schemas.py
-from pydantic import BaseModel
-from typing import List
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class UserSchema(BaseModel):
     username: str
@@ -13,15 +14,47 @@ class RoomResponse(BaseModel):
 
 
 class AutocompleteRequest(BaseModel):
-    code: str
+    # either code (the document, or just a window ending past the cursor) with
+    # cursorPosition inside it, or roomId + version with cursorPosition in the
+    # server's copy of the room document
+    code: Optional[str] = None
     cursorPosition: int
-    language: str
+    language: str = "python"
+    limit: int = Field(5, ge=1, le=50)
+    roomId: Optional[str] = None
+    version: Optional[int] = None
 
 class AutocompleteResponse(BaseModel):
     suggestion: str
+    suggestions: List[str] = []
+
+
+class AutocompleteAccept(BaseModel):
+    # the suggestion the user picked in a room
+    roomId: str
+    word: str = Field(..., max_length=64)
+
+
+class AutocompleteAcceptResponse(BaseModel):
+    accepted: bool
 
 
 class SaveRequest(BaseModel):
     roomId: str
     username: str
     code: str
+
+
+class RevisionSummary(BaseModel):
+    revision: int
+    hash: str
+    size: int
+    author: Optional[str] = None
+    snapshot: bool
+    createdAt: Optional[datetime] = None
+
+class RevisionContent(BaseModel):
+    roomId: str
+    revision: int
+    hash: str
+    code: str
@@ -0,0 +1,242 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from heapq import heappop, heappush, nsmallest
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+from app.utils.constants import ALL_WORDS
+
+_MAX_CHAR = "\U0010ffff"
+_WORD = re.compile(r"\w+")
+_LEADING_WORD = re.compile(r"\w*")
+_TRAILING_WORD = re.compile(r"\w*\Z")
+_SCAN = 64
+
+
+class PrefixIndex:
+    # words sorted case-insensitively, so a prefix maps to one contiguous range;
+    # a segment tree over that array returns the words of a range that come
+    # first in the original list (keywords, then builtins, ...) in O(k log n)
+    # without scanning it. The ranking is static: picks are counted per room
+    def __init__(self, words: Iterable[str]):
+        unique: Dict[str, Tuple[int, str]] = {}
+        for order, word in enumerate(words):
+            key = word.lower()
+            if word and key not in unique:
+                unique[key] = (order, word)
+
+        self._keys = sorted(unique)
+        self._words = [unique[k][1] for k in self._keys]
+        self._position = {k: i for i, k in enumerate(self._keys)}
+        # position in the original list per word, smaller is better
+        self._rank: List[int] = [unique[k][0] for k in self._keys]
+
+        size = 1
+        while size < len(self._keys):
+            size *= 2
+        self._size = size
+        self._tree = [-1] * (2 * size)
+        for i in range(len(self._keys)):
+            self._tree[size + i] = i
+        for node in range(size - 1, 0, -1):
+            self._tree[node] = self._better(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _better(self, a: int, b: int) -> int:
+        if a < 0:
+            return b
+        if b < 0:
+            return a
+        return a if self._rank[a] <= self._rank[b] else b
+
+    def _best(self, lo: int, hi: int) -> int:
+        best = -1
+        lo += self._size
+        hi += self._size
+        while lo < hi:
+            if lo & 1:
+                best = self._better(best, self._tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = self._better(best, self._tree[hi])
+            lo //= 2
+            hi //= 2
+        return best
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        key = prefix.lower()
+        return bisect_left(self._keys, key), bisect_right(self._keys, key + _MAX_CHAR)
+
+    def top(self, prefix: str, k: int) -> List[str]:
+        lo, hi = self.prefix_range(prefix)
+        if lo >= hi or k <= 0:
+            return []
+
+        results = []
+        heap = []
+        best = self._best(lo, hi)
+        heappush(heap, (self._rank[best], best, lo, hi))
+        while heap and len(results) < k:
+            _, i, a, b = heappop(heap)
+            results.append(self._words[i])
+            for sub_lo, sub_hi in ((a, i), (i + 1, b)):
+                if sub_lo < sub_hi:
+                    sub_best = self._best(sub_lo, sub_hi)
+                    heappush(heap, (self._rank[sub_best], sub_best, sub_lo, sub_hi))
+        return results
+
+    def lookup(self, word: str) -> Optional[str]:
+        # the vocabulary's own spelling of a word, or None when it is not indexed
+        i = self._position.get(word.lower())
+        return self._words[i] if i is not None else None
+
+
+class RoomSymbols:
+    # identifiers used in one room's document, kept in sync edit by edit:
+    # only the words around each changed range are re-tokenized
+    MIN_LENGTH = 2
+    MAX_LENGTH = 64
+
+    def __init__(self, max_symbols: int):
+        self.max_symbols = max_symbols
+        self.counts: Dict[str, int] = {}
+        self._sorted: List[Tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @classmethod
+    def from_counts(cls, max_symbols: int, counts: Dict[str, int]) -> "RoomSymbols":
+        symbols = cls(max_symbols)
+        symbols.counts = dict(counts)
+        symbols._sorted = sorted((word.lower(), word) for word in symbols.counts)
+        return symbols
+
+    def _add(self, word: str):
+        seen = self.counts.get(word)
+        if seen is not None:
+            self.counts[word] = seen + 1
+        elif len(self.counts) < self.max_symbols:
+            # past the cap new names are simply not tracked
+            self.counts[word] = 1
+            insort(self._sorted, (word.lower(), word))
+
+    def _remove(self, word: str):
+        seen = self.counts.get(word)
+        if seen is None:
+            return
+        if seen > 1:
+            self.counts[word] = seen - 1
+            return
+        del self.counts[word]
+        entry = (word.lower(), word)
+        i = bisect_left(self._sorted, entry)
+        if i < len(self._sorted) and self._sorted[i] == entry:
+            del self._sorted[i]
+
+    def _tokens(self, text: str) -> List[str]:
+        return _symbol_tokens(text)
+
+    def add_text(self, text: str):
+        for word in self._tokens(text):
+            self._add(word)
+
+    def remove_text(self, text: str):
+        for word in self._tokens(text):
+            self._remove(word)
+
+    @staticmethod
+    def _word_start(rope, pos: int) -> int:
+        start = pos
+        while start > 0:
+            chunk = rope.slice(max(0, start - _SCAN), start)
+            run = len(_TRAILING_WORD.search(chunk).group())
+            start -= run
+            if run < len(chunk):
+                break
+        return start
+
+    @staticmethod
+    def _word_end(rope, pos: int) -> int:
+        end = pos
+        while end < len(rope):
+            chunk = rope.slice(end, end + _SCAN)
+            run = _LEADING_WORD.match(chunk).end()
+            end += run
+            if run < len(chunk):
+                break
+        return end
+
+    def before_edit(self, rope, op) -> Tuple[int, int]:
+        # widen the edited range to whole words and forget what was there
+        start = self._word_start(rope, op.pos)
+        end = self._word_end(rope, op.pos + op.delete)
+        self.remove_text(rope.slice(start, end))
+        return start, end
+
+    def after_edit(self, rope, op, span: Tuple[int, int]):
+        start, end = span
+        self.add_text(rope.slice(start, end - op.delete + len(op.insert)))
+
+    def top(self, prefix: str, k: int) -> List[str]:
+        key = prefix.lower()
+        lo = bisect_left(self._sorted, (key,))
+        hi = bisect_left(self._sorted, (key + _MAX_CHAR,))
+        # the word being typed is in the document too, never suggest it back
+        candidates = (word for _, word in self._sorted[lo:hi] if word != prefix)
+        return nsmallest(k, candidates, key=lambda w: (-self.counts[w], w.lower()))
+
+
+def _symbol_tokens(text: str) -> List[str]:
+    return [
+        w for w in _WORD.findall(text)
+        if RoomSymbols.MIN_LENGTH <= len(w) <= RoomSymbols.MAX_LENGTH and not w[0].isdigit()
+    ]
+
+
+def symbol_counts(text: str, max_symbols: int) -> Dict[str, int]:
+    # what RoomSymbols.add_text would count for a whole document, as a plain dict
+    # a pool worker can hand back: the first max_symbols distinct names
+    return dict(islice(Counter(_symbol_tokens(text)).items(), max_symbols))
+
+
+def word_before(text: str, cursor: int) -> str:
+    # the identifier characters immediately left of the cursor
+    i = cursor - 1
+    while i >= 0 and (text[i].isalnum() or text[i] == "_"):
+        i -= 1
+    return text[i + 1 : cursor]
+
+
+_static_index: Optional[PrefixIndex] = None
+
+
+def get_index() -> PrefixIndex:
+    # built once, on startup or on the first autocomplete request
+    global _static_index
+    if _static_index is None:
+        _static_index = PrefixIndex(ALL_WORDS)
+    return _static_index
+
+
+def suggest(
+    prefix: str, k: int, symbols: Optional[RoomSymbols] = None, accepted: Optional[RoomSymbols] = None
+) -> List[str]:
+    # names from the room's own code come first, then the vocabulary words the
+    # room has accepted before, then the rest of the static vocabulary
+    results = symbols.top(prefix, k) if symbols is not None else []
+    seen = {w.lower() for w in results}
+    for source in (accepted, get_index()):
+        if source is None or len(results) == k:
+            continue
+        for word in source.top(prefix, k):
+            if word.lower() not in seen:
+                seen.add(word.lower())
+                results.append(word)
+                if len(results) == k:
+                    break
+    return results
@@ -0,0 +1,43 @@
+from typing import Any, Dict, Optional
+
+from app.core import metrics
+from app.schemas.schemas import AutocompleteAccept, AutocompleteRequest
+from app.services.autocomplete_index import get_index, suggest, word_before
+
+AUTOCOMPLETE_SECONDS = metrics.Histogram("pair_autocomplete_seconds", "Time to answer an autocomplete request.")
+
+
+class AutocompleteService:
+
+    @staticmethod
+    def prefix(request: AutocompleteRequest, manager) -> Optional[str]:
+        if request.code is not None:
+            if request.cursorPosition < 0 or request.cursorPosition > len(request.code):
+                return None
+            return word_before(request.code, request.cursorPosition)
+        if request.roomId:
+            return manager.prefix_at(request.roomId, request.cursorPosition, request.version)
+        return None
+
+    @staticmethod
+    @metrics.timed(AUTOCOMPLETE_SECONDS)
+    def complete(request: AutocompleteRequest, manager) -> Dict[str, Any]:
+        prefix = AutocompleteService.prefix(request, manager)
+        if not prefix:
+            return {"suggestion": "", "suggestions": []}
+
+        symbols, accepted = None, None
+        if request.roomId:
+            symbols, accepted = manager.room_symbols(request.roomId), manager.room_accepted(request.roomId)
+        suggestions = suggest(prefix, request.limit, symbols, accepted)
+
+        return {"suggestion": suggestions[0] if suggestions else "", "suggestions": suggestions}
+
+    @staticmethod
+    def accept(request: AutocompleteAccept, manager) -> bool:
+        # only a suggestion the user picked counts as a use, and only in its own
+        # room; words outside the static vocabulary are ranked by the room's code
+        word = get_index().lookup(request.word)
+        if word is None:
+            return False
+        return manager.accept_completion(request.roomId, word)
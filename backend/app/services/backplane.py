@@ -0,0 +1,376 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple
+from itertools import count
+import asyncio
+import logging
+import os
+import sys
+import uuid
+
+from app.core import serialization
+from app.core.executor import cpu
+
+logger = logging.getLogger(__name__)
+
+
+class Backplane(ABC):
+    # orders room events for every process serving the room. Each node keeps a
+    # replica of the room and applies the same events in the same order, its own
+    # included, so published events only take effect once they come back through
+    # handler.deliver(). The handler (ConnectionManager) provides:
+    #   deliver(room_id, event)         apply one event
+    #   install(room_id, state)         seed a joined room, state is None for the first node
+    #   request_state(room_id, reply)   reply(state) for a node joining later, taken
+    #                                   after every event delivered before the request
+    #   backplane_lost()                the relay went away, local rooms must be dropped
+    def __init__(self, handler):
+        self.handler = handler
+        self.node_id = uuid.uuid4().hex
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def join(self, room_id: str):
+        ...
+
+    @abstractmethod
+    async def leave(self, room_id: str):
+        ...
+
+    @abstractmethod
+    async def publish(self, room_id: str, event: Dict[str, Any]):
+        ...
+
+
+class LocalBackplane(Backplane):
+    # single process: events are applied as they are published
+    async def join(self, room_id: str):
+        self.handler.install(room_id, None)
+
+    async def leave(self, room_id: str):
+        pass
+
+    async def publish(self, room_id: str, event: Dict[str, Any]):
+        self.handler.deliver(room_id, event)
+
+
+def _line(message: Dict[str, Any]) -> bytes:
+    return serialization.dumps(message) + b"\n"
+
+
+def _write(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    writer.write(_line(message))
+
+
+def _event_size(event: Dict[str, Any]) -> int:
+    # characters of code an edit carries, to decide where it is encoded
+    return len(event.get("code") or "") + sum(len(op.get("insert") or "") for op in event.get("ops") or ())
+
+
+def _hub_lock(path: str, block: bool):
+    # whoever holds the lock file owns the hub socket. fcntl is POSIX only and
+    # imported here, so BACKPLANE=memory still runs on Windows
+    import fcntl
+
+    lock_file = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class BackplaneHub:
+    # the sequencer behind UnixBackplane: one line-delimited JSON stream per node,
+    # every room event goes out to the room's nodes in the order it came in
+    def __init__(self):
+        self.nodes: Dict[str, asyncio.StreamWriter] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+        # (room, joining node) -> (node asked for the room state, join ref)
+        self.pending: Dict[Tuple[str, str], Tuple[str, int]] = {}
+
+    async def serve(self, path: str) -> asyncio.AbstractServer:
+        if os.path.exists(path):
+            os.unlink(path)
+        return await asyncio.start_unix_server(self._handle, path=path, limit=2 ** 24)
+
+    def _send(self, node: str, message: Dict[str, Any]):
+        writer = self.nodes.get(node)
+        if writer is not None and not writer.is_closing():
+            _write(writer, message)
+
+    def _ask_for_state(self, room_id: str, joining: str, ref: int, skip: Set[str]):
+        holders = [n for n in self.rooms.get(room_id, ()) if n != joining and n not in skip]
+        if holders:
+            self.pending[(room_id, joining)] = (holders[0], ref)
+            self._send(holders[0], {"op": "state_request", "room": room_id, "for": joining, "ref": ref, "skip": sorted(skip)})
+        else:
+            self._send(joining, {"op": "state", "room": room_id, "ref": ref, "state": None})
+
+    def _publish(self, room_id: str, event: Dict[str, Any]):
+        self._fanout(room_id, _line({"op": "event", "room": room_id, "event": event}))
+
+    def _fanout(self, room_id: str, data: bytes):
+        # encoded once for every node of the room
+        for node in self.rooms.get(room_id, ()):
+            writer = self.nodes.get(node)
+            if writer is not None and not writer.is_closing():
+                writer.write(data)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        node = None
+        try:
+            hello = serialization.loads(await reader.readline())
+            node = hello["node"]
+            self.nodes[node] = writer
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = await cpu.run(serialization.loads, line, size=len(line))
+                op = message.get("op")
+                room_id = message.get("room")
+
+                if op == "publish":
+                    # the event is sequenced when it goes out, to the room's nodes at that point
+                    data = await cpu.run(_line, {"op": "event", "room": room_id, "event": message["event"]}, size=len(line))
+                    self._fanout(room_id, data)
+                elif op == "join":
+                    self.rooms.setdefault(room_id, set()).add(node)
+                    # the node now sees every later event; the state it starts
+                    # from is taken by a holder at exactly this point of the stream
+                    self._send(node, {"op": "joined", "room": room_id, "ref": message["ref"]})
+                    self._ask_for_state(room_id, node, message["ref"], set())
+                elif op == "leave":
+                    members = self.rooms.get(room_id)
+                    if members is not None:
+                        members.discard(node)
+                        if not members:
+                            del self.rooms[room_id]
+                elif op == "state":
+                    joining = message["for"]
+                    ref = message["ref"]
+                    if self.pending.get((room_id, joining), (None, None))[1] != ref:
+                        continue
+                    del self.pending[(room_id, joining)]
+                    state = message.get("state")
+                    if (state is None or not state.get("live")) and joining in self.rooms.get(room_id, ()):
+                        # a holder that already closed the room only has its last code;
+                        # prefer a live replica when there still is one
+                        skip = set(message.get("skip") or ()) | {node}
+                        if any(n not in skip and n != joining for n in self.rooms[room_id]):
+                            self._ask_for_state(room_id, joining, ref, skip)
+                            continue
+                    self._send(joining, {"op": "state", "room": room_id, "ref": ref, "state": state})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Backplane hub connection failed")
+        finally:
+            if node is not None:
+                self._node_gone(node)
+            writer.close()
+
+    def _node_gone(self, node: str):
+        self.nodes.pop(node, None)
+        for room_id in [r for r, members in self.rooms.items() if node in members]:
+            self.rooms[room_id].discard(node)
+            if self.rooms[room_id]:
+                self._publish(room_id, {"kind": "node_gone", "node": node})
+            else:
+                del self.rooms[room_id]
+        for (room_id, joining), (holder, ref) in list(self.pending.items()):
+            if joining == node:
+                del self.pending[(room_id, joining)]
+            elif holder == node:
+                del self.pending[(room_id, joining)]
+                self._ask_for_state(room_id, joining, ref, {node})
+
+
+class UnixBackplane(Backplane):
+    # relays through a BackplaneHub on a Unix socket; the first worker to take
+    # the lock file hosts the hub, so `uvicorn --workers N` needs nothing else
+    RETRY_DELAY = 1.0
+
+    def __init__(self, handler, path: str):
+        super().__init__(handler)
+        self.path = path
+        self._lock_file = None
+        self._hub_server: Optional[asyncio.AbstractServer] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        # room -> (join ref, started, future, events buffered until the state arrives)
+        self._joining: Dict[str, List[Any]] = {}
+        self._refs = count(1)
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        await self._connect()
+
+    async def stop(self):
+        self._stopping = True
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._hub_server:
+            self._hub_server.close()
+            self._hub_server = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _host_hub(self):
+        if self._lock_file is None:
+            self._lock_file = _hub_lock(self.path, block=False)
+            if self._lock_file is None:
+                return
+        if self._hub_server is None:
+            self._hub_server = await BackplaneHub().serve(self.path)
+            logger.info(f"Backplane hub listening on {self.path}")
+
+    async def _connect(self):
+        while True:
+            await self._host_hub()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 24)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # another worker holds the lock and is still starting its hub
+                await asyncio.sleep(0.1)
+        _write(writer, {"op": "hello", "node": self.node_id})
+        await writer.drain()
+        self._writer = writer
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _send(self, message: Dict[str, Any], size: int = 0):
+        writer = self._writer
+        if writer is None:
+            raise ConnectionError("backplane is not connected")
+        writer.write(await cpu.run(_line, message, size=size))
+        await writer.drain()
+
+    async def join(self, room_id: str):
+        ref = next(self._refs)
+        previous = self._joining.get(room_id)
+        if previous is not None and not previous[2].done():
+            # a room closed and reopened before its first join finished
+            previous[2].set_exception(ConnectionError("join superseded"))
+        future = asyncio.get_running_loop().create_future()
+        joining = self._joining[room_id] = [ref, False, future, []]
+        try:
+            await self._send({"op": "join", "room": room_id, "ref": ref})
+            await future
+        finally:
+            if self._joining.get(room_id) is joining:
+                del self._joining[room_id]
+
+    async def leave(self, room_id: str):
+        await self._send({"op": "leave", "room": room_id})
+
+    async def publish(self, room_id: str, event: Dict[str, Any]):
+        await self._send({"op": "publish", "room": room_id, "event": event}, _event_size(event))
+
+    def _dispatch(self, message: Dict[str, Any]):
+        op = message.get("op")
+        room_id = message.get("room")
+
+        if op == "event":
+            joining = self._joining.get(room_id)
+            if joining is None:
+                self.handler.deliver(room_id, message["event"])
+            elif joining[1]:
+                # sequenced after our join, applied once the room state is in
+                joining[3].append(message["event"])
+            # else: left over from an earlier subscription to the room, already superseded
+        elif op == "joined":
+            joining = self._joining.get(room_id)
+            if joining is not None and joining[0] == message["ref"]:
+                joining[1] = True
+        elif op == "state":
+            joining = self._joining.get(room_id)
+            if joining is None or joining[0] != message["ref"]:
+                return
+            del self._joining[room_id]
+            _, _, future, buffered = joining
+            self.handler.install(room_id, message["state"])
+            for event in buffered:
+                self.handler.deliver(room_id, event)
+            if not future.done():
+                future.set_result(None)
+        elif op == "state_request":
+            writer = self._writer
+
+            def reply(state):
+                if writer is self._writer and not writer.is_closing():
+                    _write(writer, {
+                        "op": "state",
+                        "room": room_id,
+                        "for": message["for"],
+                        "ref": message["ref"],
+                        "skip": message.get("skip"),
+                        "state": state,
+                    })
+
+            self.handler.request_state(room_id, reply)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self._dispatch(await cpu.run(serialization.loads, line, size=len(line)))
+                except Exception:
+                    logger.exception("Failed to apply backplane message")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        if self._stopping:
+            return
+
+        logger.error("Lost the backplane hub, dropping local rooms")
+        self._writer = None
+        for _, _, future, _ in self._joining.values():
+            if not future.done():
+                future.set_exception(ConnectionError("backplane hub went away"))
+        self._joining.clear()
+        self.handler.backplane_lost()
+        await asyncio.sleep(self.RETRY_DELAY)
+        try:
+            await self._connect()
+        except Exception:
+            logger.exception("Failed to reconnect to the backplane hub")
+
+
+def create_backplane(handler, kind: str, path: str) -> Backplane:
+    if kind == "memory":
+        return LocalBackplane(handler)
+    if kind == "unix":
+        return UnixBackplane(handler, path)
+    raise ValueError(f"unknown backplane {kind!r}")
+
+
+async def _serve_forever(path: str):
+    lock_file = _hub_lock(path, block=True)
+    server = await BackplaneHub().serve(path)
+    async with server:
+        await server.serve_forever()
+    lock_file.close()
+
+
+if __name__ == "__main__":
+    # standalone hub, for when the workers should not host it themselves
+    asyncio.run(_serve_forever(sys.argv[1] if len(sys.argv) > 1 else "/tmp/pair-programmer.sock"))
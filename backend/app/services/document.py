@@ -0,0 +1,160 @@
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 2048
+
+
+def validate_ops(ops: Any) -> List[Dict[str, Any]]:
+    if not isinstance(ops, list):
+        raise ValueError("ops must be a list")
+
+    cleaned = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("op must be an object")
+
+        pos = op.get("pos")
+        delete = op.get("delete", 0)
+        insert = op.get("insert", "")
+
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise ValueError("op.pos must be a non-negative integer")
+        if not isinstance(delete, int) or isinstance(delete, bool) or delete < 0:
+            raise ValueError("op.delete must be a non-negative integer")
+        if not isinstance(insert, str):
+            raise ValueError("op.insert must be a string")
+
+        if delete or insert:
+            cleaned.append({"pos": pos, "delete": delete, "insert": insert})
+    return cleaned
+
+
+def _common_prefix(a: str, b: str) -> int:
+    # binary search over slice comparisons keeps the scan in C
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def diff(old: str, new: str) -> Optional[Tuple[int, int, str]]:
+    if old == new:
+        return None
+
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    return prefix, len(old) - prefix - suffix, new[prefix:len(new) - suffix]
+
+
+class Rope:
+    # the document is kept as a list of bounded chunks so an edit only
+    # rebuilds the chunk it touches; the joined text is built on demand
+    __slots__ = ("_chunks", "_starts", "_length", "_text")
+
+    def __init__(self, text: str = ""):
+        self._chunks = self._split(text)
+        self._starts: Optional[List[int]] = None
+        self._length = len(text)
+        self._text: Optional[str] = text
+
+    @staticmethod
+    def _split(text: str) -> List[str]:
+        return [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = "".join(self._chunks)
+        return self._text
+
+    def footprint(self) -> Tuple[int, int]:
+        # approximate bytes of the chunks, and of the joined text while it is cached
+        cached = self._length if self._text is not None and self._chunks else 0
+        return self._length + 56 * len(self._chunks), cached
+
+    def forget_text(self):
+        # drops the cached joined text, the chunks are kept
+        if self._chunks:
+            self._text = None
+
+    def _changed(self, delta: int):
+        self._length += delta
+        self._starts = None
+        self._text = None
+
+    def _locate(self, pos: int) -> Tuple[int, int]:
+        if self._starts is None:
+            self._starts = [0]
+            self._starts.extend(accumulate(len(c) for c in self._chunks[:-1]))
+        idx = bisect_right(self._starts, pos) - 1
+        return idx, pos - self._starts[idx]
+
+    def slice(self, start: int, end: int) -> str:
+        start, end = max(0, start), min(end, self._length)
+        if start >= end:
+            return ""
+        if self._text is not None:
+            return self._text[start:end]
+
+        i, oi = self._locate(start)
+        j, oj = self._locate(end)
+        if i == j:
+            return self._chunks[i][oi:oj]
+        return self._chunks[i][oi:] + "".join(self._chunks[i + 1:j]) + self._chunks[j][:oj]
+
+    def insert(self, pos: int, text: str):
+        if not text:
+            return
+        if pos < 0 or pos > self._length:
+            raise ValueError("insert position outside of document")
+
+        if not self._chunks:
+            self._chunks = self._split(text)
+        else:
+            idx, off = self._locate(pos)
+            chunk = self._chunks[idx]
+            merged = chunk[:off] + text + chunk[off:]
+            self._chunks[idx:idx + 1] = [merged] if len(merged) <= 2 * CHUNK_SIZE else self._split(merged)
+        self._changed(len(text))
+
+    def delete(self, pos: int, length: int):
+        if length <= 0:
+            return
+        if pos < 0 or pos + length > self._length:
+            raise ValueError("delete range outside of document")
+
+        i, oi = self._locate(pos)
+        j, oj = self._locate(pos + length)
+        merged = self._chunks[i][:oi] + self._chunks[j][oj:]
+
+        # fold small leftovers into the next chunk so the list stays short
+        if len(merged) < CHUNK_SIZE // 2 and j + 1 < len(self._chunks):
+            j += 1
+            merged += self._chunks[j]
+
+        if not merged:
+            replacement = []
+        elif len(merged) <= 2 * CHUNK_SIZE:
+            replacement = [merged]
+        else:
+            replacement = self._split(merged)
+        self._chunks[i:j + 1] = replacement
+        self._changed(-length)
@@ -0,0 +1,216 @@
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+import logging
+import time
+
+from app.core import serialization
+from app.core.executor import cpu
+
+logger = logging.getLogger(__name__)
+
+# close codes sent when a client breaks the inbound limits
+CLOSE_MALFORMED = 1007
+CLOSE_FLOOD = 1008
+CLOSE_TOO_BIG = 1009
+
+# message types where only the newest queued one matters
+COALESCED = ("CODE_UPDATE", "TYPING_UPDATE", "SYNC_REQUEST", "USER_UPDATE")
+
+# counters over every connection of this process, closed ones included
+totals: Counter = Counter()
+
+
+class TokenBucket:
+    # `rate` messages per second with bursts of up to `burst`; rate <= 0 is unlimited
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        # takes a token and returns 0 when one is available, else the seconds until there is
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class InboundQueue:
+    # frames read from one socket and not handled yet. A reader task keeps
+    # receiving while the handler waits on the rate limits, so a flood of
+    # full-text updates collapses into the newest one here; a client that
+    # overruns the queue anyway is disconnected
+    __slots__ = (
+        "socket", "max_bytes", "max_depth", "bucket", "room_bucket",
+        "_messages", "_waiter", "_task", "closed",
+        "received", "coalesced", "throttled", "throttled_ms", "rejected",
+    )
+
+    def __init__(
+        self,
+        socket: WebSocket,
+        max_bytes: int,
+        max_depth: int,
+        bucket: TokenBucket,
+        room_bucket: Optional[TokenBucket] = None,
+    ):
+        self.socket = socket
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.bucket = bucket
+        self.room_bucket = room_bucket
+
+        # both only exist while there is something to hold, idle sockets are common
+        self._messages: Optional[Deque[Dict[str, Any]]] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.received = 0
+        self.coalesced = 0
+        self.throttled = 0
+        self.throttled_ms = 0.0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages) if self._messages else 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._read())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "throttled": self.throttled,
+            "throttled_ms": round(self.throttled_ms, 3),
+            "rejected": self.rejected,
+        }
+
+    async def _read(self):
+        try:
+            while not self.closed:
+                frame = await self.socket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    return
+                self.received += 1
+                totals["received"] += 1
+                # text frames are JSON; binary ones carry their encoding in a flags byte.
+                # Text is measured in characters, which costs nothing and is at most its UTF-8 size
+                text = frame.get("text")
+                raw = text if text is not None else frame.get("bytes") or b""
+                if len(raw) > self.max_bytes:
+                    await self.reject(CLOSE_TOO_BIG, f"message larger than {self.max_bytes} bytes")
+                    return
+                try:
+                    # large messages are parsed on the CPU pool
+                    if text is not None:
+                        message = await cpu.run(serialization.loads, raw, size=len(raw))
+                    else:
+                        message = await cpu.run(serialization.unpack, raw, self.max_bytes, size=len(raw))
+                except serialization.FrameTooLarge:
+                    await self.reject(CLOSE_TOO_BIG, f"message larger than {self.max_bytes} bytes")
+                    return
+                except ValueError:
+                    message = None
+                if not isinstance(message, dict):
+                    await self.reject(CLOSE_MALFORMED, "message is not a JSON or MessagePack object")
+                    return
+                if not self.put(message):
+                    await self.reject(CLOSE_FLOOD, "too many messages")
+                    return
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            logger.exception("Websocket reader failed")
+        finally:
+            self.closed = True
+            self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def put(self, message: Dict[str, Any]) -> bool:
+        if self._messages is None:
+            self._messages = deque()
+        kind = message.get("type")
+        if kind in COALESCED:
+            for queued in self._messages:
+                if queued.get("type") == kind:
+                    self._messages.remove(queued)
+                    self.coalesced += 1
+                    totals["coalesced"] += 1
+                    break
+        if len(self._messages) >= self.max_depth:
+            return False
+        self._messages.append(message)
+        self._wake()
+        return True
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        # the next message once both rate limits allow it; None when the socket is done
+        while not self._messages:
+            if self.closed:
+                return None
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        waited = 0.0
+        for bucket in (self.bucket, self.room_bucket):
+            while bucket is not None:
+                delay = bucket.delay()
+                if delay <= 0:
+                    break
+                waited += delay
+                await asyncio.sleep(delay)
+        if waited:
+            self.throttled += 1
+            self.throttled_ms += waited * 1000
+            totals["throttled"] += 1
+
+        # a newer message may have replaced this one while we waited
+        if not self._messages:
+            return await self.get()
+        message = self._messages.popleft()
+        if not self._messages:
+            self._messages = None
+        return message
+
+    async def reject(self, code: int, reason: str):
+        logger.warning(f"Closing websocket with {code}: {reason}")
+        self.rejected += 1
+        totals[f"closed_{code}"] += 1
+        self.closed = True
+        self._messages = None
+        self._wake()
+        try:
+            await self.socket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self._wake()
+        task = self._task
+        if task and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
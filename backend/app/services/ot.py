@@ -0,0 +1,195 @@
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import uuid
+
+from app.services.document import Rope, diff
+
+DEFAULT_HISTORY = 500
+
+
+class Op(NamedTuple):
+    # a primitive edit: either an insert (delete == 0) or a delete (insert == "")
+    pos: int
+    delete: int
+    insert: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"pos": self.pos, "delete": self.delete, "insert": self.insert}
+
+
+class StaleVersionError(Exception):
+    pass
+
+
+def to_primitives(ops: List[Dict[str, Any]]) -> List[Op]:
+    primitives = []
+    for op in ops:
+        if op["delete"]:
+            primitives.append(Op(op["pos"], op["delete"], ""))
+        if op["insert"]:
+            primitives.append(Op(op["pos"], 0, op["insert"]))
+    return primitives
+
+
+def _transform_pair(a: Op, b: Op) -> Tuple[List[Op], List[Op]]:
+    # returns (a applied after b, b applied after a); on an insert tie b goes first
+    if a.insert and b.insert:
+        if a.pos < b.pos:
+            return [a], [b._replace(pos=b.pos + len(a.insert))]
+        return [a._replace(pos=a.pos + len(b.insert))], [b]
+
+    if a.insert:
+        b_end = b.pos + b.delete
+        if a.pos <= b.pos:
+            return [a], [b._replace(pos=b.pos + len(a.insert))]
+        if a.pos >= b_end:
+            return [a._replace(pos=a.pos - b.delete)], [b]
+        head = a.pos - b.pos
+        return [a._replace(pos=b.pos)], [
+            Op(b.pos, head, ""),
+            Op(b.pos + len(a.insert), b.delete - head, ""),
+        ]
+
+    if b.insert:
+        b_prime, a_prime = _transform_pair(b, a)
+        return a_prime, b_prime
+
+    a_end, b_end = a.pos + a.delete, b.pos + b.delete
+    if a_end <= b.pos:
+        return [a], [b._replace(pos=b.pos - a.delete)]
+    if a.pos >= b_end:
+        return [a._replace(pos=a.pos - b.delete)], [b]
+
+    overlap = min(a_end, b_end) - max(a.pos, b.pos)
+    start = min(a.pos, b.pos)
+    a_left, b_left = a.delete - overlap, b.delete - overlap
+    return (
+        [Op(start, a_left, "")] if a_left else [],
+        [Op(start, b_left, "")] if b_left else [],
+    )
+
+
+def _transform_one(a: Op, bs: List[Op]) -> Tuple[List[Op], List[Op]]:
+    a_out, b_out = [a], []
+    for b in bs:
+        a_out, b_part = _transform_many(a_out, b)
+        b_out.extend(b_part)
+    return a_out, b_out
+
+
+def _transform_many(a_ops: List[Op], b: Op) -> Tuple[List[Op], List[Op]]:
+    a_out, b_out = [], [b]
+    for a in a_ops:
+        if len(b_out) == 1:
+            a_part, b_out = _transform_pair(a, b_out[0])
+        else:
+            a_part, b_out = _transform_one(a, b_out)
+        a_out.extend(a_part)
+    return a_out, b_out
+
+
+def transform(a_ops: List[Op], b_ops: List[Op]) -> Tuple[List[Op], List[Op]]:
+    # both sequences start from the same state; returns (a after b, b after a)
+    b_out = []
+    for b in b_ops:
+        a_ops, b_part = _transform_many(a_ops, b)
+        b_out.extend(b_part)
+    return a_ops, b_out
+
+
+class MergeEngine:
+    # server-ordered OT: every accepted op list gets the next version and is
+    # kept in a bounded log so edits made against older versions can be rebased
+    __slots__ = ("rope", "version", "epoch", "_log", "observer")
+
+    def __init__(
+        self,
+        text: str = "",
+        version: int = 0,
+        history: int = DEFAULT_HISTORY,
+        observer=None,
+        log: Iterable[List[Op]] = (),
+        epoch: Optional[str] = None,
+    ):
+        self.rope = Rope(text)
+        self.version = version
+        # names this line of versions: a document rebuilt from saved code starts
+        # over at version 0 under a new epoch, so old versions can't be mistaken for it
+        self.epoch = epoch or uuid.uuid4().hex[:12]
+        self._log: deque = deque(log, maxlen=history)
+        # optional before_edit/after_edit hooks that see the rope around each primitive
+        self.observer = observer
+
+    @property
+    def text(self) -> str:
+        return str(self.rope)
+
+    @property
+    def length(self) -> int:
+        # not __len__: an empty document must still be truthy next to a missing one
+        return len(self.rope)
+
+    def log_entries(self) -> List[List[Op]]:
+        return list(self._log)
+
+    def log_size(self) -> int:
+        return len(self._log)
+
+    def trim_log(self):
+        # edits against an older version than the current one now need a resync
+        self._log.clear()
+
+    def ops_since(self, version: int) -> List[List[Op]]:
+        behind = self.version - version
+        if behind < 0 or behind > len(self._log):
+            raise StaleVersionError(f"version {version} is not in the op log")
+        return list(islice(self._log, len(self._log) - behind, None))
+
+    def rebase_position(self, version: int, pos: int) -> int:
+        # moves a position seen at an older version past everything applied since
+        for ops in self.ops_since(version):
+            for op in ops:
+                if op.delete:
+                    if pos > op.pos:
+                        pos -= min(op.delete, pos - op.pos)
+                elif op.pos < pos:
+                    pos += len(op.insert)
+        return pos
+
+    def _apply(self, ops: List[Op]) -> List[Op]:
+        length = len(self.rope)
+        for op in ops:
+            if op.pos + op.delete > length:
+                raise ValueError("op range outside of document")
+            length += len(op.insert) - op.delete
+
+        observer = self.observer
+        for op in ops:
+            span = observer.before_edit(self.rope, op) if observer is not None else None
+            if op.delete:
+                self.rope.delete(op.pos, op.delete)
+            else:
+                self.rope.insert(op.pos, op.insert)
+            if observer is not None:
+                observer.after_edit(self.rope, op, span)
+
+        self.version += 1
+        self._log.append(ops)
+        return ops
+
+    def submit(self, base_version: int, ops: List[Op]) -> List[Op]:
+        for concurrent in self.ops_since(base_version):
+            ops, _ = transform(ops, concurrent)
+        return self._apply(ops)
+
+    def replace(self, text: str) -> List[Op]:
+        return self.apply_change(diff(self.text, text))
+
+    def apply_change(self, change: Optional[Tuple[int, int, str]]) -> List[Op]:
+        # a diff() of the current text, possibly computed off the loop
+        if change is None:
+            return []
+
+        pos, delete, insert = change
+        return self._apply(to_primitives([{"pos": pos, "delete": delete, "insert": insert}]))
@@ -0,0 +1,195 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Union
+from fastapi import WebSocket
+import asyncio
+import logging
+import time
+
+from app.core import metrics
+from app.core.executor import cpu
+from app.core.serialization import Frame
+from app.services.sync import SnapshotStream
+
+logger = logging.getLogger(__name__)
+
+# frame kinds; CODE frames (or a SnapshotStream) carry the whole document and
+# supersede older code/delta frames
+CODE = "code"
+DELTA = "delta"
+RESYNC = "resync"
+USERS = "users"
+OTHER = "other"
+
+SEND_SECONDS = metrics.Histogram("pair_send_seconds", "Time to write one frame to a socket.")
+SEND_FAILURES = metrics.Counter(
+    "pair_send_failures_total", "Sockets dropped because a send failed, timed out or overflowed the queue.", ["reason"]
+)
+
+
+class OutboundQueue:
+    # one bounded queue per socket, so a slow client only delays itself. The writer
+    # task and its buffer only exist while frames are pending, an idle socket has neither
+    __slots__ = (
+        "socket", "_snapshot", "_on_failure", "max_depth", "send_timeout",
+        "binary", "_frames", "_floor", "_task", "closed", "sent", "sent_bytes", "coalesced", "dropped", "timeouts",
+    )
+
+    def __init__(
+        self,
+        socket: WebSocket,
+        snapshot: Callable[[], Tuple[int, Union[Frame, SnapshotStream]]],
+        on_failure: Callable[["OutboundQueue"], None],
+        max_depth: int,
+        send_timeout: float,
+        binary: bool = False,
+    ):
+        self.socket = socket
+        self._snapshot = snapshot
+        self._on_failure = on_failure
+        self.max_depth = max_depth
+        self.send_timeout = send_timeout
+        # binary clients get Frame.binary in binary frames, the rest Frame.text
+        self.binary = binary
+
+        self._frames: Optional[Deque[Tuple[str, Optional[int], Union[Frame, SnapshotStream, None]]]] = None
+        self._floor = -1
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.sent = 0
+        self.sent_bytes = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.timeouts = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames) if self._frames else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "timeouts": self.timeouts,
+        }
+
+    def _discard(self, keep: Callable[[Tuple[str, Optional[int], Optional[Frame]]], bool]) -> int:
+        if not self._frames or all(keep(f) for f in self._frames):
+            return 0
+        before = len(self._frames)
+        self._frames = deque(f for f in self._frames if keep(f))
+        return before - len(self._frames)
+
+    def put(self, frame: Union[Frame, SnapshotStream], kind: str = OTHER, version: Optional[int] = None) -> bool:
+        if self.closed:
+            return False
+
+        if kind == CODE and version is not None:
+            self.coalesced += self._discard(lambda f: f[0] not in (CODE, DELTA) or f[1] is None or f[1] > version)
+        elif kind == USERS:
+            self.coalesced += self._discard(lambda f: f[0] != USERS)
+
+        if self._frames is None:
+            self._frames = deque()
+        if len(self._frames) >= self.max_depth:
+            # the client can't keep up: replace its pending edits with one snapshot taken at send time
+            purged = self._discard(lambda f: f[0] not in (CODE, DELTA, RESYNC))
+            if purged:
+                self.dropped += purged
+                self._frames.append((RESYNC, None, None))
+                if kind in (CODE, DELTA):
+                    self.dropped += 1
+                    self._wake()
+                    return True
+
+            if len(self._frames) >= self.max_depth:
+                self.dropped += 1
+                self._fail(f"outbound queue full ({self.max_depth} frames)", "overflow")
+                return False
+
+        self._frames.append((kind, version, frame))
+        self._wake()
+        return True
+
+    def _wake(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while not self.closed and self._frames:
+                kind, version, frame = self._frames.popleft()
+                if kind == RESYNC:
+                    version, frame = self._snapshot()
+                    self._floor = version
+                elif kind in (CODE, DELTA) and version is not None and version <= self._floor:
+                    self.coalesced += 1
+                    continue
+
+                if isinstance(frame, SnapshotStream):
+                    # frames queued meanwhile wait behind the whole stream, unless a
+                    # newer snapshot is among them: the rest of this one is stale
+                    for part in frame.frames():
+                        if self.closed or self._superseded() or not await self._send(part):
+                            break
+                else:
+                    await self._send(frame)
+        finally:
+            # the writer exits once the queue is empty; the next put starts a new one
+            self._task = None
+            if not self._frames:
+                self._frames = None
+
+    def _superseded(self) -> bool:
+        return bool(self._frames) and any(f[0] in (CODE, RESYNC) for f in self._frames)
+
+    async def _send(self, frame: Frame) -> bool:
+        try:
+            # a large frame is encoded on the CPU pool instead of inline below
+            if cpu.offloads(frame.size):
+                await frame.prepare(self.binary, cpu.run)
+            if self.binary:
+                send = self.socket.send_bytes(frame.binary)
+                size = len(frame.binary)
+            else:
+                send = self.socket.send_text(frame.text)
+                size = len(frame.data)
+            if metrics.enabled:
+                start = time.perf_counter()
+                await asyncio.wait_for(send, self.send_timeout)
+                SEND_SECONDS.observe(time.perf_counter() - start)
+            else:
+                await asyncio.wait_for(send, self.send_timeout)
+            self.sent += 1
+            self.sent_bytes += size
+            return True
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._fail(f"send timed out after {self.send_timeout}s", "timeout")
+        except Exception:
+            self._fail("send failed", "error")
+        return False
+
+    def _fail(self, reason: str, cause: str):
+        if self.closed:
+            return
+        logger.warning(f"Dropping slow or dead websocket: {reason}")
+        SEND_FAILURES.inc(cause)
+        self.closed = True
+        self.dropped += self.depth
+        self._frames = None
+        self._on_failure(self)
+
+    async def close(self):
+        self.closed = True
+        self._frames = None
+        task = self._task
+        if task and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
@@ -0,0 +1,178 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.room import Room
+
+logger = logging.getLogger(__name__)
+
+
+class DirtyRoom:
+    __slots__ = ("since", "size", "final_code")
+
+    def __init__(self, since: float):
+        self.since = since
+        self.size = 0
+        # set when the room was torn down and the document is no longer in memory
+        self.final_code: Optional[str] = None
+
+
+class CodeFlusher:
+    # write-behind checkpoints of in-memory room code into Room.code
+    def __init__(self, manager):
+        self.manager = manager
+        self.dirty: Dict[str, DirtyRoom] = {}
+        self._write_lock = asyncio.Lock()
+        self._inflight: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closing = set()
+
+        self.flushes = 0
+        self.rooms_flushed = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+
+    def mark_dirty(self, room_id: str, size: int):
+        state = self.dirty.get(room_id)
+        if state is None:
+            state = self.dirty[room_id] = DirtyRoom(time.monotonic())
+        state.size += size
+        # the room is live again, its in-memory document supersedes any final copy
+        state.final_code = None
+
+    def room_closed(self, room_id: str, code: str):
+        # last socket left: push the final document out without waiting for the next tick
+        state = self.dirty.get(room_id)
+        if state is None:
+            return
+        state.final_code = code
+        task = asyncio.create_task(self.flush(room_ids=[room_id]))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def pending_code(self, room_id: str) -> Optional[str]:
+        # code of a torn-down room that hasn't reached the DB yet
+        state = self.dirty.get(room_id)
+        if state is not None and state.final_code is not None:
+            return state.final_code
+        return self._inflight.get(room_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        await self.flush(force=True)
+
+    async def _run(self):
+        tick = min(1.0, settings.CHECKPOINT_INTERVAL / 2)
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+
+    def _due(self, force: bool) -> List[str]:
+        now = time.monotonic()
+        return [
+            room_id for room_id, state in self.dirty.items()
+            if force
+            or state.final_code is not None
+            or now - state.since >= settings.CHECKPOINT_INTERVAL
+            or state.size >= settings.CHECKPOINT_BYTES
+        ]
+
+    async def flush(self, force: bool = False, room_ids: Optional[List[str]] = None) -> int:
+        due = room_ids if room_ids is not None else self._due(force)
+        flushed = 0
+        for i in range(0, len(due), settings.CHECKPOINT_BATCH_SIZE):
+            flushed += await self._write(due[i:i + settings.CHECKPOINT_BATCH_SIZE])
+        return flushed
+
+    async def _write(self, room_ids: List[str]) -> int:
+        async with self._write_lock:
+            batch: List[Tuple[str, str, DirtyRoom]] = []
+            for room_id in room_ids:
+                state = self.dirty.pop(room_id, None)
+                if state is None:
+                    continue
+                code = state.final_code
+                if code is None:
+                    room = self.manager.rooms.get(room_id)
+                    if room is None or room.document is None:
+                        # nothing to read right now (the room is loading or being handed
+                        # over); kept dirty for a later flush rather than dropped
+                        self._requeue(room_id, state)
+                        continue
+                    code = room.document.text
+                batch.append((room_id, code, state))
+            if not batch:
+                return 0
+
+            self._inflight = {room_id: code for room_id, code, state in batch if state.final_code is not None}
+            start = time.perf_counter()
+            try:
+                # one transaction per batch of rooms
+                async with SessionLocal() as db:
+                    for room_id, code, _ in batch:
+                        await db.execute(update(Room).where(Room.id == room_id).values(code=code))
+                    await db.commit()
+            except Exception:
+                logger.exception(f"Failed to checkpoint {len(batch)} rooms")
+                self.failures += 1
+                for room_id, _, state in batch:
+                    self._requeue(room_id, state)
+                return 0
+            finally:
+                self._inflight = {}
+
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.rooms_flushed += len(batch)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+            self.last_batch_size = len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            return len(batch)
+
+    def _requeue(self, room_id: str, state: DirtyRoom):
+        current = self.dirty.get(room_id)
+        if current is None:
+            self.dirty[room_id] = state
+        else:
+            current.since = min(current.since, state.since)
+            current.size += state.size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dirty_rooms": len(self.dirty),
+            "flushes": self.flushes,
+            "rooms_flushed": self.rooms_flushed,
+            "failures": self.failures,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.rooms_flushed / self.flushes, 2) if self.flushes else 0.0,
+        }
@@ -0,0 +1,166 @@
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple, Union
+import hashlib
+import zlib
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import defer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import serialization
+from app.core.config import settings
+from app.core.executor import cpu
+from app.models.room import RoomRevision
+from app.services.document import diff
+
+# a delta is an edit script over the previous revision's text: n >= 0 copies n
+# characters, n < 0 skips -n characters, a string is inserted as is
+Script = List[Union[int, str]]
+
+
+def content_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def _lines(text: str) -> Tuple[List[str], List[int]]:
+    lines = text.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return lines, offsets
+
+
+def make_delta(old: str, new: str) -> Script:
+    change = diff(old, new)
+    if change is None:
+        return [len(old)] if old else []
+
+    # only the changed middle is matched line by line
+    pos, delete, insert = change
+    script: Script = [pos] if pos else []
+    old_lines, old_offsets = _lines(old[pos:pos + delete])
+    new_lines, new_offsets = _lines(insert)
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines).get_opcodes():
+        if tag == "equal":
+            script.append(old_offsets[i2] - old_offsets[i1])
+            continue
+        if i2 > i1:
+            script.append(old_offsets[i1] - old_offsets[i2])
+        if j2 > j1:
+            script.append(insert[new_offsets[j1]:new_offsets[j2]])
+    suffix = len(old) - pos - delete
+    if suffix:
+        script.append(suffix)
+    return script
+
+
+def apply_delta(old: str, script: Script) -> str:
+    out = []
+    pos = 0
+    for step in script:
+        if isinstance(step, str):
+            out.append(step)
+        elif step >= 0:
+            out.append(old[pos:pos + step])
+            pos += step
+        else:
+            pos -= step
+    return "".join(out)
+
+
+# the stored (snapshot, data) of each revision in a chain, for the CPU pool
+Blobs = List[Tuple[bool, bytes]]
+
+
+def _decode(snapshot: bool, data: bytes, previous: Optional[str]) -> str:
+    raw = zlib.decompress(data)
+    if snapshot:
+        return raw.decode("utf-8")
+    return apply_delta(previous, serialization.loads(raw))
+
+
+def rebuild(blobs: Blobs) -> Optional[str]:
+    code = None
+    for snapshot, data in blobs:
+        code = _decode(snapshot, data, code)
+    return code
+
+
+def encode_revision(blobs: Blobs, code: str) -> Tuple[bytes, bool]:
+    # (data, is snapshot) for a revision after `blobs`: a delta over the previous
+    # revision when there is one and it is actually smaller than the document
+    snapshot = zlib.compress(code.encode("utf-8"))
+    if not blobs:
+        return snapshot, True
+    delta = zlib.compress(serialization.dumps(make_delta(rebuild(blobs), code)))
+    return (delta, False) if len(delta) < len(snapshot) else (snapshot, True)
+
+
+class RevisionService:
+
+    @staticmethod
+    async def _chain(db: AsyncSession, room_id: str, revision: Optional[int] = None) -> List[RoomRevision]:
+        # the nearest snapshot at or before `revision` and the deltas after it
+        latest = select(func.max(RoomRevision.revision)).where(RoomRevision.room_id == room_id, RoomRevision.snapshot.is_(True))
+        if revision is not None:
+            latest = latest.where(RoomRevision.revision <= revision)
+        base = (await db.execute(latest)).scalar()
+        if base is None:
+            return []
+
+        query = select(RoomRevision).where(RoomRevision.room_id == room_id, RoomRevision.revision >= base)
+        if revision is not None:
+            query = query.where(RoomRevision.revision <= revision)
+        result = await db.execute(query.order_by(RoomRevision.revision))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def _rebuild(chain: List[RoomRevision]) -> Optional[str]:
+        if not chain:
+            return None
+        return await cpu.run(rebuild, [(row.snapshot, row.data) for row in chain], size=chain[-1].size)
+
+    @staticmethod
+    async def append(
+        db: AsyncSession, room_id: str, code: str, author: Optional[str] = None, digest: Optional[str] = None
+    ) -> Optional[RoomRevision]:
+        # adds a revision unless the code is what the last revision already holds;
+        # the caller commits, and is expected to hold the room row lock. Hashing,
+        # diffing and compressing a large document run on the CPU pool
+        if digest is None:
+            digest = await cpu.run(content_hash, code, size=len(code))
+        chain = await RevisionService._chain(db, room_id)
+        if chain and chain[-1].content_hash == digest:
+            return None
+
+        blobs = [(row.snapshot, row.data) for row in chain] if len(chain) < settings.REVISION_SNAPSHOT_INTERVAL else []
+        data, is_snapshot = await cpu.run(encode_revision, blobs, code, size=len(code))
+
+        row = RoomRevision(
+            room_id=room_id,
+            revision=chain[-1].revision + 1 if chain else 1,
+            snapshot=is_snapshot,
+            data=data,
+            content_hash=digest,
+            size=len(code),
+            author=author,
+        )
+        db.add(row)
+        await db.flush()
+        return row
+
+    @staticmethod
+    async def history(db: AsyncSession, room_id: str, limit: int = 50, before: Optional[int] = None) -> List[RoomRevision]:
+        # summaries only, the blobs stay in the DB
+        query = select(RoomRevision).options(defer(RoomRevision.data)).where(RoomRevision.room_id == room_id)
+        if before is not None:
+            query = query.where(RoomRevision.revision < before)
+        result = await db.execute(query.order_by(RoomRevision.revision.desc()).limit(limit))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def fetch(db: AsyncSession, room_id: str, revision: int) -> Optional[Tuple[RoomRevision, str]]:
+        chain = await RevisionService._chain(db, room_id, revision)
+        if not chain or chain[-1].revision != revision:
+            return None
+        return chain[-1], await RevisionService._rebuild(chain)
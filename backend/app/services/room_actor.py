@@ -0,0 +1,561 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from fastapi import WebSocket
+import asyncio
+import inspect
+import logging
+import time
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.executor import cpu
+from app.core.serialization import Frame, encode
+from app.services.autocomplete_index import RoomSymbols, symbol_counts
+from app.services.document import diff
+from app.services.inbound import TokenBucket
+from app.services.ot import MergeEngine, Op, StaleVersionError, to_primitives
+from app.services.outbound import CODE, DELTA, USERS
+from app.services.room_service import RoomService
+from app.services.room_state import Connection, Presence
+from app.services.room_store import CONNECTION_BYTES, LOG_ENTRY_BYTES, MEMBER_BYTES, ROOM_BYTES, SYMBOL_BYTES, ColdRoom
+from app.services.sync import SnapshotStream
+
+logger = logging.getLogger(__name__)
+
+FANOUT_SECONDS = metrics.Histogram(
+    "pair_broadcast_fanout_seconds", "Time to encode a broadcast and queue it for every socket in the room.", ["kind"]
+)
+FANOUT_RECIPIENTS = metrics.Histogram(
+    "pair_broadcast_recipients", "Sockets a broadcast was queued for.", ["kind"], buckets=(1, 2, 5, 10, 20, 50, 100, 500)
+)
+SYNCS = metrics.Counter(
+    "pair_syncs_total", "Documents sent to joining or resyncing sockets, by how: snapshot, stream, resume or catch_up.", ["kind"]
+)
+
+
+def _size(ops: List[Op]) -> int:
+    return sum(op.delete + len(op.insert) for op in ops)
+
+
+class RoomActor:
+    # owns everything about one room in this process: its sockets, document,
+    # symbol index and presence. Changes run as commands on the room's own task,
+    # in arrival order, so none of this state needs a lock
+    __slots__ = (
+        "room_id", "manager", "connections", "document", "symbols", "accepted", "presence", "sessions", "bucket",
+        "presence_sent", "presence_timer", "seed", "joining", "leaving", "closed", "active", "trimmed", "indexing",
+        "_snapshot", "_stream", "_edits", "_queue", "_task",
+    )
+
+    def __init__(self, room_id: str, manager):
+        self.room_id = room_id
+        self.manager = manager
+        # id(socket) -> connection
+        self.connections: Dict[int, Connection] = {}
+        self.document: Optional[MergeEngine] = None
+        self.symbols: Optional[RoomSymbols] = None
+        # vocabulary words picked from the suggestions in this room, most picked first
+        self.accepted = RoomSymbols(settings.ROOM_ACCEPTED_MAX)
+        self.presence = Presence()
+        # inbound rate limit shared by the room's local sockets
+        self.bucket = TokenBucket(settings.WS_ROOM_RATE, settings.WS_ROOM_BURST)
+        # username -> node -> open sockets, over every process serving the room
+        self.sessions: Dict[str, Dict[str, int]] = {}
+        self.presence_sent: Tuple[int, float] = (0, 0.0)
+        self.presence_timer: Optional[asyncio.TimerHandle] = None
+        self.seed: Optional[str] = None
+        self.joining: Optional[asyncio.Future] = None
+        # leaves this node published that have not come back through the backplane yet
+        self.leaving = 0
+        self.closed = False
+        # last local join or edit, and whether RoomStore has trimmed the room since
+        self.active = time.monotonic()
+        self.trimmed = False
+        # a symbol rebuild is queued on the CPU pool
+        self.indexing = False
+        self._snapshot: Optional[Tuple[int, Frame]] = None
+        self._stream: Optional[SnapshotStream] = None
+        # applied edits not yet fanned out: (version, ops, local sender ref, sender name)
+        self._edits: List[Tuple[int, List[Op], Optional[int], str]] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def tell(self, fn: Callable, *args):
+        if not self.closed:
+            self._queue.put_nowait((fn, args, None))
+
+    async def call(self, fn: Callable, *args):
+        # a closed room has no task left to answer
+        if self.closed:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            command = await self._queue.get()
+            # everything queued while we were busy is one batch; consecutive
+            # edits in it go out as a single broadcast
+            while True:
+                fn, args, future = command
+                try:
+                    result = fn(*args)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    if future is not None:
+                        future.set_result(result)
+                except Exception as exc:
+                    if future is not None:
+                        future.set_exception(exc)
+                    else:
+                        logger.exception(f"Room {self.room_id} command failed")
+                if self._queue.empty():
+                    break
+                command = self._queue.get_nowait()
+            self._flush_edits()
+
+            # the room stays open until its own leaves are applied: they are what
+            # marks the users offline, here and in the DB
+            if not self.connections and self._queue.empty() and not self.leaving:
+                self._close()
+                try:
+                    await self.manager.backplane.leave(self.room_id)
+                except Exception:
+                    logger.exception(f"Failed to leave room {self.room_id} on the backplane")
+                return
+
+    def _close(self):
+        self.closed = True
+        if self.manager.rooms.get(self.room_id) is self:
+            del self.manager.rooms[self.room_id]
+        if self.document is not None:
+            self.manager.flusher.room_closed(self.room_id, self.document.text)
+            document = self.document
+            self.manager.store.put(self.room_id, ColdRoom(document.text, document.version, document.log_entries(), document.epoch))
+        if self.presence_timer:
+            self.presence_timer.cancel()
+
+    # connections
+
+    def add(self, conn: Connection):
+        self.connections[id(conn.socket)] = conn
+        self.active = time.monotonic()
+
+    async def open(self, ref: int, members: List[str]):
+        conn = self.connections.get(ref)
+        if conn is None:
+            return
+        joining = not conn.joined
+        if joining:
+            conn.joined = True
+            backplane = self.manager.backplane
+            await backplane.publish(self.room_id, {"kind": "join", "node": backplane.node_id, "username": conn.username})
+        # the joiner is marked online by its join event, not offline here first, and
+        # the members go out with the user list that event sends, joiner included
+        self.load_members([m for m in members if m != conn.username], announce=not joining)
+
+    async def remove(self, sockets: List[WebSocket]) -> List[Connection]:
+        removed = [c for c in (self.connections.pop(id(s), None) for s in sockets) if c is not None]
+        backplane = self.manager.backplane
+        for conn in removed:
+            if conn.joined:
+                await backplane.publish(self.room_id, {"kind": "leave", "node": backplane.node_id, "username": conn.username})
+                self.leaving += 1
+            elif conn.username not in self.sessions and not self._has_local(conn.username):
+                # the join failed after the DB marked the user online, and no
+                # session of theirs is left to publish a leave for them
+                RoomService.mark_offline_later(self.room_id, conn.username)
+        return removed
+
+    def _has_local(self, username: str) -> bool:
+        return any(c.username == username for c in self.connections.values())
+
+    def abandon(self):
+        # the backplane is gone: every local socket is closed and the room dropped
+        for conn in self.connections.values():
+            self.manager.close_socket(conn.outbox, code=1012)
+        self.connections.clear()
+        # the hub will not relay our leaves any more
+        self.leaving = 0
+
+    # document
+
+    def install(self, state: Optional[Dict[str, Any]]):
+        if self.document is not None:
+            return
+
+        if state and state.get("live"):
+            # another process has the room: continue from its copy, op log included
+            log = [[Op(o["pos"], o["delete"], o["insert"]) for o in ops] for ops in state["log"]]
+            self._new_document(state["code"], state["version"], log, state.get("epoch"))
+            self.presence.load(state["presence"])
+            self.sessions = {u: dict(nodes) for u, nodes in state["sessions"].items()}
+            self.manager.store.discard(self.room_id)
+            return
+
+        code = self.manager.flusher.pending_code(self.room_id)
+        if code is None and state:
+            code = state.get("code")
+        if code is None:
+            code = self.seed or ""
+        # reopened in this process with nothing changed in between: carry on at the
+        # old version, so reconnecting clients can rebase instead of resyncing
+        cold = self.manager.store.take(self.room_id, code)
+        if cold is not None:
+            self._new_document(cold.code, cold.version, cold.log, cold.epoch)
+        else:
+            self._new_document(code)
+
+    def _new_document(self, code: str, version: int = 0, log: List[List[Op]] = (), epoch: Optional[str] = None):
+        self.symbols = None
+        self.document = MergeEngine(code, version, log=log, epoch=epoch)
+        self.restore_symbols()
+
+    def restore_symbols(self) -> Optional[RoomSymbols]:
+        # the symbol index is seeded from the whole document and then follows every
+        # applied op; after a trim it is rebuilt on first use. A large document is
+        # indexed on the CPU pool, and has no room symbols until that is done
+        if self.symbols is None and self.document is not None:
+            if cpu.offloads(self.document.length):
+                self._queue_reindex()
+                return None
+            self.symbols = RoomSymbols(settings.ROOM_SYMBOLS_MAX)
+            self.symbols.add_text(self.document.text)
+            self.document.observer = self.symbols
+        return self.symbols
+
+    def _queue_reindex(self):
+        if not self.indexing:
+            self.indexing = True
+            self.tell(self.reindex)
+
+    async def reindex(self):
+        # a room command: no edit lands between reading the text and installing the index
+        self.indexing = False
+        if self.symbols is not None or self.document is None:
+            return
+        text = self.document.text
+        counts = await cpu.run(symbol_counts, text, settings.ROOM_SYMBOLS_MAX, size=len(text))
+        self.symbols = RoomSymbols.from_counts(settings.ROOM_SYMBOLS_MAX, counts)
+        self.document.observer = self.symbols
+
+    def _drop_symbols(self, size: int):
+        # a large paste or delete is not re-tokenized inline by the symbol index,
+        # which is rebuilt on the CPU pool after the edit instead
+        if self.symbols is not None and cpu.offloads(size):
+            self.document.observer = None
+            self.symbols = None
+            self._queue_reindex()
+
+    def accept(self, word: str):
+        self.accepted.add_text(word)
+
+    def trim(self):
+        # keeps only the document: the op log, symbol index and cached frames are
+        # dropped. Runs on the room's task, between commands
+        if self.document is None:
+            return
+        self.document.trim_log()
+        self.document.observer = None
+        self.document.rope.forget_text()
+        self.symbols = None
+        self._snapshot = None
+        self._stream = None
+        self.trimmed = True
+
+    def footprint(self) -> Dict[str, int]:
+        # approximate bytes held for the room; "reclaimable" is what a trim frees
+        document, cached_text, log, symbols = 0, 0, 0, 0
+        accepted = SYMBOL_BYTES * len(self.accepted)
+        if self.document is not None:
+            document, cached_text = self.document.rope.footprint()
+            log = LOG_ENTRY_BYTES * self.document.log_size()
+        if self.symbols is not None:
+            symbols = SYMBOL_BYTES * len(self.symbols)
+        snapshot = self._snapshot[1].footprint() if self._snapshot is not None else 0
+        if self._stream is not None:
+            snapshot += self._stream.footprint()
+        connections = CONNECTION_BYTES * len(self.connections)
+        presence = MEMBER_BYTES * len(self.presence.members)
+        reclaimable = cached_text + log + symbols + snapshot
+        return {
+            "document": document + cached_text,
+            "op_log": log,
+            "symbols": symbols,
+            "accepted": accepted,
+            "snapshot": snapshot,
+            "connections": connections,
+            "presence": presence,
+            "total": ROOM_BYTES + document + reclaimable + accepted + connections + presence,
+            "reclaimable": reclaimable,
+            "idle_seconds": round(time.monotonic() - self.active, 1),
+        }
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        if self.document is None:
+            return None
+        return {
+            "live": True,
+            "code": self.document.text,
+            "version": self.document.version,
+            "epoch": self.document.epoch,
+            "log": [[op.to_dict() for op in ops] for ops in self.document.log_entries()],
+            "presence": self.presence.to_list(),
+            "sessions": self.sessions,
+        }
+
+    def reply_state(self, reply: Callable[[Optional[Dict[str, Any]]], None]):
+        reply(self.state())
+
+    def snapshot(self, chunked: bool = False) -> Tuple[int, Union[Frame, SnapshotStream]]:
+        # a burst of joiners at the same version shares one encoded snapshot
+        document = self.document
+        version = document.version if document is not None else 0
+        chunk_size = settings.SYNC_CHUNK_SIZE
+        if chunked and chunk_size > 0 and document is not None and document.length > chunk_size:
+            if self._stream is None or self._stream.version != version:
+                self._stream = SnapshotStream(version, document.epoch, document.text, chunk_size)
+            return version, self._stream
+
+        if self._snapshot and self._snapshot[0] == version:
+            return self._snapshot
+
+        frame = encode({
+            "type": "CODE_UPDATE",
+            "code": document.text if document is not None else "",
+            "version": version,
+            "epoch": document.epoch if document is not None else None,
+            "sender": "System"
+        }, document.length if document is not None else 0)
+        self._snapshot = (version, frame)
+        return self._snapshot
+
+    def send_snapshot(self, ref: int, version: Optional[int] = None, epoch: Optional[str] = None, offset: int = 0) -> bool:
+        # a delta client that still has `version` of this epoch gets what it misses:
+        # the rest of an interrupted stream (offset > 0, same version), or one
+        # CODE_DELTA with every op since. Anyone else gets the whole document
+        conn = self.connections.get(ref)
+        if not conn:
+            return False
+        document = self.document
+        if version is not None and conn.delta and document is not None and epoch == document.epoch:
+            if offset:
+                current, stream = self.snapshot(conn.chunked)
+                if version == current and isinstance(stream, SnapshotStream):
+                    SYNCS.inc("resume")
+                    return conn.outbox.put(stream.resume(offset), CODE, current)
+            else:
+                try:
+                    missed = document.ops_since(version)
+                except StaleVersionError:
+                    missed = None
+                if missed is not None:
+                    SYNCS.inc("catch_up")
+                    ops = [op for edit_ops in missed for op in edit_ops]
+                    return conn.outbox.put(encode({
+                        "type": "CODE_DELTA",
+                        "version": document.version,
+                        "ops": [op.to_dict() for op in ops],
+                        "sender": "System"
+                    }, _size(ops)), DELTA, document.version)
+
+        version, frame = self.snapshot(conn.chunked)
+        SYNCS.inc("stream" if isinstance(frame, SnapshotStream) else "snapshot")
+        return conn.outbox.put(frame, CODE, version)
+
+    # backplane events
+
+    def apply_event(self, event: Dict[str, Any]):
+        if self.document is None:
+            return
+        if event["kind"] == "code":
+            return self._apply_code(event)
+        if event["kind"] == "delta":
+            self._apply_edit(event)
+        else:
+            self._flush_edits()
+            self._apply_presence(event)
+
+    async def _apply_code(self, event: Dict[str, Any]):
+        # full-text updates are diffed against the document, on the CPU pool when
+        # either is large; the room runs nothing else until the edit is applied
+        text = self.document.text
+        change = await cpu.run(diff, text, event["code"], size=max(len(text), len(event["code"])))
+        self._apply_edit(event, change)
+
+    def _apply_edit(self, event: Dict[str, Any], change: Optional[Tuple[int, int, str]] = None):
+        ref = event["conn"] if event["node"] == self.manager.backplane.node_id else None
+        try:
+            if event["kind"] == "code":
+                if change is None:
+                    return
+                self._drop_symbols(change[1] + len(change[2]))
+                ops = self.document.apply_change(change)
+            else:
+                ops = to_primitives(event["ops"])
+                self._drop_symbols(_size(ops))
+                ops = self.document.submit(event["version"], ops)
+        except (StaleVersionError, ValueError):
+            logger.warning(f"Rejected delta for room {self.room_id}")
+            # a client too far behind is brought back with a full snapshot, after
+            # the edits before it went out
+            if ref in self.connections:
+                self._flush_edits()
+                self.send_snapshot(ref)
+            return
+
+        if ops:
+            self.manager.flusher.mark_dirty(self.room_id, _size(ops))
+        self.active = time.monotonic()
+        self.trimmed = False
+        self._edits.append((self.document.version, ops, ref, event["sender"]))
+
+    def _flush_edits(self):
+        if not self._edits:
+            return
+        edits, self._edits = self._edits, []
+        if metrics.enabled:
+            start = time.perf_counter()
+        version = edits[-1][0]
+        senders = {ref for _, _, ref, _ in edits if ref is not None}
+        ops = [op for _, edit_ops, _, _ in edits for op in edit_ops]
+        last_sender = edits[-1][2]
+
+        shared_frame = None
+        # legacy clients need the whole document, built at most once per batch
+        full_frame = None
+        for ref, conn in self.connections.items():
+            if conn.delta:
+                if ref in senders:
+                    self._send_interleaved(conn, ref, edits)
+                    continue
+                if shared_frame is None:
+                    shared_frame = encode({
+                        "type": "CODE_DELTA",
+                        "version": version,
+                        "ops": [op.to_dict() for op in ops],
+                        "sender": edits[-1][3]
+                    }, _size(ops))
+                conn.outbox.put(shared_frame, DELTA, version)
+            elif ops and ref != last_sender:
+                if full_frame is None:
+                    full_frame = encode(
+                        {"type": "CODE_UPDATE", "code": self.document.text, "version": version, "sender": edits[-1][3]},
+                        self.document.length,
+                    )
+                conn.outbox.put(full_frame, CODE, version)
+        if metrics.enabled:
+            FANOUT_SECONDS.observe(time.perf_counter() - start, "edit")
+            FANOUT_RECIPIENTS.observe(len(self.connections), "edit")
+
+    def _send_interleaved(self, conn: Connection, ref: int, edits: List[Tuple[int, List[Op], Optional[int], str]]):
+        # a sender gets the others' ops up to its own edit, then its ack, and so on
+        ops: List[Op] = []
+        version = None
+        sender = None
+        for edit_version, edit_ops, edit_ref, edit_sender in edits:
+            if edit_ref == ref:
+                if version is not None:
+                    conn.outbox.put(encode({
+                        "type": "CODE_DELTA", "version": version, "ops": [op.to_dict() for op in ops], "sender": sender
+                    }, _size(ops)), DELTA, version)
+                    ops, version = [], None
+                conn.outbox.put(encode({"type": "CODE_ACK", "version": edit_version}))
+            else:
+                ops.extend(edit_ops)
+                version, sender = edit_version, edit_sender
+        if version is not None:
+            conn.outbox.put(encode({
+                "type": "CODE_DELTA", "version": version, "ops": [op.to_dict() for op in ops], "sender": sender
+            }, _size(ops)), DELTA, version)
+
+    def _apply_presence(self, event: Dict[str, Any]):
+        kind = event["kind"]
+        changed = False
+
+        if kind == "join":
+            nodes = self.sessions.setdefault(event["username"], {})
+            nodes[event["node"]] = nodes.get(event["node"], 0) + 1
+            self.presence.set(event["username"], online=True, typing=False)
+            # the joiner needs a user list even if nothing changed for the others
+            self.presence.bump()
+            changed = True
+        elif kind == "leave":
+            local = event["node"] == self.manager.backplane.node_id
+            if local:
+                self.leaving = max(0, self.leaving - 1)
+            nodes = self.sessions.get(event["username"], {})
+            if event["node"] in nodes:
+                nodes[event["node"]] -= 1
+                if nodes[event["node"]] <= 0:
+                    del nodes[event["node"]]
+                if not nodes:
+                    del self.sessions[event["username"]]
+                    changed = self.presence.set(event["username"], online=False, typing=False)
+                    # every replica applies the leave, the node that had the socket writes it down
+                    if local:
+                        RoomService.mark_offline_later(self.room_id, event["username"])
+        elif kind == "typing":
+            if event["username"] in self.sessions:
+                changed = self.presence.set(event["username"], typing=bool(event["typing"]))
+        elif kind == "node_gone":
+            # the process died without saying goodbye for its sockets
+            offline = []
+            for username, nodes in list(self.sessions.items()):
+                if nodes.pop(event["node"], None) and not nodes:
+                    del self.sessions[username]
+                    changed |= self.presence.set(username, online=False, typing=False)
+                    offline.append(username)
+            # its users are written down by one survivor: every replica holds the
+            # same sessions, so all of them pick the same lowest node id
+            survivors = {node for nodes in self.sessions.values() for node in nodes}
+            if not survivors or min(survivors) == self.manager.backplane.node_id:
+                for username in offline:
+                    RoomService.mark_offline_later(self.room_id, username)
+
+        if changed:
+            self.schedule_presence()
+
+    # presence
+
+    def load_members(self, usernames: List[str], announce: bool = True):
+        # known members from the DB start out offline; afterwards presence lives in memory
+        added = False
+        for name in usernames:
+            if name:
+                added |= self.presence.add(name)
+        if added and announce:
+            self.schedule_presence()
+
+    def schedule_presence(self):
+        # at most PRESENCE_MAX_RATE user lists per second per room, changes in between are coalesced
+        if self.presence_timer is not None or self.closed:
+            return
+
+        interval = 1.0 / settings.PRESENCE_MAX_RATE if settings.PRESENCE_MAX_RATE > 0 else 0.0
+        loop = asyncio.get_running_loop()
+        delay = self.presence_sent[1] + interval - loop.time()
+        if delay <= 0:
+            self._flush_presence()
+        else:
+            self.presence_timer = loop.call_later(delay, self._flush_presence)
+
+    def _flush_presence(self):
+        self.presence_timer = None
+        if self.presence.version == self.presence_sent[0] or not self.connections:
+            return
+
+        self.presence_sent = (self.presence.version, asyncio.get_running_loop().time())
+        if metrics.enabled:
+            start = time.perf_counter()
+        frame = self.presence.frame()
+        for conn in self.connections.values():
+            conn.outbox.put(frame, USERS)
+        if metrics.enabled:
+            FANOUT_SECONDS.observe(time.perf_counter() - start, "presence")
+            FANOUT_RECIPIENTS.observe(len(self.connections), "presence")
+
+    def send_presence(self, ref: int):
+        conn = self.connections.get(ref)
+        if conn:
+            conn.outbox.put(self.presence.frame(), USERS)
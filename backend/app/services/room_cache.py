@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import time
+
+from app.core.config import settings
+
+
+class RoomInfo:
+    # what the REST handlers need about a room without loading its code
+    __slots__ = ("room_id", "limit", "users")
+
+    def __init__(self, room_id: str, limit: int, users: List[Dict[str, Any]]):
+        self.room_id = room_id
+        self.limit = limit
+        self.users = users
+
+
+class RoomCache:
+    # in-process LRU of room metadata with a TTL. Writes through RoomService
+    # invalidate their room; writes from other workers show up once the entry expires
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, RoomInfo]]" = OrderedDict()
+        # bumped by every invalidation, so a load that raced a write isn't cached
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, room_id: str) -> Optional[RoomInfo]:
+        entry = self._entries.get(room_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(room_id)
+                self.hits += 1
+                return entry[1]
+            del self._entries[room_id]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, info: RoomInfo, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        self._entries[info.room_id] = (time.monotonic() + self.ttl, info)
+        self._entries.move_to_end(info.room_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, room_id: str):
+        self.generation += 1
+        if self._entries.pop(room_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+_room_cache: Optional[RoomCache] = None
+
+
+def get_room_cache() -> RoomCache:
+    global _room_cache
+    if _room_cache is None:
+        _room_cache = RoomCache(settings.ROOM_CACHE_SIZE, settings.ROOM_CACHE_TTL)
+    return _room_cache
@@ -1,122 +1,190 @@
-import json
+import asyncio
 import logging
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy.ext.mutable import MutableDict
-from app.models.room import Room
+from sqlalchemy import func, literal, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core import metrics
+from app.core.executor import cpu
+from app.core.database import SessionLocal, upsert_insert
+from app.models.room import Room, RoomMember
+from app.services.revision_service import RevisionService, content_hash
+from app.services.room_cache import RoomInfo, get_room_cache
 
 logger = logging.getLogger(__name__)
 
+_background_tasks = set()
+
+DB_SECONDS = metrics.Histogram(
+    "pair_db_operation_seconds", "Time spent in RoomService calls, database round trips included.", ["operation"]
+)
+
 class RoomService:
 
     @staticmethod
-    def join_room(db: Session, room_id: str, username: str):
-        room = db.query(Room).filter(Room.id == room_id).first()
+    async def get_room(db: AsyncSession, room_id: str, for_update: bool = False):
+        query = select(Room).where(Room.id == room_id)
+        if for_update:
+            query = query.with_for_update()
+        result = await db.execute(query)
+        return result.scalars().first()
+
+    @staticmethod
+    async def get_members(db: AsyncSession, room_id: str) -> List[RoomMember]:
+        result = await db.execute(select(RoomMember).where(RoomMember.room_id == room_id).order_by(RoomMember.id))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def user_list(db: AsyncSession, room_id: str) -> List[Dict[str, Any]]:
+        return [{"username": m.username, "online": m.online} for m in await RoomService.get_members(db, room_id)]
+
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "get_info")
+    async def get_info(db: AsyncSession, room_id: str) -> Optional[RoomInfo]:
+        # read-through: limit and members, without the code
+        cache = get_room_cache()
+        info = cache.get(room_id)
+        if info is not None:
+            return info
+
+        generation = cache.generation
+        limit = (await db.execute(select(Room.limit).where(Room.id == room_id))).scalar()
+        if limit is None:
+            return None
+        info = RoomInfo(room_id, limit, await RoomService.user_list(db, room_id))
+        cache.put(info, generation)
+        return info
+
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "create_room")
+    async def create_room(db: AsyncSession, room_id: str, username: str, limit: int) -> Optional[RoomInfo]:
+        db.add(Room(id=room_id, limit=limit))
+        await db.flush()
+        db.add(RoomMember(room_id=room_id, username=username, online=True))
+        await db.commit()
+        get_room_cache().invalidate(room_id)
+        return await RoomService.get_info(db, room_id)
+
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "join_room")
+    async def join_room(db: AsyncSession, room_id: str, username: str):
+        # the room row is locked (FOR UPDATE on Postgres, SQLite has one writer
+        # anyway) and the capacity check is part of the insert itself, so
+        # concurrent joins can't overfill a room
+        room = await RoomService.get_room(db, room_id, for_update=True)
 
         if not room:
 
             raise HTTPException(404, "Room does not exist")
 
-        users_list = room.users or []
-        room.users = [MutableDict(u) for u in users_list]
-        
-        active_usernames = {u["username"] for u in room.users}
+        rejoined = await db.execute(
+            update(RoomMember)
+            .where(RoomMember.room_id == room_id, RoomMember.username == username, RoomMember.online.is_(False))
+            .values(online=True, last_seen=func.now())
+        )
+        if rejoined.rowcount == 0:
+            members = select(func.count()).select_from(RoomMember).where(RoomMember.room_id == room_id).scalar_subquery()
+            joined = await db.execute(
+                upsert_insert(db.bind.dialect.name)(RoomMember)
+                .from_select(
+                    ["room_id", "username", "online"],
+                    select(literal(room_id), literal(username), true()).where(Room.id == room_id, members < Room.limit),
+                )
+                .on_conflict_do_nothing()
+            )
+            if joined.rowcount == 0:
+                await db.rollback()
+                existing = await db.execute(
+                    select(RoomMember.id).where(RoomMember.room_id == room_id, RoomMember.username == username)
+                )
+                if existing.first():
+                    raise HTTPException(409, "User already online")
+                raise HTTPException(403, "Room is full")
+
+        await db.commit()
+        get_room_cache().invalidate(room_id)
+        return room
 
-        if len(room.users) >= room.limit and username not in active_usernames:
-            raise HTTPException(403, "Room is full")
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "connect_user")
+    async def connect_user(db: AsyncSession, room_id: str, username: str) -> Tuple[Room, List[str]]:
+        # websocket join: creates the room on the fly and marks the user online
+        insert = upsert_insert(db.bind.dialect.name)
+        await db.execute(insert(Room).values(id=room_id, code="", limit=5).on_conflict_do_nothing())
+        await db.execute(
+            insert(RoomMember)
+            .values(room_id=room_id, username=username, online=True)
+            .on_conflict_do_update(
+                index_elements=["room_id", "username"],
+                set_={"online": True, "last_seen": func.now()},
+            )
+        )
+        await db.commit()
+        get_room_cache().invalidate(room_id)
+        room = await RoomService.get_room(db, room_id)
+        return room, [m.username for m in await RoomService.get_members(db, room_id)]
 
-        existing_user = next((u for u in room.users if u["username"] == username.lower()), None)
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "save_code")
+    async def save_code(db: AsyncSession, room_id: str, code: str, username: str) -> int:
+        # unchanged code is only refused under the room lock, against the last
+        # revision in the DB: a cached hash can be behind another worker's save.
+        # The hash is taken before the lock, so the lock is not held for it
+        digest = await cpu.run(content_hash, code, size=len(code))
+        room = await RoomService.get_room(db, room_id, for_update=True)
+        if not room:
+            raise HTTPException(404, "Room not found")
+        revision = await RevisionService.append(db, room.id, code, username, digest)
+        if revision is None:
+            await db.rollback()
+            raise HTTPException(304, "No changes")
 
-        if existing_user:
-            if existing_user.get("online"):
-                raise HTTPException(409, "User already online")
-            existing_user["online"] = True
-        else:
-            room.users.append(MutableDict({"username": username, "online": True}))
+        room.code = code
+        room.name = username
+        await db.commit()
+        return revision.revision
 
-        db.commit()
-        db.refresh(room)
-        return room
+    @staticmethod
+    @metrics.timed(DB_SECONDS, "update_limit")
+    async def update_limit(db: AsyncSession, room_id: str, new_limit: int):
+        # one conditional UPDATE; the cached room only explains a refusal
+        result = await db.execute(
+            update(Room).where(Room.id == room_id, Room.limit < new_limit).values(limit=new_limit)
+        )
+        if result.rowcount == 0:
+            await db.rollback()
+            if await RoomService.get_info(db, room_id) is None:
+                raise HTTPException(404, "Room not found")
+            raise HTTPException(400, "New limit cannot be lower than current limit")
+        await db.commit()
+        get_room_cache().invalidate(room_id)
 
     @staticmethod
-    def mark_user_offline(db: Session, room_id: str, username: str):
+    @metrics.timed(DB_SECONDS, "mark_user_offline")
+    async def mark_user_offline(db: AsyncSession, room_id: str, username: Optional[str]):
         if not username: 
             return
 
         try:
-            room = db.query(Room).filter(Room.id == room_id).first()
-            if not room: 
-                return
-
-            users = room.users or []
-            updated = False
-
-            for i, u in enumerate(users):
-                if not isinstance(u, MutableDict):
-                    users[i] = MutableDict(u)
-                
-                if users[i].get("username") == username and users[i].get("online"):
-                    users[i]["online"] = False
-                    users[i]["typing"] = False
-                    updated = True
-
-            if updated:
-                room.users = users 
-                db.add(room)
-                db.commit()
-                db.refresh(room)                
+            await db.execute(
+                update(RoomMember)
+                .where(RoomMember.room_id == room_id, RoomMember.username == username, RoomMember.online.is_(True))
+                .values(online=False, last_seen=func.now())
+            )
+            await db.commit()
+            get_room_cache().invalidate(room_id)
         except Exception:
             logger.exception(f"Error marking user {username} offline")
-            db.rollback()
+            await db.rollback()
 
     @staticmethod
-    def active_user_objs(manager, room_id: str):
-
-        try:
-            conns = manager.active_connections.get(room_id, [])
-            return [
-                {
-                    "username": c["username"],
-                    "typing": c.get("typing", False),
-                    "online": True
-                }
-                for c in conns
-            ]
-        except Exception:
-            logger.exception("Error getting active user objects")
-            return []
-
-    @staticmethod
-    async def send_user_list(room_id: str, db: Session, manager):
-        try:
-
-            active_users = RoomService.active_user_objs(manager, room_id)
-            active_names = {u["username"] for u in active_users}
-
-            room = db.query(Room).filter(Room.id == room_id).first()
-            db_users = list(room.users or []) if room else []
-
-            offline_users = []
-            for u in db_users:
-                uname = u.get("username")
-                if uname and uname not in active_names:
-                    offline_users.append({
-                        "username": uname,
-                        "online": False,
-                        "typing": False
-                    })
-
-            final_list = active_users + offline_users
-            msg = json.dumps({"type": "USER_UPDATE", "users": final_list})
-            async with manager._get_lock(room_id):
-                sockets = [c["socket"] for c in manager.active_connections.get(room_id, [])]
-
-            dead_sockets = []
-            for s in sockets:
-                if not await manager._safe_send(s, msg):
-                    dead_sockets.append(s)
-            
-            if dead_sockets:
-                await manager.remove_dead_sockets(room_id, dead_sockets)
-        except Exception:
-            logger.exception("Failed to send user list")
\ No newline at end of file
+    def mark_offline_later(room_id: str, username: str):
+        # called by the room once an applied leave took the user's last session;
+        # the DB is only touched in the background, never on the message path
+        async def run():
+            async with SessionLocal() as db:
+                await RoomService.mark_user_offline(db, room_id, username)
+
+        task = asyncio.create_task(run())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,104 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import WebSocket
+
+from app.core.serialization import Frame, encode
+from app.services.inbound import InboundQueue
+from app.services.outbound import OutboundQueue
+
+
+class Connection:
+    # one socket in a room, keyed by id(socket) in RoomActor.connections
+    __slots__ = ("socket", "username", "delta", "chunked", "outbox", "inbox", "joined")
+
+    def __init__(
+        self,
+        socket: WebSocket,
+        username: str,
+        delta: bool,
+        outbox: OutboundQueue,
+        inbox: InboundQueue,
+        chunked: bool = False,
+    ):
+        self.socket = socket
+        self.username = username
+        self.delta = delta
+        # large snapshots go out as a SnapshotStream
+        self.chunked = chunked
+        self.outbox = outbox
+        self.inbox = inbox
+        # set once the join went out on the backplane
+        self.joined = False
+
+
+class Member:
+    __slots__ = ("username", "online", "typing")
+
+    def __init__(self, username: str, online: bool = False, typing: bool = False):
+        self.username = username
+        self.online = online
+        self.typing = typing
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"username": self.username, "online": self.online, "typing": self.typing}
+
+
+class Presence:
+    # the members of a room and their status. Every change bumps the version; the
+    # user list and its USER_UPDATE frame are built once per version and shared
+    __slots__ = ("members", "version", "_cache")
+
+    def __init__(self):
+        self.members: Dict[str, Member] = {}
+        self.version = 0
+        self._cache: Optional[Tuple[int, List[Dict[str, Any]], Optional[Frame]]] = None
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.members
+
+    def is_online(self, username: str) -> bool:
+        member = self.members.get(username)
+        return member is not None and member.online
+
+    def bump(self):
+        self.version += 1
+
+    def add(self, username: str) -> bool:
+        # known members start out offline
+        if username in self.members:
+            return False
+        self.members[username] = Member(username)
+        self.bump()
+        return True
+
+    def set(self, username: str, **state) -> bool:
+        member = self.members.get(username)
+        if member is None:
+            member = self.members[username] = Member(username)
+        changed = False
+        for key, value in state.items():
+            if getattr(member, key) != value:
+                setattr(member, key, value)
+                changed = True
+        if changed:
+            self.bump()
+        return changed
+
+    def load(self, records: Iterable[Dict[str, Any]]):
+        self.members = {r["username"]: Member(r["username"], r["online"], r["typing"]) for r in records}
+        self.bump()
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        # online members first
+        if self._cache is None or self._cache[0] != self.version:
+            members = self.members.values()
+            users = [m.to_dict() for m in members if m.online] + [m.to_dict() for m in members if not m.online]
+            self._cache = (self.version, users, None)
+        return self._cache[1]
+
+    def frame(self) -> Frame:
+        users = self.to_list()
+        version, _, frame = self._cache
+        if frame is None:
+            frame = encode({"type": "USER_UPDATE", "users": users})
+            self._cache = (version, users, frame)
+        return frame
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+from app.services.ot import Op
+
+logger = logging.getLogger(__name__)
+
+# rough per-item costs used by the accounting, measured with tracemalloc on CPython 3.11
+LOG_ENTRY_BYTES = 250
+SYMBOL_BYTES = 200
+MEMBER_BYTES = 300
+CONNECTION_BYTES = 4096
+ROOM_BYTES = 2048
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # resource is POSIX only, and gives the peak rather than the current RSS
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ColdRoom:
+    # what a room leaves behind when its last local socket goes: enough to carry on
+    # at the same version, and with the same op log, if it is reopened here
+    __slots__ = ("code", "version", "log", "epoch", "size")
+
+    def __init__(self, code: str, version: int, log: List[List[Op]], epoch: str):
+        self.code = code
+        self.version = version
+        self.log = log
+        self.epoch = epoch
+        self.size = ROOM_BYTES + len(code) + LOG_ENTRY_BYTES * len(log)
+
+
+class RoomStore:
+    # works the room state of this process towards ROOM_MEMORY_BUDGET bytes, a
+    # soft target rather than a limit. Closed rooms stay as cold copies in an LRU
+    # and are evicted first; after that, live rooms idle for ROOM_IDLE_SECONDS are
+    # trimmed to their document (op log, symbol index and cached snapshots
+    # dropped, rebuilt when next needed). The documents of rooms with sockets are
+    # never evicted, so live rooms alone can stay over the target; that is
+    # reported, not enforced. The code of a closed room is flushed by CodeFlusher
+    # as before, so evicting a cold copy never loses an edit
+    def __init__(self, manager, budget: int, idle_seconds: float, interval: float):
+        self.manager = manager
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.cold: "OrderedDict[str, ColdRoom]" = OrderedDict()
+        self.cold_bytes = 0
+        # live rooms at the last check, so storing a cold copy doesn't walk every room
+        self.live_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        self.over_budget = False
+
+        self.rehydrated = 0
+        self.stale = 0
+        self.evictions = 0
+        self.trims = 0
+        self.checks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def put(self, room_id: str, room: ColdRoom):
+        if not self.enabled:
+            return
+        self.discard(room_id)
+        self.cold[room_id] = room
+        self.cold_bytes += room.size
+        self._evict_cold(self.budget - self.live_bytes)
+
+    def take(self, room_id: str, code: str) -> Optional[ColdRoom]:
+        # the cold copy, if it still matches the code the room is opened with;
+        # another process may have changed the room since
+        room = self.discard(room_id)
+        if room is None:
+            return None
+        if room.code != code:
+            self.stale += 1
+            return None
+        self.rehydrated += 1
+        return room
+
+    def discard(self, room_id: str) -> Optional[ColdRoom]:
+        room = self.cold.pop(room_id, None)
+        if room is not None:
+            self.cold_bytes -= room.size
+        return room
+
+    def _evict_cold(self, allowed: int):
+        while self.cold and self.cold_bytes > max(0, allowed):
+            _, room = self.cold.popitem(last=False)
+            self.cold_bytes -= room.size
+            self.evictions += 1
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Room memory check failed")
+
+    def check(self):
+        self.checks += 1
+        rooms = list(self.manager.rooms.values())
+        self.live_bytes = sum(room.footprint()["total"] for room in rooms)
+        self._evict_cold(self.budget - self.live_bytes)
+        if self.live_bytes + self.cold_bytes <= self.budget:
+            self.over_budget = False
+            return
+
+        # least recently active first
+        now = time.monotonic()
+        for room in sorted(rooms, key=lambda r: r.active):
+            if now - room.active < self.idle_seconds or self.live_bytes <= self.budget:
+                break
+            if room.trimmed:
+                continue
+            # the trim runs on the room's task; count what it will free
+            self.live_bytes -= room.footprint()["reclaimable"]
+            room.tell(room.trim)
+            self.trims += 1
+        over = self.live_bytes > self.budget
+        if over and not self.over_budget:
+            logger.warning(
+                f"Live rooms use about {self.live_bytes} bytes after trimming, over the {self.budget} byte"
+                " ROOM_MEMORY_BUDGET target; their documents stay in memory while they have sockets"
+            )
+        self.over_budget = over
+
+    def stats(self) -> Dict[str, Any]:
+        live = sum(room.footprint()["total"] for room in self.manager.rooms.values())
+        return {
+            "budget": self.budget,
+            "accounted": live + self.cold_bytes,
+            "rss": rss_bytes(),
+            "live_rooms": len(self.manager.rooms),
+            "live_bytes": live,
+            "cold_rooms": len(self.cold),
+            "cold_bytes": self.cold_bytes,
+            "over_budget": self.over_budget,
+            "rehydrated": self.rehydrated,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "trims": self.trims,
+            "checks": self.checks,
+        }
+
+    def largest_rooms(self, top: int = 20) -> Dict[str, Dict[str, int]]:
+        rooms = [(room_id, room.footprint()) for room_id, room in self.manager.rooms.items()]
+        rooms.sort(key=lambda item: item[1]["total"], reverse=True)
+        return {room_id: footprint for room_id, footprint in rooms[:top]}
+
@@ -0,0 +1,58 @@
+from typing import Iterator, List, Optional
+
+from app.core.serialization import Frame, encode
+
+
+class SnapshotStream:
+    # a document too large for one frame, sent as SYNC_START, SYNC_CHUNK frames of
+    # `chunk_size` characters and SYNC_END. It is a single entry in a socket's
+    # outbound queue: each chunk is sliced and encoded when the writer gets to it,
+    # so the loop never serializes the whole document at once, and edits queued
+    # behind the stream go out after SYNC_END. Joiners at the same version share
+    # the encoded chunks
+    __slots__ = ("version", "epoch", "code", "chunk_size", "offset", "_chunks")
+
+    def __init__(self, version: int, epoch: str, code: str, chunk_size: int):
+        self.version = version
+        self.epoch = epoch
+        self.code = code
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._chunks: List[Optional[Frame]] = [None] * -(-len(code) // chunk_size)
+
+    def resume(self, offset: int) -> "SnapshotStream":
+        # the same stream for a client that already has code[:offset] at this version
+        stream = SnapshotStream.__new__(SnapshotStream)
+        stream.version, stream.epoch, stream.code, stream.chunk_size = self.version, self.epoch, self.code, self.chunk_size
+        stream.offset = min(max(0, offset), len(self.code))
+        stream._chunks = self._chunks
+        return stream
+
+    def frames(self) -> Iterator[Frame]:
+        size = self.chunk_size
+        first = self.offset // size
+        yield encode({
+            "type": "SYNC_START",
+            "version": self.version,
+            "epoch": self.epoch,
+            "length": len(self.code),
+            "offset": self.offset,
+            "chunks": len(self._chunks) - first,
+        })
+        for seq in range(first, len(self._chunks)):
+            start = max(seq * size, self.offset)
+            if start != seq * size:
+                # a resumed transfer starts part way into a chunk
+                yield self._chunk(seq, start)
+                continue
+            if self._chunks[seq] is None:
+                self._chunks[seq] = self._chunk(seq, start)
+            yield self._chunks[seq]
+        yield encode({"type": "SYNC_END", "version": self.version})
+
+    def _chunk(self, seq: int, start: int) -> Frame:
+        code = self.code[start:(seq + 1) * self.chunk_size]
+        return encode({"type": "SYNC_CHUNK", "version": self.version, "seq": seq, "offset": start, "code": code}, len(code))
+
+    def footprint(self) -> int:
+        return len(self.code) + sum(chunk.footprint() for chunk in self._chunks if chunk is not None)
@@ -1,130 +1,317 @@
+from collections import Counter
+from functools import partial
 from typing import List, Dict, Any, Optional
 from fastapi import WebSocket
 import asyncio
-import json
 import logging
 
+from app.core import metrics
+from app.core.config import settings
+from app.core.executor import cpu, loop_monitor
+from app.core.serialization import Frame
+from app.services.autocomplete_index import RoomSymbols, word_before
+from app.services.backplane import create_backplane
+from app.services.document import validate_ops
+from app.services import inbound
+from app.services.inbound import InboundQueue, TokenBucket
+from app.services.ot import Op, StaleVersionError
+from app.services.outbound import OutboundQueue
+from app.services.persistence import CodeFlusher
+from app.services.room_actor import RoomActor
+from app.services.room_state import Connection
+from app.services.room_store import RoomStore
+
 logger = logging.getLogger(__name__)
 
 class ConnectionManager:
+    # routes socket and backplane traffic to the actor of each live room
     def __init__(self):
-        self.active_connections: Dict[str, List[Dict[str, Any]]] = {}
-        self._locks: Dict[str, asyncio.Lock] = {}
-        self.latest_code: Dict[str, str] = {}
+        self.rooms: Dict[str, RoomActor] = {}
+        self.flusher = CodeFlusher(self)
+        self.store = RoomStore(
+            self, settings.ROOM_MEMORY_BUDGET, settings.ROOM_IDLE_SECONDS, settings.ROOM_MEMORY_CHECK_INTERVAL
+        )
+        self.backplane = create_backplane(self, settings.BACKPLANE, settings.BACKPLANE_SOCKET)
 
-    def set_code(self, room_id: str, code: str):
-        self.latest_code[room_id] = code
+    def set_code(self, room_id: str, code: str) -> List[Op]:
+        room = self.rooms.get(room_id)
+        return room.document.replace(code) if room and room.document is not None else []
 
     def get_code(self, room_id: str) -> Optional[str]:
-        return self.latest_code.get(room_id)
+        room = self.rooms.get(room_id)
+        return room.document.text if room and room.document is not None else None
+
+    def get_version(self, room_id: str) -> int:
+        room = self.rooms.get(room_id)
+        return room.document.version if room and room.document is not None else 0
+
+    def room_symbols(self, room_id: str) -> Optional[RoomSymbols]:
+        room = self.rooms.get(room_id)
+        return room.restore_symbols() if room else None
+
+    def room_accepted(self, room_id: str) -> Optional[RoomSymbols]:
+        room = self.rooms.get(room_id)
+        return room.accepted if room else None
 
-    def _get_lock(self, room_id: str) -> asyncio.Lock:
-        if room_id not in self._locks:
-            self._locks[room_id] = asyncio.Lock()
-        return self._locks[room_id]
+    def accept_completion(self, room_id: str, word: str) -> bool:
+        room = self.rooms.get(room_id)
+        if room is None:
+            return False
+        room.tell(room.accept, word)
+        return True
+
+    def prefix_at(self, room_id: str, cursor: int, version: Optional[int] = None) -> Optional[str]:
+        # word left of a cursor in the live document; a cursor from an older
+        # version is first moved through the op log
+        room = self.rooms.get(room_id)
+        if room is None or room.document is None:
+            return None
+        document = room.document
+        if version is not None and version != document.version:
+            try:
+                cursor = document.rebase_position(version, cursor)
+            except StaleVersionError:
+                return None
+        if cursor < 0 or cursor > document.length:
+            return None
+        window = document.rope.slice(max(0, cursor - RoomSymbols.MAX_LENGTH), cursor)
+        return word_before(window, len(window))
 
-    async def connect(self, room_id: str, websocket: WebSocket, username: str):
+    async def connect(
+        self,
+        room_id: str,
+        websocket: WebSocket,
+        username: str,
+        delta: bool = False,
+        binary: bool = False,
+        chunked: bool = False,
+    ) -> Optional[InboundQueue]:
         try:
             await websocket.accept()
-            async with self._get_lock(room_id):
-                self.active_connections.setdefault(room_id, []).append({
-                    "socket": websocket,
-                    "username": username,
-                    "typing": False
-                })
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = self.rooms[room_id] = RoomActor(room_id, self)
+            outbox = OutboundQueue(
+                websocket,
+                snapshot=partial(room.snapshot, chunked),
+                on_failure=lambda queue: self.drop_socket(room_id, queue),
+                max_depth=settings.WS_OUTBOX_SIZE,
+                send_timeout=settings.WS_SEND_TIMEOUT,
+                binary=binary,
+            )
+            inbox = InboundQueue(
+                websocket,
+                max_bytes=settings.WS_MAX_MESSAGE_BYTES,
+                max_depth=settings.WS_INBOX_SIZE,
+                bucket=TokenBucket(settings.WS_RATE, settings.WS_BURST),
+                room_bucket=room.bucket,
+            )
+            room.tell(room.add, Connection(websocket, username, delta, outbox, inbox, chunked))
+            inbox.start()
+            return inbox
         except Exception:
             logger.exception("Failed to connect websocket")
             try:
                 await websocket.close()
             except Exception:
                 pass
+            return None
+
+    async def open_room(self, room_id: str, websocket: WebSocket, code: Optional[str], members: List[str]):
+        # the first local socket of a room joins it on the backplane; code from the
+        # DB is only used when no other process has the room open
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        if room.joining is None:
+            room.seed = code
+            room.joining = asyncio.ensure_future(self.backplane.join(room_id))
+        await asyncio.shield(room.joining)
+        await room.call(room.open, id(websocket), members)
 
     async def disconnect(self, room_id: str, websocket: WebSocket):
 
         try:
-            async with self._get_lock(room_id):
-                if room_id not in self.active_connections:
-                    return
-
-                self.active_connections[room_id] = [
-                    c for c in self.active_connections[room_id] 
-                    if c["socket"] != websocket
-                ]
-                if not self.active_connections[room_id]:
-                    self.active_connections.pop(room_id, None)
-                    self._locks.pop(room_id, None)
-                    self.latest_code.pop(room_id, None)
+            await self.remove_dead_sockets(room_id, [websocket])
         except Exception:
             logger.exception("Error during websocket disconnect")
 
+    def drop_socket(self, room_id: str, queue: OutboundQueue, code: int = 1008):
+        # the writer gave up on this socket; closing it ends the receive loop as well
+        async def drop():
+            await self.remove_dead_sockets(room_id, [queue.socket])
+            await self._close_socket(queue, code)
+
+        asyncio.create_task(drop())
+
+    def close_socket(self, queue: OutboundQueue, code: int):
+        asyncio.create_task(self._close_socket(queue, code))
+
+    async def _close_socket(self, queue: OutboundQueue, code: int):
+        await queue.close()
         try:
-            await websocket.close()
+            await queue.socket.close(code=code)
         except Exception:
             pass
 
-    async def _safe_send(self, socket: WebSocket, data: str) -> bool:
+    # backplane handler
+
+    def deliver(self, room_id: str, event: Dict[str, Any]):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.tell(room.apply_event, event)
+
+    def install(self, room_id: str, state: Optional[Dict[str, Any]]):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.tell(room.install, state)
+
+    def request_state(self, room_id: str, reply):
+        # answered in order with the room's events, so the state matches the stream position
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.tell(room.reply_state, reply)
+            return
+        code = self.flusher.pending_code(room_id)
+        reply({"live": False, "code": code} if code is not None else None)
+
+    def backplane_lost(self):
+        # copies can't be kept in step any more: drop every local room and let
+        # the clients reconnect, which rebuilds the rooms from a fresh join
+        for room in list(self.rooms.values()):
+            room.tell(room.abandon)
+
+    # socket messages
+
+    async def send_snapshot(
+        self,
+        room_id: str,
+        websocket: WebSocket,
+        version: Any = None,
+        epoch: Any = None,
+        offset: Any = 0,
+    ) -> bool:
+        # a client that names the version (and epoch) it already has is caught up
+        # from there when it can be; anything malformed just gets a full snapshot
+        if not isinstance(version, int) or isinstance(version, bool) or not isinstance(epoch, str):
+            version, epoch = None, None
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            offset = 0
+        room = self.rooms.get(room_id)
+        return await room.call(room.send_snapshot, id(websocket), version, epoch, offset) if room else False
+
+    def _find(self, room_id: str, websocket: WebSocket) -> Optional[Connection]:
+        room = self.rooms.get(room_id)
+        return room.connections.get(id(websocket)) if room else None
+
+    async def _publish_edit(self, room_id: str, sender_socket: WebSocket, event: Dict[str, Any]):
+        conn = self._find(room_id, sender_socket)
+        event.update(node=self.backplane.node_id, conn=id(sender_socket), sender=conn.username if conn else "Unknown")
         try:
-            await socket.send_text(data)
-            return True
+            await self.backplane.publish(room_id, event)
         except Exception:
-            return False
+            logger.exception("Failed to publish code change")
 
     async def broadcast_code(self, room_id: str, code: str, sender_socket: WebSocket):
-        self.latest_code[room_id] = code
+        # full-text fallback: last writer wins, peers only receive the changed range
+        await self._publish_edit(room_id, sender_socket, {"kind": "code", "code": code})
+
+    async def apply_delta(self, room_id: str, base_version: Any, ops: Any, sender_socket: WebSocket):
         try:
-            async with self._get_lock(room_id):
-                if room_id not in self.active_connections:
-                    return
- 
-                connections = self.active_connections[room_id]
-                sender = next((c["username"] for c in connections if c["socket"] == sender_socket), "Unknown")
-                sockets = [c["socket"] for c in connections]
-        except Exception:
-            logger.exception("Failed to prepare broadcast")
+            if not isinstance(base_version, int) or isinstance(base_version, bool):
+                raise ValueError("missing base version")
+            ops = validate_ops(ops)
+        except ValueError:
+            # garbage never reaches the other processes, the sender is just resynced
+            await self.send_snapshot(room_id, sender_socket)
             return
 
-        message = json.dumps({"type": "CODE_UPDATE", "code": code, "sender": sender})
-        
-        dead_sockets = []
-        for socket in sockets:
-            if socket == sender_socket:
-                continue
-            
-            if not await self._safe_send(socket, message):
-                dead_sockets.append(socket)
-        
-        if dead_sockets:
-            await self.remove_dead_sockets(room_id, dead_sockets)
+        await self._publish_edit(room_id, sender_socket, {"kind": "delta", "version": base_version, "ops": ops})
 
     async def broadcast_typing(self, room_id: str, sender_socket: WebSocket, typing: bool):
         try:
-            async with self._get_lock(room_id):
-                for conn in self.active_connections.get(room_id, []):
-                    if conn["socket"] == sender_socket:
-                        conn["typing"] = typing
-                        break
+            conn = self._find(room_id, sender_socket)
+            if conn:
+                await self.backplane.publish(room_id, {"kind": "typing", "username": conn.username, "typing": bool(typing)})
         except Exception:
             pass
 
     async def remove_dead_sockets(self, room_id: str, dead_sockets: list):
+        removed = []
         try:
-            async with self._get_lock(room_id):
-                if room_id not in self.active_connections:
-                    return
-
-                self.active_connections[room_id] = [
-                    c for c in self.active_connections[room_id]
-                    if c["socket"] not in dead_sockets
-                ]
-
-                if not self.active_connections[room_id]:
-                    self.active_connections.pop(room_id, None)
-                    self._locks.pop(room_id, None)
-                    self.latest_code.pop(room_id, None)
+            room = self.rooms.get(room_id)
+            if room is None:
+                return
+            # the room's task drops the room itself once its last socket is gone
+            removed = await room.call(room.remove, dead_sockets) or []
         except Exception:
             logger.exception("Failed to remove dead sockets")
 
+        for conn in removed:
+            await conn.outbox.close()
+            await conn.inbox.close()
+
+    async def send_presence(self, room_id: str, websocket: WebSocket):
+        room = self.rooms.get(room_id)
+        if room:
+            room.tell(room.send_presence, id(websocket))
+
+    def send_to(self, room_id: str, websocket: WebSocket, frame: Frame) -> bool:
+        conn = self._find(room_id, websocket)
+        return conn.outbox.put(frame) if conn else False
+
+    def connection_stats(self) -> Dict[str, Any]:
+        # totals over the open sockets; room IDs are what lets a user into a room,
+        # so they only appear in connection_detail()
+        sent, received = Counter(), Counter()
+        connections = 0
+        for room in self.rooms.values():
+            for c in room.connections.values():
+                connections += 1
+                sent.update(c.outbox.stats())
+                received.update(c.inbox.stats())
+        return {"rooms": len(self.rooms), "connections": connections, "outbound": dict(sent), "inbound": dict(received)}
+
+    def connection_detail(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            room_id: [
+                {"username": c.username, **c.outbox.stats(), "inbound": c.inbox.stats()}
+                for c in room.connections.values()
+            ]
+            for room_id, room in self.rooms.items()
+        }
+
 manager_instance = ConnectionManager()
 
 def get_manager() -> ConnectionManager:
-    return manager_instance
\ No newline at end of file
+    return manager_instance
+
+metrics.Gauge("pair_active_rooms", "Rooms open in this process.", lambda: len(manager_instance.rooms))
+metrics.Gauge(
+    "pair_active_connections", "Sockets open in this process.",
+    lambda: sum(len(room.connections) for room in manager_instance.rooms.values()),
+)
+metrics.Gauge(
+    "pair_outbound_queued_frames", "Frames waiting to be sent, over every socket.",
+    lambda: sum(c.outbox.depth for room in manager_instance.rooms.values() for c in room.connections.values()),
+)
+metrics.Gauge(
+    "pair_room_memory_bytes", "Approximate bytes of room state, at the last memory check for live rooms.",
+    lambda: {"live": manager_instance.store.live_bytes, "cold": manager_instance.store.cold_bytes}, ["tier"],
+)
+metrics.CollectedCounter(
+    "pair_inbound_messages_total", "Inbound messages received, coalesced, throttled and closed, by event.",
+    lambda: dict(inbound.totals), ["event"],
+)
+metrics.CollectedCounter(
+    "pair_cpu_jobs_total", "CPU-bound jobs, run inline on the event loop or offloaded to the pool.",
+    lambda: dict(cpu.jobs), ["job", "where"],
+)
+metrics.CollectedCounter(
+    "pair_cpu_job_seconds_total", "Wall time of offloaded CPU-bound jobs, queueing included.",
+    lambda: dict(cpu.seconds), ["job"],
+)
+metrics.Gauge(
+    "pair_event_loop_lag_seconds", "How late the loop monitor's timer fired, over its recent samples.",
+    loop_monitor.quantiles, ["quantile"],
+)
@@ -0,0 +1,78 @@
+"""Per-request latency of the autocomplete prefix index.
+
+    python -m benchmarks.autocomplete_latency --words 100000 --requests 20000
+
+Builds a random vocabulary, then times top-k lookups for random prefixes of
+1-4 characters against the old approach (compile a regex per request and
+scan the whole word list).
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from app.services.autocomplete_index import PrefixIndex
+
+
+def vocabulary(size, seed):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(string.ascii_lowercase + "_") for _ in range(rng.randint(3, 12))))
+    return list(words)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(name, samples):
+    print(
+        f"  {name:<14} p50 {percentile(samples, 0.5) * 1e6:9.1f} us"
+        f"  p99 {percentile(samples, 0.99) * 1e6:9.1f} us"
+        f"  mean {sum(samples) / len(samples) * 1e6:9.1f} us"
+    )
+
+
+def regex_scan(words, prefix, k):
+    pattern = re.compile(rf"^{re.escape(prefix)}.*", re.IGNORECASE)
+    return [w for w in words if pattern.match(w)][:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--scan-requests", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = vocabulary(args.words, args.seed)
+
+    start = time.perf_counter()
+    index = PrefixIndex(words)
+    print(f"{len(index)} words, index built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    prefixes = [rng.choice(words)[:rng.randint(1, 4)] for _ in range(args.requests)]
+
+    samples = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.top(prefix, args.k)
+        samples.append(time.perf_counter() - start)
+    report("prefix index", samples)
+
+    samples = []
+    for prefix in prefixes[:args.scan_requests]:
+        start = time.perf_counter()
+        regex_scan(words, prefix, args.k)
+        samples.append(time.perf_counter() - start)
+    report("regex scan", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Multi-process check of the Unix-socket backplane.
+
+    python -m benchmarks.backplane_fanout --nodes 3 --clients 6 --edits 200
+
+Starts several uvicorn processes sharing one backplane socket (each on its
+own port, so clients can be spread over them deliberately), connects delta
+clients for one room round-robin across the processes and has them type
+concurrently. It then checks that
+
+  * every client converged to the same document,
+  * a client joining late on a process that never had the room gets it,
+  * every process reports every user online, and users of a killed process
+    go offline everywhere else,
+  * a user who disconnects while others stay on the same process, and the
+    users of a killed process, are marked offline in the DB: rejoining with
+    GET /rooms/{room} is accepted instead of answered 409.
+
+Reports the CODE_ACK round trip, which now includes the hop through the hub.
+Needs the `websockets` package.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+from app.services.ot import Op
+from benchmarks.ot_throughput import SimClient, random_op
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def start_hub(workdir):
+    # a standalone hub, so killing a node below never takes the hub with it
+    path = os.path.join(workdir, "backplane.sock")
+    hub = subprocess.Popen([sys.executable, "-m", "app.services.backplane", path], cwd=BACKEND)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise RuntimeError("backplane hub did not start")
+        time.sleep(0.05)
+    return hub
+
+
+def start_nodes(count, base_port, workdir):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'rooms.db')}",
+        DB_CREATE_SCHEMA="true",
+        BACKPLANE="unix",
+        BACKPLANE_SOCKET=os.path.join(workdir, "backplane.sock"),
+        PRESENCE_MAX_RATE="20",
+    )
+    nodes = []
+    for i in range(count):
+        nodes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(base_port + i), "--log-level", "warning"],
+            cwd=BACKEND,
+            env=env,
+        ))
+        # one at a time, so the processes don't race each other creating the tables
+        wait_ready(base_port + i)
+    return nodes
+
+
+def wait_ready(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"node on port {port} did not start")
+
+
+class Client:
+    def __init__(self, name, port, room):
+        self.name = name
+        self.url = f"ws://127.0.0.1:{port}/ws/{room}/{name}?features=delta"
+        self.sim = None
+        self.socket = None
+        self.users = []
+        self.sent_at = []
+        self.acks = []
+        self.snapshot = asyncio.Event()
+        self.reader = None
+
+    async def connect(self):
+        self.socket = await websockets.connect(self.url, max_size=None)
+        self.reader = asyncio.create_task(self.read())
+        await asyncio.wait_for(self.snapshot.wait(), 10)
+
+    def send(self, outbox):
+        for version, ops in outbox:
+            self.sent_at.append(time.perf_counter())
+            message = {"type": "CODE_DELTA", "version": version, "ops": [op._asdict() for op in ops]}
+            asyncio.ensure_future(self.socket.send(json.dumps(message)))
+
+    def send_pending(self):
+        outbox = []
+        self.sim.flush(outbox)
+        self.send(outbox)
+
+    async def read(self):
+        try:
+            async for raw in self.socket:
+                message = json.loads(raw)
+                kind = message["type"]
+                if kind == "CODE_UPDATE":
+                    # initial snapshot or a resync: start over from the server copy
+                    self.sim = SimClient(message["code"], message["version"])
+                    self.snapshot.set()
+                elif kind == "CODE_ACK":
+                    self.acks.append(time.perf_counter() - self.sent_at.pop(0))
+                    outbox = []
+                    self.sim.receive(("ack", message["version"], []), outbox)
+                    self.send(outbox)
+                elif kind == "CODE_DELTA":
+                    ops = [Op(o["pos"], o["delete"], o["insert"]) for o in message["ops"]]
+                    self.sim.receive(("op", message["version"], ops), [])
+                elif kind == "USER_UPDATE":
+                    self.users = message["users"]
+        except websockets.ConnectionClosed:
+            pass
+
+    @property
+    def idle(self):
+        return self.sim.inflight is None and not self.sim.buffer
+
+    def online(self):
+        return {u["username"] for u in self.users if u["online"]}
+
+
+async def wait_for(predicate, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.05)
+
+
+def rejoin_status(port, room, username):
+    url = f"http://127.0.0.1:{port}/rooms/{room}?username={username}"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+async def wait_rejoin(port, room, username, timeout=10.0):
+    # the room writes the leave to the DB in the background once it is applied
+    deadline = time.monotonic() + timeout
+    while True:
+        status = await asyncio.to_thread(rejoin_status, port, room, username)
+        if status == 200:
+            return
+        if time.monotonic() > deadline:
+            raise AssertionError(f"{username} could not rejoin: {status}")
+        await asyncio.sleep(0.1)
+
+
+async def run(args, nodes):
+    rng = random.Random(args.seed)
+    ports = [args.port + i for i in range(args.nodes)]
+
+    # one process per client in turn; the last process is left empty for the late joiner
+    serving = ports[:-1] if args.nodes > 1 else ports
+    clients = [Client(f"user{i}", serving[i % len(serving)], args.room) for i in range(args.clients)]
+    for client in clients:
+        await client.connect()
+
+    names = {c.name for c in clients}
+    await wait_for(lambda: all(c.online() == names for c in clients), 10, "presence on every process")
+    print(f"{args.clients} clients on {len(serving)} processes see each other online")
+
+    start = time.perf_counter()
+    for _ in range(args.edits):
+        client = rng.choice(clients)
+        client.sim.edit(random_op(rng, client.sim.text))
+        client.send_pending()
+        await asyncio.sleep(rng.random() * args.pause)
+    await wait_for(lambda: all(c.idle for c in clients), 30, "outstanding acks")
+    await wait_for(lambda: len({c.sim.text for c in clients}) == 1, 10, "convergence")
+    elapsed = time.perf_counter() - start
+    document = clients[0].sim.text
+    print(f"{args.edits} edits converged on {len(document)} characters in {elapsed:.2f}s")
+
+    acks = [a for c in clients for a in c.acks]
+    print(
+        f"  ack round trip p50 {percentile(acks, 0.5) * 1000:.2f} ms"
+        f"  p99 {percentile(acks, 0.99) * 1000:.2f} ms  over {len(acks)} deltas"
+    )
+
+    late = Client("late", ports[-1], args.room)
+    await late.connect()
+    assert late.sim.text == document, "late joiner got a different document"
+    print(f"late joiner on port {ports[-1]} received version {late.sim.version}")
+
+    # one user leaves a process that keeps the room open for the others there
+    keeper = serving[-1]
+    local = [c for c in clients if c.url.startswith(f"ws://127.0.0.1:{keeper}/")]
+    if len(local) > 1:
+        leaver = local[-1]
+        clients.remove(leaver)
+        await leaver.socket.close()
+        leaver.reader.cancel()
+        await wait_for(lambda: all(leaver.name not in c.online() for c in clients + [late]), 10, "leaver offline")
+        await wait_rejoin(ports[0], args.room, leaver.name)
+        print(f"{leaver.name} left port {keeper} with {len(local) - 1} others still there, and could rejoin")
+
+    if args.nodes > 2:
+        victim = serving[0]
+        gone = {c.name for c in clients if c.url.startswith(f"ws://127.0.0.1:{victim}/")}
+        nodes[0].send_signal(signal.SIGKILL)
+        survivors = [c for c in clients + [late] if c.name not in gone]
+        await wait_for(lambda: all(not (c.online() & gone) for c in survivors), 10, "killed process users offline")
+        print(f"killed port {victim}: {sorted(gone)} went offline on the remaining processes")
+        for name in gone:
+            await wait_rejoin(ports[-1], args.room, name)
+        print(f"  and could rejoin through port {ports[-1]}")
+
+    for client in clients + [late]:
+        await client.socket.close()
+        client.reader.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=6)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--pause", type=float, default=0.005)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--room", default="backplane-check")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        hub = start_hub(workdir)
+        nodes = []
+        try:
+            nodes = start_nodes(args.nodes, args.port, workdir)
+            asyncio.run(run(args, nodes))
+        finally:
+            # nodes first: they would report the hub as lost otherwise
+            for process in nodes + [hub]:
+                if process.poll() is None:
+                    process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Micro-benchmark for broadcast serialization cost.
+
+    python -m benchmarks.broadcast_encoding --size 102400 --peers 10
+
+Compares the old per-recipient paths (send_json per joiner, json.dumps once
+plus a UTF-8 encode per send_text) against pre-encoded frames, where a
+message is serialized once and every recipient reuses the same buffer.
+Throughput is payload bytes delivered to all peers per second.
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from app.core import serialization
+
+
+def sample_document(size, seed):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "    \n()[]{}:=,.\"'"
+    return "".join(rng.choice(alphabet) for _ in range(size))
+
+
+def send_json_per_peer(message, peers):
+    # websocket.send_json: serialize and encode for every recipient
+    sent = 0
+    for _ in range(peers):
+        sent += len(json.dumps(message).encode("utf-8"))
+    return sent
+
+
+def dumps_once_send_text(message, peers):
+    # the old broadcast_code: one json.dumps, then send_text encodes per socket
+    text = json.dumps(message)
+    sent = 0
+    for _ in range(peers):
+        sent += len(text.encode("utf-8"))
+    return sent
+
+
+def frame_text(message, peers):
+    # pre-encoded frame delivered as text: one encode, one shared decode
+    frame = serialization.encode(message)
+    sent = 0
+    for _ in range(peers):
+        sent += len(frame.text)
+    return sent
+
+
+def frame_bytes(message, peers):
+    # pre-encoded frame delivered as bytes: the buffer is reused untouched
+    frame = serialization.encode(message)
+    sent = 0
+    for _ in range(peers):
+        sent += len(frame.data)
+    return sent
+
+
+def measure(fn, message, peers, repeat):
+    start = time.perf_counter()
+    sent = 0
+    for _ in range(repeat):
+        sent += fn(message, peers)
+    elapsed = time.perf_counter() - start
+    return sent / elapsed, elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100 * 1024)
+    parser.add_argument("--peers", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    message = {"type": "CODE_UPDATE", "code": sample_document(args.size, args.seed), "version": 1, "sender": "bench"}
+    cases = [
+        ("send_json per peer", send_json_per_peer, None),
+        ("dumps once + send_text", dumps_once_send_text, None),
+    ]
+    for backend in ("json", "orjson"):
+        serialization.use_backend(backend)
+        if serialization.backend_name == backend:
+            cases.append((f"frame[{backend}] as text", frame_text, backend))
+            cases.append((f"frame[{backend}] as bytes", frame_bytes, backend))
+
+    print(f"{args.size // 1024} KB document, {args.peers} peers, {args.repeat} broadcasts")
+    for name, fn, backend in cases:
+        if backend:
+            serialization.use_backend(backend)
+        rate, per_broadcast = measure(fn, message, args.peers, args.repeat)
+        print(f"  {name:<28} {rate / 1e6:10.1f} MB/s  {per_broadcast * 1e6:10.1f} us/broadcast")
+
+
+if __name__ == "__main__":
+    main()
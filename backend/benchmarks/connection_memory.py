@@ -0,0 +1,103 @@
+"""Memory held per idle connection inside one process.
+
+    python -m benchmarks.connection_memory --connections 10000 --rooms 100
+
+Opens idle connections through ConnectionManager.connect/open_room, spread
+over a number of rooms, with the in-process backplane, and measures what the
+manager keeps for them: traced Python allocations (tracemalloc) and the
+process RSS. The sockets are in-memory stand-ins that accept, count frames
+and drop them, so the numbers cover the server-side records only (connection
+record, inbound reader task, outbound queue, presence, room actor) and not the
+network stack.
+"""
+import argparse
+import asyncio
+import gc
+import resource
+import time
+import tracemalloc
+
+from app.services.websocket_manager import ConnectionManager
+
+
+class IdleSocket:
+    # the part of starlette's WebSocket the manager uses
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames += 1
+
+    async def receive(self):
+        # an idle client never sends anything
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        pass
+
+
+def rss_kb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def settle():
+    # let room tasks and writers drain whatever the joins queued
+    for _ in range(20):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.05)
+
+
+async def run(args):
+    manager = ConnectionManager()
+    sockets = [IdleSocket() for _ in range(args.connections)]
+    rooms = [f"room-{i}" for i in range(args.rooms)]
+    members = {room: [f"user{i}" for i in range(n, args.connections, args.rooms)] for n, room in enumerate(rooms)}
+
+    gc.collect()
+    tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = rss_kb()
+    start = time.perf_counter()
+
+    for i, websocket in enumerate(sockets):
+        room = rooms[i % args.rooms]
+        await manager.connect(room, websocket, f"user{i}", delta=True)
+        await manager.open_room(room, websocket, "", members[room])
+    await settle()
+
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] - traced_before
+    rss = rss_kb() - rss_before
+    tracemalloc.stop()
+
+    connections = sum(len(room.connections) for room in manager.rooms.values())
+    assert connections == args.connections, f"{connections} of {args.connections} connections registered"
+    frames = sum(s.frames for s in sockets)
+    print(f"{args.connections} idle connections in {args.rooms} rooms, opened in {elapsed:.2f}s ({frames} frames sent)")
+    print(f"  traced  {traced / 1024 / 1024:8.2f} MiB  {traced / args.connections:8.0f} bytes/connection")
+    print(f"  rss     {rss / 1024:8.2f} MiB  {rss * 1024 / args.connections:8.0f} bytes/connection")
+
+    for i, websocket in enumerate(sockets):
+        await manager.disconnect(rooms[i % args.rooms], websocket)
+    await settle()
+    assert not manager.rooms, "rooms left open after every socket disconnected"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
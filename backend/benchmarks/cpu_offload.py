@@ -0,0 +1,176 @@
+"""Event-loop responsiveness while one room pastes a large document.
+
+    python -m benchmarks.cpu_offload --size 5242880 --pastes 5 --modes inline,thread,process
+
+For each CPU_EXECUTOR in --modes, starts `app.main:app` under uvicorn on a
+throwaway SQLite database. One client in a "paste" room (with a peer, so
+every paste is broadcast) sends --pastes full-text CODE_UPDATEs of --size
+characters, each a different document. Meanwhile --pingers clients, each in
+a room of its own, keep sending one-character CODE_DELTAs and time the
+CODE_ACK that answers each one: the round trip a user in an unrelated room
+sees while the paste is being parsed, diffed, hashed and encoded.
+
+Reported per mode: the ping round trip (p50, p99, max) during the pastes,
+how long the pastes took to reach the peer, and the server's own event-loop
+lag from GET /stats/loop, with the jobs it ran inline and offloaded. Needs
+the `websockets` package.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from benchmarks.backplane_fanout import BACKEND, percentile, wait_ready
+from benchmarks.room_load import fetch_stats
+from benchmarks.wire_encoding import sample_document
+
+
+class Pinger:
+    def __init__(self, url):
+        self.url = url
+        self.version = None
+        self.rtts = []
+        self.socket = None
+
+    async def run(self, stop, interval):
+        async with websockets.connect(self.url, max_size=None) as socket:
+            while self.version is None:
+                message = json.loads(await socket.recv())
+                if message["type"] == "CODE_UPDATE":
+                    self.version = message["version"]
+            while not stop.is_set():
+                sent = time.perf_counter()
+                await socket.send(json.dumps({
+                    "type": "CODE_DELTA", "version": self.version, "ops": [{"pos": 0, "delete": 0, "insert": "x"}],
+                }))
+                while True:
+                    message = json.loads(await socket.recv())
+                    if message["type"] == "CODE_ACK":
+                        self.version = message["version"]
+                        break
+                self.rtts.append(time.perf_counter() - sent)
+                await asyncio.sleep(interval)
+
+
+async def receive_until(socket, marker):
+    # the peer's copy of a paste is the CODE_UPDATE or CODE_DELTA that carries its marker
+    while True:
+        raw = await socket.recv()
+        if marker in raw[-200:] or marker in raw[:200]:
+            return time.perf_counter()
+
+
+async def run(args, url, http):
+    rng = random.Random(args.seed)
+    documents = [sample_document(args.size, args.seed + i) for i in range(args.pastes)]
+
+    pinger_stop = asyncio.Event()
+    pingers = [Pinger(f"{url}/ws/ping-{i}/pinger{i}?features=delta") for i in range(args.pingers)]
+    tasks = [asyncio.create_task(p.run(pinger_stop, args.interval)) for p in pingers]
+
+    paster = await websockets.connect(f"{url}/ws/paste/paster", max_size=None)
+    peer = await websockets.connect(f"{url}/ws/paste/peer", max_size=None)
+    await asyncio.sleep(1.0)
+    # the ping round trips before the paste, as a baseline
+    baseline = [rtt for p in pingers for rtt in p.rtts]
+    for p in pingers:
+        p.rtts = []
+
+    delivered = []
+    start = time.perf_counter()
+    for n, document in enumerate(documents):
+        marker = f"# paste {n} {rng.random()}"
+        sent = time.perf_counter()
+        await paster.send(json.dumps({"type": "CODE_UPDATE", "code": document + marker}))
+        delivered.append(await asyncio.wait_for(receive_until(peer, marker), 120) - sent)
+    pasting = time.perf_counter() - start
+    # let checkpoints and revisions of the pasted code run while the pingers keep going
+    await asyncio.sleep(args.settle)
+    pinger_stop.set()
+    await asyncio.gather(*tasks)
+    await paster.close()
+    await peer.close()
+
+    rtts = [rtt for p in pingers for rtt in p.rtts]
+    return {
+        "baseline_p99_ms": percentile(baseline, 0.99) * 1000,
+        "ping_p50_ms": percentile(rtts, 0.5) * 1000,
+        "ping_p99_ms": percentile(rtts, 0.99) * 1000,
+        "ping_max_ms": max(rtts, default=0.0) * 1000,
+        "pings": len(rtts),
+        "paste_ms": sum(delivered) / len(delivered) * 1000,
+        "pasting_s": pasting,
+        "stats": fetch_stats(http, "/stats/loop"),
+    }
+
+
+def start_server(args, mode, port, workdir):
+    env = dict(os.environ, **dict(pair.split("=", 1) for pair in args.server_env))
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, f'{mode}.db')}",
+        "DB_CREATE_SCHEMA": "true",
+        "CPU_EXECUTOR": mode,
+        "CPU_WORKERS": str(args.workers),
+        "WS_MAX_MESSAGE_BYTES": str(4 * args.size),
+        "LOOP_LAG_INTERVAL": "0.01",
+        "LOOP_LAG_WARN_SECONDS": "0",
+        # the pingers send as fast as the acks come back
+        "WS_RATE": "0",
+        "WS_ROOM_RATE": "0",
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning", "--ws-max-size", str(8 * args.size)],
+        cwd=BACKEND,
+        env=env,
+    )
+    wait_ready(port)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=5 * 1024 * 1024, help="characters per pasted document")
+    parser.add_argument("--pastes", type=int, default=5)
+    parser.add_argument("--modes", default="inline,thread,process", help="CPU_EXECUTOR values to compare")
+    parser.add_argument("--workers", type=int, default=2, help="CPU_WORKERS")
+    parser.add_argument("--pingers", type=int, default=4, help="clients in rooms of their own")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between a pinger's ack and its next edit")
+    parser.add_argument("--settle", type=float, default=8.0, help="seconds to keep pinging after the last paste")
+    parser.add_argument("--port", type=int, default=8960)
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="extra settings for the server")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.pastes} pastes of {args.size // 1024} KB, {args.pingers} pinging rooms")
+    print(
+        f"  {'mode':<8} {'ping p50':>9} {'p99':>8} {'max':>8} {'idle p99':>9} {'paste ms':>9}"
+        f" {'loop p99':>9} {'loop max':>9}  offloaded jobs"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        for n, mode in enumerate(args.modes.split(",")):
+            port = args.port + n
+            server = start_server(args, mode, port, workdir)
+            try:
+                result = asyncio.run(run(args, f"ws://127.0.0.1:{port}", f"http://127.0.0.1:{port}"))
+            finally:
+                server.terminate()
+                server.wait()
+            loop = (result["stats"] or {}).get("loop", {})
+            jobs = (result["stats"] or {}).get("cpu", {}).get("jobs", {})
+            offloaded = ", ".join(f"{job.split(':')[0]} {count}" for job, count in jobs.items() if job.endswith(":offloaded"))
+            print(
+                f"  {mode:<8} {result['ping_p50_ms']:>9.1f} {result['ping_p99_ms']:>8.1f} {result['ping_max_ms']:>8.1f}"
+                f" {result['baseline_p99_ms']:>9.1f} {result['paste_ms']:>9.0f}"
+                f" {loop.get('p99_ms', 0.0):>9.1f} {loop.get('max_since_start_ms', 0.0):>9.1f}  {offloaded or '-'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
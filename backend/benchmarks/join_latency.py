@@ -0,0 +1,310 @@
+"""Join latency against document size, one CODE_UPDATE against a chunked stream.
+
+    python -m benchmarks.join_latency --sizes 65536,1048576,4194304 --bandwidth-mbps 100
+
+For each document size, a room is opened through ConnectionManager (in-process
+backplane) and --editors sockets keep sending small CODE_DELTA edits while a
+new client joins. The joiner connects either as a plain delta client, which
+gets the document as one CODE_UPDATE, or with ?features=chunked, which gets
+SYNC_START, SYNC_CHUNK... and SYNC_END. Its socket is an in-memory stand-in
+that holds each frame for its size over --bandwidth-mbps, as a network link
+would. Reported per row:
+
+  first     time from the join until the first piece of code arrives (first paint)
+  complete  time until the joiner has the whole document
+  stall     longest event-loop stall during the join, as seen by a 1 ms ticker
+  converged the joiner's copy, with the edits buffered during the transfer
+            applied after it, equals the room's document once the edits stop
+
+Frames are decoded after each run, so client-side parsing is not counted as
+server time. Two reconnect checks follow for the chunked client: a transfer
+cut off half way resumes from its offset (?version=&epoch=&offset=), and a
+client that missed a few edits is caught up with one CODE_DELTA instead of
+the document.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.wire_encoding import sample_document
+
+
+class Closed(Exception):
+    pass
+
+
+class JoinSocket:
+    # the part of starlette's WebSocket the manager uses; frames are kept with
+    # their arrival time and decoded after the run
+    def __init__(self, bandwidth, drop_after=None):
+        self.bandwidth = bandwidth
+        self.drop_after = drop_after
+        self.frames = []
+        self.bytes = 0
+        # set by the frame that completes the document
+        self.synced = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.drop_after is not None and len(self.frames) >= self.drop_after:
+            raise Closed()
+        await asyncio.sleep(len(text) / self.bandwidth)
+        self.frames.append((time.perf_counter(), text))
+        self.bytes += len(text)
+        self.synced |= text.startswith(('{"type":"SYNC_END"', '{"type":"CODE_UPDATE"'))
+
+    async def receive(self):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        pass
+
+
+class Client:
+    # what a chunked delta client does with the frames: edits that arrive while a
+    # stream is unfinished are buffered and applied after SYNC_END
+    def __init__(self):
+        self.code = ""
+        self.version = None
+        self.epoch = None
+        self.first = None
+        self.complete = None
+        self._parts = None
+        self._length = 0
+        self._buffered = []
+
+    def feed(self, frames):
+        for at, text in frames:
+            message = json.loads(text)
+            kind = message["type"]
+            if kind == "CODE_UPDATE":
+                # replaces an unfinished stream, if there is one
+                self._parts, self._buffered = None, []
+                self.code, self.version, self.epoch = message["code"], message["version"], message.get("epoch")
+                self.first = self.first or at
+                self.complete = at
+            elif kind == "SYNC_START":
+                # a new stream replaces an unfinished one, a resumed one continues it
+                self._buffered = []
+                held = "".join(self._parts) if self._parts is not None else self.code
+                self._parts = [held[:message["offset"]]] if message["offset"] else []
+                self._length = message["length"]
+                self.version, self.epoch = message["version"], message["epoch"]
+            elif kind == "SYNC_CHUNK":
+                assert message["offset"] == sum(len(p) for p in self._parts), "chunk out of order"
+                self._parts.append(message["code"])
+                self.first = self.first or at
+            elif kind == "SYNC_END":
+                self.code = "".join(self._parts)
+                assert len(self.code) == self._length, "stream ended short"
+                self._parts = None
+                self.complete = at
+                for delta in self._buffered:
+                    self._apply(delta)
+                self._buffered = []
+            elif kind == "CODE_DELTA":
+                if self._parts is not None:
+                    self._buffered.append(message)
+                else:
+                    self._apply(message)
+
+    def _apply(self, message):
+        if self.version is not None and message["version"] <= self.version:
+            return
+        for op in message["ops"]:
+            self.code = self.code[:op["pos"]] + op["insert"] + self.code[op["pos"] + op["delete"]:]
+        self.version = message["version"]
+
+    @property
+    def received(self):
+        # characters held of an unfinished stream
+        return sum(len(p) for p in self._parts) if self._parts is not None else len(self.code)
+
+
+async def settle(seconds=0.0):
+    for _ in range(10):
+        await asyncio.sleep(0)
+    if seconds:
+        await asyncio.sleep(seconds)
+
+
+async def ticker(lags, stop):
+    # how late a 1 ms sleep wakes up is how long the loop was busy elsewhere
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def editor(manager, room_id, socket, rng, rate, stop):
+    while not stop.is_set():
+        await asyncio.sleep(rng.expovariate(rate))
+        # the length only, get_code would join the whole document on every edit
+        length = manager.rooms[room_id].document.length
+        ops = [{"pos": rng.randint(0, length), "delete": 0, "insert": f"e{rng.randint(0, 99)} "}]
+        await manager.apply_delta(room_id, manager.get_version(room_id), ops, socket)
+
+
+async def wait_for(predicate, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("timed out")
+        await asyncio.sleep(0.005)
+
+
+async def join(manager, room_id, args, chunked, rng):
+    from benchmarks.connection_memory import IdleSocket
+
+    editors = [IdleSocket() for _ in range(args.editors)]
+    for i, socket in enumerate(editors):
+        await manager.connect(room_id, socket, f"editor{i}", delta=True)
+        await manager.open_room(room_id, socket, None, [])
+    await settle(0.05)
+
+    stop, lags = asyncio.Event(), []
+    tasks = [asyncio.create_task(editor(manager, room_id, s, rng, args.edit_rate, stop)) for s in editors]
+    await asyncio.sleep(0.05)
+    monitor = asyncio.Event()
+    lag_task = asyncio.create_task(ticker(lags, monitor))
+
+    socket = JoinSocket(args.bandwidth)
+    started = time.perf_counter()
+    await manager.connect(room_id, socket, "joiner", delta=True, chunked=chunked)
+    await manager.open_room(room_id, socket, None, [])
+    await manager.send_snapshot(room_id, socket)
+    await wait_for(lambda: socket.synced)
+    monitor.set()
+    await lag_task
+
+    # a little more editing after the transfer, then let everything drain
+    await asyncio.sleep(0.05)
+    stop.set()
+    await asyncio.gather(*tasks)
+    version = manager.get_version(room_id)
+    await wait_for(lambda: any(f'"version":{version},' in t[:100] for _, t in socket.frames[-5:]))
+
+    client = Client()
+    client.feed(socket.frames)
+    converged = client.code == manager.get_code(room_id)
+    await manager.disconnect(room_id, socket)
+    return {
+        "first": (client.first - started) * 1000,
+        "complete": (client.complete - started) * 1000,
+        "stall": max(lags, default=0.0) * 1000,
+        "frames": len(socket.frames),
+        "bytes": socket.bytes,
+        "converged": converged,
+    }, editors
+
+
+async def reconnects(manager, room_id, args):
+    # a transfer cut off half way, then resumed from where it stopped
+    chunks = -(-len(manager.get_code(room_id)) // args.chunk)
+    cut = JoinSocket(args.bandwidth, drop_after=1 + chunks // 2)
+    await manager.connect(room_id, cut, "flaky", delta=True, chunked=True)
+    await manager.open_room(room_id, cut, None, [])
+    await manager.send_snapshot(room_id, cut)
+    await settle(0.2)
+    partial = Client()
+    partial.feed(cut.frames)
+    await manager.disconnect(room_id, cut)
+
+    resumed = JoinSocket(args.bandwidth)
+    await manager.connect(room_id, resumed, "flaky", delta=True, chunked=True)
+    await manager.open_room(room_id, resumed, None, [])
+    await manager.send_snapshot(room_id, resumed, partial.version, partial.epoch, partial.received)
+    await wait_for(lambda: resumed.synced)
+    resumed_at = partial.received
+    partial.feed(resumed.frames)
+    ok = partial.code == manager.get_code(room_id)
+    print(
+        f"  resume: cut after {resumed_at} of {len(partial.code)} characters, resent {resumed.bytes} bytes"
+        f" in {len(resumed.frames)} frames, {'converged' if ok else 'DIVERGED'}"
+    )
+    assert ok, "resumed stream did not converge"
+
+    # the same client misses a few edits while it is away
+    editor_socket = next(iter(manager.rooms[room_id].connections.values())).socket
+    await manager.disconnect(room_id, resumed)
+    await settle()
+    for i in range(args.missed):
+        await manager.apply_delta(room_id, manager.get_version(room_id), [{"pos": i, "delete": 0, "insert": "x"}], editor_socket)
+    await settle()
+    back = JoinSocket(args.bandwidth)
+    await manager.connect(room_id, back, "flaky", delta=True, chunked=True)
+    await manager.open_room(room_id, back, None, [])
+    await manager.send_snapshot(room_id, back, partial.version, partial.epoch)
+    await wait_for(lambda: back.frames)
+    partial.feed(back.frames)
+    ok = partial.code == manager.get_code(room_id)
+    kind = json.loads(back.frames[0][1])["type"]
+    print(f"  catch up: {args.missed} missed edits sent as {kind}, {back.bytes} bytes, {'converged' if ok else 'DIVERGED'}")
+    assert ok and kind == "CODE_DELTA", "catch-up did not converge"
+    await manager.disconnect(room_id, back)
+
+
+async def run(args):
+    # the app reads its settings on import, so the database is picked first
+    from app.core.config import settings
+    from app.core.migrations import create_schema
+    from app.services.websocket_manager import ConnectionManager
+
+    await create_schema()
+    settings.SYNC_CHUNK_SIZE = args.chunk
+    # the editors are the only ones sending, don't let the rate limits slow them
+    settings.WS_RATE = settings.WS_ROOM_RATE = 0
+
+    rng = random.Random(args.seed)
+    manager = ConnectionManager()
+    print(
+        f"{args.editors} editors at {args.edit_rate:g} edits/s each, {args.bandwidth * 8 / 1e6:g} Mbit/s link,"
+        f" {args.chunk // 1024} KB chunks"
+    )
+    print(f"  {'size':>8} {'mode':<8} {'first ms':>9} {'complete ms':>12} {'stall ms':>9} {'frames':>7} {'bytes':>10}  converged")
+    for n, size in enumerate(int(s) for s in args.sizes.split(",")):
+        for mode in ("single", "chunked"):
+            room_id = f"room-{n}-{mode}"
+            host = JoinSocket(float("inf"))
+            await manager.connect(room_id, host, "host", delta=True)
+            await manager.open_room(room_id, host, sample_document(size, args.seed), [])
+            await settle()
+            result, editors = await join(manager, room_id, args, mode == "chunked", rng)
+            print(
+                f"  {size // 1024:>6}KB {mode:<8} {result['first']:>9.1f} {result['complete']:>12.1f}"
+                f" {result['stall']:>9.2f} {result['frames']:>7} {result['bytes']:>10}  {result['converged']}"
+            )
+            assert result["converged"], f"{room_id} joiner did not converge"
+            if mode == "chunked" and n == 0 and size > args.chunk:
+                await reconnects(manager, room_id, args)
+            for socket in editors + [host]:
+                await manager.disconnect(room_id, socket)
+            await settle()
+    await manager.flusher.flush(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="262144,1048576,4194304,16777216", help="document sizes in characters")
+    parser.add_argument("--chunk", type=int, default=64 * 1024, help="SYNC_CHUNK_SIZE")
+    parser.add_argument("--editors", type=int, default=2)
+    parser.add_argument("--edit-rate", type=float, default=50.0, help="edits per second per editor")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0)
+    parser.add_argument("--missed", type=int, default=5, help="edits made while the client is away")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.bandwidth = args.bandwidth_mbps * 1e6 / 8
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'rooms.db')}"
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Convergence check and throughput benchmark for the room merge engine.
+
+    python -m benchmarks.ot_throughput --rounds 200 --ops 20000
+
+The convergence phase drives several simulated clients through randomly
+interleaved edits, deliveries and acks and fails if any replica diverges
+from the server document. The throughput phase measures ops/sec for one
+room, both for in-order typing and for writers lagging behind the server.
+"""
+import argparse
+import random
+import string
+import time
+from collections import deque
+
+from app.services.ot import MergeEngine, Op, transform
+
+
+def apply_text(text, ops):
+    for op in ops:
+        text = text[:op.pos] + op.insert + text[op.pos + op.delete:]
+    return text
+
+
+def random_op(rng, text):
+    if text and rng.random() < 0.4:
+        pos = rng.randrange(len(text))
+        return Op(pos, rng.randint(1, min(8, len(text) - pos)), "")
+    pos = rng.randint(0, len(text))
+    return Op(pos, 0, "".join(rng.choice(string.ascii_lowercase + " \n") for _ in range(rng.randint(1, 6))))
+
+
+class SimClient:
+    # mirrors what a browser client does: one op list in flight, the rest buffered
+    def __init__(self, text, version):
+        self.text = text
+        self.version = version
+        self.inflight = None
+        self.buffer = []
+        self.inbox = deque()
+
+    def edit(self, op):
+        self.text = apply_text(self.text, [op])
+        self.buffer.append(op)
+
+    def flush(self, outbox):
+        if self.inflight is None and self.buffer:
+            self.inflight, self.buffer = self.buffer, []
+            outbox.append((self.version, self.inflight))
+
+    def receive(self, message, outbox):
+        kind, version, ops = message
+        self.version = version
+        if kind == "ack":
+            self.inflight = None
+            self.flush(outbox)
+            return
+
+        if self.inflight:
+            self.inflight, ops = transform(self.inflight, ops)
+        if self.buffer:
+            self.buffer, ops = transform(self.buffer, ops)
+        self.text = apply_text(self.text, ops)
+
+
+def converge_round(rng, clients_count, steps):
+    initial = "".join(rng.choice(string.ascii_lowercase + "\n") for _ in range(rng.randint(0, 200)))
+    server = MergeEngine(initial)
+    reference = initial
+    clients = [SimClient(initial, 0) for _ in range(clients_count)]
+    upstream = [deque() for _ in clients]
+
+    def server_step(index):
+        nonlocal reference
+        base, ops = upstream[index].popleft()
+        ops = server.submit(base, ops)
+        reference = apply_text(reference, ops)
+        assert str(server.rope) == reference, "rope diverged from reference string"
+        for other, client in enumerate(clients):
+            kind = "ack" if other == index else "op"
+            client.inbox.append((kind, server.version, ops))
+
+    for _ in range(steps):
+        action = rng.random()
+        index = rng.randrange(clients_count)
+        client = clients[index]
+        if action < 0.4:
+            client.edit(random_op(rng, client.text))
+            client.flush(upstream[index])
+        elif action < 0.7 and upstream[index]:
+            server_step(index)
+        elif client.inbox:
+            client.receive(client.inbox.popleft(), upstream[index])
+
+    while any(upstream) or any(c.inbox for c in clients):
+        for index, client in enumerate(clients):
+            while upstream[index]:
+                server_step(index)
+            while client.inbox:
+                client.receive(client.inbox.popleft(), upstream[index])
+
+    for client in clients:
+        assert client.text == server.text, "client diverged from server"
+    return server.version
+
+
+def check_convergence(rounds, clients_count, steps, seed):
+    rng = random.Random(seed)
+    versions = 0
+    for _ in range(rounds):
+        versions += converge_round(rng, clients_count, steps)
+    print(f"convergence: {rounds} rounds, {clients_count} clients, {versions} server versions, all replicas equal")
+
+
+def bench_throughput(doc_size, ops_count, lag, seed):
+    rng = random.Random(seed)
+    engine = MergeEngine("".join(rng.choice(string.ascii_lowercase + "\n") for _ in range(doc_size)))
+    lengths = {engine.version: engine.length}
+    ops = []
+    for _ in range(ops_count):
+        ops.append((rng.randint(0, lag), rng.random()))
+
+    start = time.perf_counter()
+    rejected = 0
+    for behind, roll in ops:
+        base = max(engine.version - behind, min(lengths))
+        length = lengths[base]
+        pos = int(roll * max(length - 16, 1))
+        op = [Op(pos, 4, "")] if roll < 0.3 else [Op(pos, 0, "abcd")]
+        try:
+            engine.submit(base, op)
+        except ValueError:
+            rejected += 1
+        lengths[engine.version] = engine.length
+        if len(lengths) > lag + 1:
+            lengths.pop(min(lengths))
+    elapsed = time.perf_counter() - start
+
+    label = "in-order" if lag == 0 else f"lag<={lag}"
+    print(f"throughput ({label}, {doc_size // 1024} KB doc): {ops_count / elapsed:,.0f} ops/sec, {rejected} rejected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--doc-size", type=int, default=200 * 1024)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--lag", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_convergence(args.rounds, args.clients, args.steps, args.seed)
+    bench_throughput(args.doc_size, args.ops, 0, args.seed)
+    bench_throughput(args.doc_size, args.ops, args.lag, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Storage growth of the revision store over a long editing session.
+
+    python -m benchmarks.revision_storage --edits 20000 --save-every 50
+
+Simulates one room being edited for a long time: random typing and deletes
+(the same generator as ot_throughput) applied to a document seeded with
+`--initial` characters, saved through RevisionService.append every
+`--save-every` edits into a throwaway SQLite database. Reports the bytes
+stored against keeping a full copy per save, and the time to fetch
+revisions, which grows with the distance to the previous snapshot and is
+capped by REVISION_SNAPSHOT_INTERVAL.
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import tempfile
+import time
+
+from benchmarks.ot_throughput import random_op
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def sample_document(rng, size):
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        indent = " " * 4 * rng.randint(0, 3)
+        words = " ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9))) for _ in range(rng.randint(1, 8)))
+        lines.append(indent + words + "\n")
+    return "".join(lines)
+
+
+async def run(args):
+    # the app reads its settings on import, so the database is picked first
+    from sqlalchemy import func, select
+
+    from app.core.config import settings
+    from app.core.database import SessionLocal, dispose_engine
+    from app.core.migrations import create_schema
+    from app.models.room import Room, RoomRevision
+    from app.services.revision_service import RevisionService
+
+    settings.REVISION_SNAPSHOT_INTERVAL = args.interval
+    await create_schema()
+
+    rng = random.Random(args.seed)
+    text = sample_document(rng, args.initial)
+    saves = []
+    full_bytes = 0
+    append_ms = []
+    async with SessionLocal() as db:
+        db.add(Room(id="bench", code=text, limit=5))
+        await db.commit()
+
+        for edit in range(1, args.edits + 1):
+            op = random_op(rng, text)
+            text = text[:op.pos] + op.insert + text[op.pos + op.delete:]
+            if edit % args.save_every:
+                continue
+            start = time.perf_counter()
+            row = await RevisionService.append(db, "bench", text, "bench")
+            await db.commit()
+            append_ms.append((time.perf_counter() - start) * 1000)
+            if row is not None:
+                saves.append((row.revision, text))
+                full_bytes += len(text.encode("utf-8"))
+
+        stored, snapshots = (await db.execute(
+            select(func.sum(func.length(RoomRevision.data)), func.count().filter(RoomRevision.snapshot.is_(True))).where(RoomRevision.room_id == "bench")
+        )).one()
+
+        fetch_ms = []
+        for revision, expected in rng.sample(saves, min(args.fetches, len(saves))):
+            start = time.perf_counter()
+            _, code = await RevisionService.fetch(db, "bench", revision)
+            fetch_ms.append((time.perf_counter() - start) * 1000)
+            assert code == expected, f"revision {revision} did not round-trip"
+
+    await dispose_engine()
+    print(f"{args.edits} edits, {len(saves)} revisions, final document {len(text)} characters")
+    print(f"  full copies   {full_bytes / 1024:10.1f} KiB")
+    print(f"  stored        {stored / 1024:10.1f} KiB  ({stored / full_bytes:.1%}, {int(snapshots)} snapshots every <= {args.interval})")
+    print(f"  per revision  {stored / len(saves):10.0f} bytes")
+    print(f"  append  p50 {percentile(append_ms, 0.5):.2f} ms  p99 {percentile(append_ms, 0.99):.2f} ms")
+    print(f"  fetch   p50 {percentile(fetch_ms, 0.5):.2f} ms  p99 {percentile(fetch_ms, 0.99):.2f} ms  over {len(fetch_ms)} revisions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edits", type=int, default=20000)
+    parser.add_argument("--save-every", type=int, default=50)
+    parser.add_argument("--initial", type=int, default=20000)
+    parser.add_argument("--interval", type=int, default=20)
+    parser.add_argument("--fetches", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'revisions.db')}"
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
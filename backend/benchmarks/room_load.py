@@ -0,0 +1,300 @@
+"""Load test: N rooms x M editors against the real app.
+
+    python -m benchmarks.room_load --rooms 20 --editors 5 --rate 2 --duration 30 --output run.json
+
+Starts `app.main:app` under uvicorn (a subprocess by default, or in this
+process with --in-process) on a throwaway SQLite database, or on
+--database-url for a local Postgres, and connects rooms x editors
+WebSocket clients. Every editor sends full-text CODE_UPDATEs at --rate per
+second and TYPING_UPDATEs at --typing-rate per second, with exponential
+gaps. Each update carries a marker, so every peer that receives it records
+the broadcast latency.
+
+Reports messages sent and received per second, p50/p99/max broadcast
+latency, and the server's CPU and peak RSS. In-process runs count the load
+generator's CPU and memory as well. With --output, the parameters, results
+and the server's /stats/inbound and /stats/persistence counters are written
+as JSON, so runs can be compared. Needs the `websockets` package; CPU and
+memory are read from /proc (Linux).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import websockets
+
+from benchmarks.backplane_fanout import BACKEND, percentile, wait_ready
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def process_tree(pid):
+    # the server and its workers (uvicorn --workers starts child processes)
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    if int(stat.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            pass
+    return total / CLOCK_TICKS
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        self.closed = 0
+        # marker -> send time
+        self.pending = {}
+
+
+class Editor:
+    def __init__(self, url, room, name, document, stats, rng, args):
+        self.url = f"{url}/ws/{room}/{name}"
+        self.name = name
+        self.document = document
+        self.stats = stats
+        self.rng = rng
+        self.args = args
+        self.socket = None
+        self.tasks = []
+
+    async def connect(self):
+        self.socket = await websockets.connect(self.url, max_size=None)
+        self.tasks.append(asyncio.create_task(self.read()))
+
+    def start(self, until):
+        self.tasks.append(asyncio.create_task(self.write_code(until)))
+        if self.args.typing_rate > 0:
+            self.tasks.append(asyncio.create_task(self.write_typing(until)))
+
+    async def read(self):
+        try:
+            async for raw in self.socket:
+                now = time.perf_counter()
+                self.stats.received += 1
+                message = json.loads(raw)
+                if message.get("type") == "CODE_UPDATE" and message.get("sender") not in (self.name, "System"):
+                    code = message.get("code", "")
+                    sent_at = self.stats.pending.get(code[code.rfind("#"):])
+                    if sent_at is not None:
+                        self.stats.latencies.append(now - sent_at)
+        except websockets.ConnectionClosed:
+            self.stats.closed += 1
+
+    async def write_code(self, until):
+        seq = 0
+        while time.perf_counter() < until:
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+            seq += 1
+            marker = f"# {self.name} {seq}\n"
+            self.stats.pending[marker] = time.perf_counter()
+            await self.socket.send(json.dumps({"type": "CODE_UPDATE", "code": self.document + marker}))
+            self.stats.sent += 1
+
+    async def write_typing(self, until):
+        typing = False
+        while time.perf_counter() < until:
+            await asyncio.sleep(self.rng.expovariate(self.args.typing_rate))
+            typing = not typing
+            await self.socket.send(json.dumps({"type": "TYPING_UPDATE", "typing": typing}))
+            self.stats.sent += 1
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await self.socket.close()
+
+
+def fetch_stats(http, path):
+    try:
+        with urllib.request.urlopen(f"{http}{path}", timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+async def sample_rss(pids, peak, stop):
+    while not stop.is_set():
+        peak[0] = max(peak[0], rss_bytes(pids))
+        await asyncio.sleep(0.5)
+
+
+async def run(args, url, pid):
+    rng = random.Random(args.seed)
+    stats = Stats()
+    document = "".join(f"line_{i} = {i}\n" for i in range(max(1, args.doc_size // 12)))
+    editors = [
+        Editor(url, f"load-{r}", f"room{r}-user{e}", document, stats, random.Random(rng.random()), args)
+        for r in range(args.rooms)
+        for e in range(args.editors)
+    ]
+
+    start = time.perf_counter()
+    for i in range(0, len(editors), 50):
+        await asyncio.gather(*(editor.connect() for editor in editors[i:i + 50]))
+    connect_s = time.perf_counter() - start
+    print(f"connected {len(editors)} editors in {args.rooms} rooms in {connect_s:.2f}s")
+    await asyncio.sleep(args.warmup)
+
+    pids = process_tree(pid)
+    peak = [0]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pids, peak, stop))
+    cpu_before = cpu_seconds(pids)
+    stats.sent = stats.received = 0
+    stats.latencies.clear()
+
+    start = time.perf_counter()
+    until = start + args.duration
+    for editor in editors:
+        editor.start(until)
+    await asyncio.sleep(args.duration)
+    # let the last broadcasts arrive before counting
+    await asyncio.sleep(1.0)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(pids) - cpu_before
+    stop.set()
+    await sampler
+
+    http = url.replace("ws://", "http://")
+    latencies = stats.latencies or [0.0]
+    results = {
+        "editors": len(editors),
+        "connect_s": round(connect_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "sent": stats.sent,
+        "received": stats.received,
+        "sent_per_s": round(stats.sent / elapsed, 1),
+        "received_per_s": round(stats.received / elapsed, 1),
+        "latency_samples": len(stats.latencies),
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "latency_max_ms": round(max(latencies) * 1000, 3),
+        "server_cpu_percent": round(cpu / elapsed * 100, 1),
+        "server_rss_peak_mb": round(peak[0] / 1024 / 1024, 1),
+        "server_processes": len(pids),
+        "closed_sockets": stats.closed,
+        "server_inbound": fetch_stats(http, "/stats/inbound"),
+        "server_persistence": fetch_stats(http, "/stats/persistence"),
+    }
+    for editor in editors:
+        await editor.close()
+    return results
+
+
+def start_server(args, port, workdir):
+    env = dict(os.environ, **dict(pair.split("=", 1) for pair in args.server_env))
+    env["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    env.setdefault("DB_CREATE_SCHEMA", "true")
+    if args.in_process:
+        os.environ.update(env)
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config("app.main:app", port=port, log_level="warning", ws_max_size=64 * 1024 * 1024))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        wait_ready(port)
+        return server, os.getpid()
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND,
+        env=env,
+    )
+    wait_ready(port)
+    return process, process.pid
+
+
+def stop_server(args, server):
+    if args.in_process:
+        server.should_exit = True
+        time.sleep(1)
+    else:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--editors", type=int, default=5, help="editors per room")
+    parser.add_argument("--rate", type=float, default=2.0, help="CODE_UPDATEs per second per editor")
+    parser.add_argument("--typing-rate", type=float, default=1.0, help="TYPING_UPDATEs per second per editor, 0 for none")
+    parser.add_argument("--doc-size", type=int, default=2000, help="characters per document")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=8950)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--in-process", action="store_true", help="run uvicorn in this process instead of a subprocess")
+    parser.add_argument("--url", help="ws://host:port of a server that is already running")
+    parser.add_argument("--database-url", help="e.g. postgresql://localhost/pair, default a temporary SQLite file")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="extra settings for the server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write parameters and results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = None
+        if args.url:
+            url, pid = args.url.rstrip("/"), None
+        else:
+            server, pid = start_server(args, args.port, workdir)
+            url = f"ws://127.0.0.1:{args.port}"
+        try:
+            results = asyncio.run(run(args, url, pid or os.getpid()))
+        finally:
+            if server is not None:
+                stop_server(args, server)
+
+    print(
+        f"{results['sent_per_s']} msg/s sent, {results['received_per_s']} msg/s received"
+        f"  broadcast p50 {results['latency_p50_ms']} ms  p99 {results['latency_p99_ms']} ms"
+        f"  max {results['latency_max_ms']} ms  over {results['latency_samples']} deliveries"
+    )
+    print(f"server cpu {results['server_cpu_percent']}%  peak rss {results['server_rss_peak_mb']} MB")
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump({"time": time.time(), "parameters": vars(args), "results": results}, out, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Room state against a soft memory target, with thousands of rooms in one process.
+
+    python -m benchmarks.room_memory --rooms 5000 --size 20000 --budget-mb 32
+
+Opens --rooms rooms one after another through ConnectionManager with an
+in-memory socket, with the in-process backplane. Each room gets a document
+of --size characters and a few edits, then its socket leaves. The closed room
+stays as a cold copy in RoomStore until the target is reached. Reports the
+accounted bytes and the process RSS as rooms pile up, and fails if the
+accounting goes over --budget-mb (closed rooms are evicted, so it must not).
+
+It then reopens the newest and the oldest rooms (cold copies hit against
+evicted ones). Finally it keeps --live rooms open, lets them go idle and runs a
+memory check, to show the trim of live rooms. Live documents are never
+evicted, so those rooms can remain over the target after the trim. Room code is checkpointed into
+a throwaway SQLite database, as in the app.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.revision_storage import sample_document
+
+
+async def settle():
+    # the room tasks close and store their rooms a few loop turns after the last leave
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def mib(n):
+    return f"{n / 1024 / 1024:8.1f} MiB"
+
+
+async def open_room(manager, room_id, username, code):
+    from benchmarks.connection_memory import IdleSocket
+
+    socket = IdleSocket()
+    await manager.connect(room_id, socket, username, delta=True)
+    await manager.open_room(room_id, socket, code, [username])
+    return socket
+
+
+async def run(args):
+    # the app reads its settings on import, so the database is picked first
+    from app.core.migrations import create_schema
+    from app.services.room_store import rss_bytes
+    from app.services.websocket_manager import ConnectionManager
+
+    await create_schema()
+
+    rng = random.Random(args.seed)
+    manager = ConnectionManager()
+    store = manager.store
+    store.budget = args.budget_mb * 1024 * 1024
+    base = sample_document(rng, args.size)
+
+    def room_code(i):
+        # every room gets its own copy of the text, as documents loaded from the DB would
+        return f"# room-{i}\n" + base + "".join(f"x_{edit} = {i}\n" for edit in range(args.edits))
+
+    # RSS is unknown where neither /proc nor resource is available
+    rss_before = rss_bytes() or 0
+    peak_accounted = 0
+    start = time.perf_counter()
+    print(f"{args.rooms} rooms of {args.size} characters, budget {mib(store.budget)}")
+    for i in range(args.rooms):
+        room_id = f"room-{i}"
+        code = room_code(i)
+        socket = await open_room(manager, room_id, "user", code[:len(code) - len(f"x_0 = {i}\n") * args.edits])
+        for edit in range(args.edits):
+            await manager.broadcast_code(room_id, code[:len(code) - len(f"x_0 = {i}\n") * (args.edits - edit - 1)], socket)
+        await settle()
+        await manager.disconnect(room_id, socket)
+        await settle()
+
+        accounted = store.live_bytes + store.cold_bytes
+        peak_accounted = max(peak_accounted, accounted)
+        assert accounted <= store.budget, f"accounted {accounted} bytes, over the {store.budget} byte budget"
+        if (i + 1) % args.report_every == 0:
+            print(
+                f"  {i + 1:6} rooms  cold {len(store.cold):6}  accounted {mib(accounted)}"
+                f"  rss +{mib((rss_bytes() or 0) - rss_before)}  evictions {store.evictions}"
+            )
+    await manager.flusher.flush(force=True)
+    print(f"  opened and closed in {time.perf_counter() - start:.1f}s, peak accounted {mib(peak_accounted)}")
+
+    # reopen: the newest rooms still have cold copies, the oldest were evicted
+    for label, numbers in (("newest", range(args.rooms - args.reopen, args.rooms)), ("oldest", range(args.reopen))):
+        hits = store.rehydrated
+        start = time.perf_counter()
+        for i in numbers:
+            room_id = f"room-{i}"
+            socket = await open_room(manager, room_id, "again", room_code(i))
+            await settle()
+            version = manager.get_version(room_id)
+            assert manager.get_code(room_id) == room_code(i), f"{room_id} reopened with different code"
+            await manager.disconnect(room_id, socket)
+            await settle()
+        elapsed = (time.perf_counter() - start) / len(numbers) * 1000
+        print(f"  reopened {len(numbers)} {label} rooms: {store.rehydrated - hits} from cold copies, last version {version}, {elapsed:.2f} ms/room")
+
+    # live rooms idle past ROOM_IDLE_SECONDS are trimmed once the budget is exceeded
+    sockets = {}
+    for i in range(args.live):
+        room_id = f"live-{i}"
+        sockets[room_id] = await open_room(manager, room_id, "user", f"# {room_id}\n" + base)
+        for edit in range(args.edits):
+            await manager.broadcast_code(room_id, f"# {room_id}\n" + base + f"y = {edit}\n", sockets[room_id])
+    await settle()
+    for room in manager.rooms.values():
+        manager.room_symbols(room.room_id)
+        room.snapshot()
+    before = sum(room.footprint()["total"] for room in manager.rooms.values())
+    store.budget = max(1, before // 2)
+    store.idle_seconds = 0
+    store.check()
+    await settle()
+    after = sum(room.footprint()["total"] for room in manager.rooms.values())
+    print(
+        f"  {args.live} idle live rooms: {mib(before)} before the check, {mib(after)} after trimming {store.trims}"
+        f" (target {mib(store.budget)}, {'still over' if store.over_budget else 'within'})"
+    )
+    for room_id, socket in sockets.items():
+        await manager.disconnect(room_id, socket)
+    await settle()
+    await manager.flusher.flush(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=20000, help="characters per document")
+    parser.add_argument("--edits", type=int, default=3, help="edits per room before it closes")
+    parser.add_argument("--budget-mb", type=int, default=32)
+    parser.add_argument("--reopen", type=int, default=100)
+    parser.add_argument("--live", type=int, default=200)
+    parser.add_argument("--report-every", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'rooms.db')}"
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
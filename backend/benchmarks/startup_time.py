@@ -0,0 +1,103 @@
+"""Cold start of the app: process start to first request.
+
+    python -m benchmarks.startup_time --runs 5
+
+Prepares a throwaway SQLite database once with `python -m app.core.migrations`,
+then for each run starts a fresh interpreter twice:
+
+  import    `import app.main` alone, with no DATABASE_URL set: the app
+            imports without a database and loads no driver until first use
+  serve     uvicorn on `app.main:app`, timed from the process start until
+            GET /stats/startup answers (first request), and until the
+            background warm-ups (pool connections, autocomplete index)
+            have reported in
+
+Serving runs once with the schema already in place and once with
+DB_CREATE_SCHEMA=true, which checks the schema on every start. Reported
+figures are medians over --runs, plus the server's own startup_ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.backplane_fanout import BACKEND
+
+IMPORT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+
+def time_import():
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", IMPORT], cwd=BACKEND, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1]), time.perf_counter() - start
+
+
+def get_startup(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats/startup", timeout=1) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+def time_serve(port, env, timeout=30.0):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        first = warm = None
+        while time.perf_counter() - start < timeout:
+            startup = get_startup(port)
+            now = time.perf_counter()
+            if startup is not None:
+                first = first or now - start
+                if "pool_warmed_ms" in startup and "index_built_ms" in startup:
+                    warm = now - start
+                    return first, warm, startup
+            time.sleep(0.005)
+        raise RuntimeError(f"server on port {port} did not start")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8970)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'rooms.db')}")
+        subprocess.run([sys.executable, "-m", "app.core.migrations"], cwd=BACKEND, env=env, check=True, capture_output=True)
+
+        imports = [time_import() for _ in range(args.runs)]
+        print(f"medians over {args.runs} runs")
+        print(
+            f"  import app.main, no DATABASE_URL: {statistics.median(i for i, _ in imports) * 1000:.0f} ms"
+            f" (interpreter start included: {statistics.median(t for _, t in imports) * 1000:.0f} ms)"
+        )
+        print(f"  {'schema':<14} {'first request ms':>17} {'warmed ms':>10} {'startup_ms':>11} {'pool ms':>8} {'index ms':>9}")
+        for label, create in (("migrated", "false"), ("DB_CREATE_SCHEMA", "true")):
+            runs = [time_serve(args.port, dict(env, DB_CREATE_SCHEMA=create)) for _ in range(args.runs)]
+            print(
+                f"  {label:<14} {statistics.median(r[0] for r in runs) * 1000:>17.0f}"
+                f" {statistics.median(r[1] for r in runs) * 1000:>10.0f}"
+                f" {statistics.median(r[2]['startup_ms'] for r in runs):>11.1f}"
+                f" {statistics.median(r[2]['pool_warmed_ms'] for r in runs):>8.1f}"
+                f" {statistics.median(r[2]['index_built_ms'] for r in runs):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Bandwidth and CPU of the wire formats, per message kind and document size.
+
+    python -m benchmarks.wire_encoding --sizes 1024,10240,102400,1048576
+
+For a join snapshot (CODE_UPDATE with the whole document), a small CODE_DELTA
+and a USER_UPDATE, compares the JSON text protocol with the binary frames of
+?features=binary: JSON or MessagePack, with and without deflate. Reports the
+bytes on the wire, and the encode and decode time per message. A broadcast
+encodes once per room, and every recipient decodes it. Documents are
+generated Python source, which compresses like real code. MessagePack rows
+need `pip install msgpack`.
+"""
+import argparse
+import random
+import time
+
+from app.core import serialization
+
+SNIPPETS = [
+    "def {name}(self, {arg}):\n    return self.{arg}_{n} + {n}\n\n",
+    "class {Name}:\n    __slots__ = (\"{arg}\", \"{name}\")\n\n",
+    "    for {arg} in range({n}):\n        {name}.append({arg} * {n})\n",
+    "# {name}: keep {arg} below {n}\n",
+    "    if {arg} is None:\n        raise ValueError(\"{name} needs {arg}\")\n",
+    "{name} = {{\"{arg}\": {n}, \"limit\": {n}}}\n",
+]
+WORDS = ["room", "user", "version", "delta", "frame", "queue", "presence", "socket", "snapshot", "cursor"]
+
+
+def sample_document(size, seed):
+    rng = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}"
+        part = rng.choice(SNIPPETS).format(name=name, Name=name.title().replace("_", ""), arg=rng.choice(WORDS), n=rng.randint(0, 999))
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)[:size]
+
+
+def messages(size, seed):
+    users = [{"username": f"user{i}", "online": i < 3, "typing": i == 0} for i in range(5)]
+    return [
+        ("snapshot", {"type": "CODE_UPDATE", "code": sample_document(size, seed), "version": 1200}),
+        ("delta", {"type": "CODE_DELTA", "version": 1201, "ops": [{"pos": size // 2, "delete": 1, "insert": "self.room"}], "sender": "user1"}),
+        ("users", {"type": "USER_UPDATE", "users": users}),
+    ]
+
+
+def measure(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def run_case(message, fmt, repeat):
+    if fmt == "json text":
+        text, encode_s = measure(lambda: serialization.Frame(message).text, repeat)
+        size = len(text.encode("utf-8"))
+        decoded, decode_s = measure(lambda: serialization.loads(text), repeat)
+    else:
+        data, encode_s = measure(lambda: serialization.pack(message), repeat)
+        size = len(data)
+        decoded, decode_s = measure(lambda: serialization.unpack(data, 64 * 1024 * 1024), repeat)
+    assert decoded == message, f"{fmt} did not round-trip"
+    return size, encode_s, decode_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1024,10240,102400,1048576", help="document sizes in characters")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--level", type=int, default=1, help="deflate level")
+    parser.add_argument("--compress-min", type=int, default=1024, help="deflate payloads of at least this many bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # format -> (binary encoding, compress from this many bytes, 0 never)
+    formats = {"json text": None, "binary json": ("json", 0), "binary json+deflate": ("json", args.compress_min)}
+    if serialization.msgpack is not None:
+        formats["msgpack"] = ("msgpack", 0)
+        formats["msgpack+deflate"] = ("msgpack", args.compress_min)
+    else:
+        print("msgpack is not installed, skipping the MessagePack rows")
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"\n{size // 1024} KB document ({serialization.backend_name} backend)")
+        print(f"  {'message':<9} {'format':<20} {'bytes':>10} {'ratio':>7} {'encode us':>11} {'decode us':>11}")
+        for kind, message in messages(size, args.seed):
+            baseline = None
+            repeat = max(3, args.repeat * 10240 // max(size, 10240)) if kind == "snapshot" else args.repeat * 20
+            for fmt, binary in formats.items():
+                if binary:
+                    serialization.use_binary(binary[0], binary[1], args.level)
+                wire, encode_s, decode_s = run_case(message, fmt, repeat)
+                baseline = baseline or wire
+                print(f"  {kind:<9} {fmt:<20} {wire:>10} {wire / baseline:>7.2f} {encode_s * 1e6:>11.1f} {decode_s * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
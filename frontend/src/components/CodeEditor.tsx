@@ -42,7 +42,7 @@ const CodeEditor: React.FC = () => {
 
   });
 
-  const { init: initAutocomplete, fetchSuggestions } = useAutocomplete();
+  const { init: initAutocomplete, fetchSuggestions } = useAutocomplete(roomId);
 
   const { handleEdit, clear } = useDebouncedTyping(
     (isTyping) => sendTyping(isTyping),
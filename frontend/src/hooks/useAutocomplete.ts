@@ -3,11 +3,26 @@ import debounce from "lodash.debounce";
 
 const BACKEND_HTTP_BASE = process.env.REACT_APP_BACKEND_HTTP;
 
-export function useAutocomplete() {
+export function useAutocomplete(roomId?: string) {
   const suggestionsRef = useRef<string[]>([]);
   const monacoRef = useRef<any | null>(null);
   
   const providerDisposableRef = useRef<any>(null);
+  // read by the editor command, which is registered once per editor
+  const roomIdRef = useRef(roomId);
+  roomIdRef.current = roomId;
+
+  // only a picked suggestion counts as a use, ranking it higher in this room
+  const reportAccept = useCallback((word: string) => {
+    if (!roomIdRef.current || !word) return;
+    fetch(`${BACKEND_HTTP_BASE}/autocomplete/accept`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ roomId: roomIdRef.current, word }),
+    }).catch((err) => {
+      if (process.env.REACT_APP_BACKEND_HTTP) console.error("autocomplete accept error", err);
+    });
+  }, []);
 
 // Wrap the logic in useCallback to make it stable
   const fetchSuggestionsInner = useCallback(async (word: string) => {
@@ -24,11 +39,16 @@ export function useAutocomplete() {
           code: word,
           cursorPosition: word.length,
           language: "python",
+          roomId,
         }),
       });
 
       const data = await res.json();
-      suggestionsRef.current = data?.suggestion ? [data.suggestion] : [];
+      suggestionsRef.current = data?.suggestions?.length
+        ? data.suggestions
+        : data?.suggestion
+        ? [data.suggestion]
+        : [];
 
       // Force suggest popup if monaco is present
       const editor = monacoRef.current?.editorInstance;
@@ -39,7 +59,7 @@ export function useAutocomplete() {
       suggestionsRef.current = [];
       if (process.env.REACT_APP_BACKEND_HTTP) console.error("autocomplete error", err);
     }
-  }, []); // Dependencies are empty because refs are stable
+  }, [roomId]); // refs are stable, only the room changes the request
   const fetchSuggestions = useMemo(
     () => debounce(fetchSuggestionsInner, 400),
     [fetchSuggestionsInner] 
@@ -53,6 +73,9 @@ export function useAutocomplete() {
       providerDisposableRef.current.dispose();
     }
 
+    // keybinding 0: reachable only as the command of an accepted completion item
+    const acceptCommand = editorInstance.addCommand(0, (_accessor: any, word: string) => reportAccept(word), "");
+
     providerDisposableRef.current = monaco.languages.registerCompletionItemProvider("python", {
       triggerCharacters: ["_", ".", " "],
       provideCompletionItems: (model: any, position: any) => {
@@ -77,11 +100,12 @@ export function useAutocomplete() {
             kind: monaco.languages.CompletionItemKind.Text,
             insertText: s,
             range,
+            command: acceptCommand ? { id: acceptCommand, title: "Accept suggestion", arguments: [s] } : undefined,
           })),
         };
       },
     });
-  }, []);
+  }, [reportAccept]);
 
   useEffect(() => {
     return () => {